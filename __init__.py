@@ -46,6 +46,7 @@ if "bpy" in locals():
     imp.reload( util)
     imp.reload( preferences)
     imp.reload( project_file_writer)
+    imp.reload( export_state)
     
 else:
     import bpy
@@ -57,6 +58,7 @@ else:
     from . import util
     from . import preferences
     from . import project_file_writer
+    from . import export_state
 
 import bpy, bl_ui, bl_operators
 import math, mathutils
@@ -71,6 +73,7 @@ def register():
     export.register()
     ui.register()
     preferences.register()
+    export_state.register()
     bpy.utils.register_module( __name__)
 
 def unregister():
@@ -79,4 +82,5 @@ def unregister():
     export.unregister()
     ui.unregister()
     preferences.unregister()
+    export_state.unregister()
     bpy.utils.unregister_module( __name__)
@@ -0,0 +1,67 @@
+#
+# This source file is part of appleseed.
+# Visit http://appleseedhq.net/ for additional information and resources.
+#
+# This software is released under the MIT license.
+#
+# Copyright (c) 2013 Franz Beaune, Joel Daniels, Esteban Tovagliari.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+#
+# Compare the float precision modes of the mesh encoder: bytes written and
+# encode time per million vertices. Runs outside of Blender:
+#
+#   python benchmarks/bench_float_encoder.py [num_vertices]
+#
+
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath( __file__))))
+import mesh_encoder
+
+def make_vertices( num_vertices):
+    random = np.random.RandomState( 0)
+    return random.uniform( -10.0, 10.0, ( num_vertices, 3)).astype( np.float32)
+
+def format_python( values):
+    # The per-vertex loop used by mesh_writer.write_mesh_to_disk().
+    return ('').join( [ "v %.15f %.15f %.15f\n" % ( v[0], v[1], v[2]) for v in values.tolist()])
+
+def run( name, encode, values):
+    start = time.time()
+    text = encode( values)
+    elapsed = time.time() - start
+    scale = 1000000.0 / len( values)
+    print( "%-12s %8.1f MB/M verts %8.3f s/M verts" % ( name, len( text) * scale / 1e6, elapsed * scale))
+
+def main():
+    num_vertices = int( sys.argv[1]) if len( sys.argv) > 1 else 1000000
+    values = make_vertices( num_vertices)
+    run( "python", format_python, values)
+    for precision, digits in (( 'double', 15), ( 'fixed', 6), ( 'fixed', 4), ( 'float32', 0)):
+        name = precision if precision != 'fixed' else "fixed %d" % digits
+        run( name, lambda v: ('').join( mesh_encoder.iter_rows( "v %f %f %f\n", v, 65536, precision, digits)), values)
+
+if __name__ == "__main__":
+    main()
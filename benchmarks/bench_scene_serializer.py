@@ -0,0 +1,70 @@
+#
+# This source file is part of appleseed.
+# Visit http://appleseedhq.net/ for additional information and resources.
+#
+# This software is released under the MIT license.
+#
+# Copyright (c) 2013 Franz Beaune, Joel Daniels, Esteban Tovagliari.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+
+#
+# Serialize a synthetic scene IR with the scene serializer: nodes written per
+# second and XML size. Runs outside of Blender:
+#
+#   python benchmarks/bench_scene_serializer.py [num_instances]
+#
+
+import io
+import os
+import sys
+import time
+
+sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath( __file__))))
+import scene_ir
+import scene_serializer
+import xml_emitter
+
+def make_nodes( num_instances):
+    rows = (( 1.0, 0.0, 0.0, 0.0), ( 0.0, 1.0, 0.0, 0.0), ( -0.0, -0.0, -1.0, -0.0), ( 0.0, 0.0, 0.0, 1.0))
+    nodes = [scene_ir.Color( "material_color", "linear_rgb", [0.8, 0.8, 0.8]),
+             scene_ir.Entity( "material", "material", "generic_material", [( "bsdf", "material_bsdf"),
+                                                                         ( "surface_shader", "physical_surface_shader")])]
+    for i in range( num_instances):
+        object_name = "object_%d.part_0" % i
+        nodes.append( scene_ir.Entity( "object", object_name, "mesh_object", [( "filename", "meshes/object_%d.binarymesh" % i)]))
+        nodes.append( scene_ir.ObjectInstance( object_name + ".instance_0", object_name, [scene_ir.Transform( rows)],
+                                               "material", "material"))
+    return nodes
+
+def main():
+    num_instances = int( sys.argv[1]) if len( sys.argv) > 1 else 100000
+    nodes = make_nodes( num_instances)
+    output_file = io.BytesIO()
+    start = time.time()
+    emitter = xml_emitter.XmlEmitter( output_file)
+    scene_serializer.write_all( emitter, nodes)
+    emitter.flush()
+    elapsed = time.time() - start
+    print( "%d nodes %12.0f nodes/s %8.1f MB" % ( len( nodes), len( nodes) / elapsed, len( output_file.getvalue()) / 1e6))
+
+if __name__ == "__main__":
+    main()
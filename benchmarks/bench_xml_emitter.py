@@ -0,0 +1,110 @@
+#
+# This source file is part of appleseed.
+# Visit http://appleseedhq.net/ for additional information and resources.
+#
+# This software is released under the MIT license.
+#
+# Copyright (c) 2013 Franz Beaune, Joel Daniels, Esteban Tovagliari.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+
+#
+# Compare the per-line file writes of the project file writer with the
+# buffered XML emitter: elements written per second. Runs outside of Blender:
+#
+#   python benchmarks/bench_xml_emitter.py [num_elements]
+#
+
+import os
+import sys
+import time
+import tempfile
+
+sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath( __file__))))
+import xml_emitter
+
+class LineWriter( object):
+    # The writer used by write_project_file before the emitter: two file writes per line.
+    def __init__( self, output_file):
+        self._output_file = output_file
+        self._indent = 0
+
+    def open_element( self, name):
+        self.emit_line( "<" + name + ">")
+        self._indent += 1
+
+    def close_element( self, name):
+        self._indent -= 1
+        self.emit_line( "</" + name + ">")
+
+    def emit_line( self, line):
+        self._output_file.write( " " * self._indent * 4)
+        self._output_file.write( line + "\n")
+
+    def flush( self):
+        pass
+
+def emit_parameter_concat( writer, name, value):
+    writer.emit_line( "<parameter name=\"" + name + "\" value=\"" + str( value) + "\" />")
+
+def emit_parameter_format( writer, name, value):
+    writer.emit_line( '<parameter name="%s" value="%s" />' % ( name, value))
+
+def emit_instances( writer, emit_parameter, num_elements):
+    # Object instances as written by __emit_mesh_object_instance().
+    writer.open_element( "assembly name=\"scene\"")
+    for i in range( num_elements):
+        writer.open_element( "object_instance name=\"object_%d.part_0_inst\" object=\"object_%d.part_0\"" % ( i, i))
+        emit_parameter( writer, "ray_bias_method", "normal")
+        writer.open_element( "transform")
+        writer.open_element( "matrix")
+        for row in range( 4):
+            writer.emit_line( "1.000000000000000 0.000000000000000 0.000000000000000 0.000000000000000")
+        writer.close_element( "matrix")
+        writer.close_element( "transform")
+        writer.emit_line( "<assign_material slot=\"0\" side=\"front\" material=\"material\" />")
+        writer.emit_line( "<assign_material slot=\"0\" side=\"back\" material=\"material\" />")
+        writer.close_element( "object_instance")
+    writer.close_element( "assembly")
+    writer.flush()
+
+def run( name, make_writer, emit_parameter, num_elements, mode, repeats = 5):
+    fd, file_path = tempfile.mkstemp( suffix = ".appleseed")
+    os.close( fd)
+    try:
+        elapsed = []
+        for i in range( repeats):
+            with open( file_path, mode) as output_file:
+                start = time.time()
+                emit_instances( make_writer( output_file), emit_parameter, num_elements)
+                elapsed.append( time.time() - start)
+        size = os.path.getsize( file_path)
+    finally:
+        os.remove( file_path)
+    print( "%-12s %12.0f elements/s %8.1f MB" % ( name, num_elements / min( elapsed), size / 1e6))
+
+def main():
+    num_elements = int( sys.argv[1]) if len( sys.argv) > 1 else 50000
+    run( "per-line", LineWriter, emit_parameter_concat, num_elements, "w")
+    run( "buffered", xml_emitter.XmlEmitter, emit_parameter_format, num_elements, "wb")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,344 @@
+#
+# This source file is part of appleseed.
+# Visit http://appleseedhq.net/ for additional information and resources.
+#
+# This software is released under the MIT license.
+#
+# Copyright (c) 2013 Franz Beaune, Joel Daniels, Esteban Tovagliari.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+
+import bpy
+import hashlib
+import os
+from bpy.app.handlers   import persistent
+from .                  import mesh_writer
+
+#--------------------------------------------------------------------------------------------------
+# State kept between exports.
+#--------------------------------------------------------------------------------------------------
+
+class ExportState( object):
+    '''
+    What previous exports computed about the objects of the open file, and the objects
+    whose data changed since then, as reported by Blender's scene update handler.
+    Objects that did not change are not evaluated again by the next export, and
+    projects exported from an unchanged scene are not exported again.
+    '''
+    def __init__( self):
+        # Object name -> ( frame, salt, fingerprint).
+        self._fingerprints = {}
+        self._dirty_objects = set()
+        # Incremented whenever a datablock used by the scene changes.
+        self._generation = 0
+        # Project file path -> ( file stat, scene key, settings key) of its last export.
+        self._projects = {}
+        # Set while exporting: the export's own frame changes are not edits.
+        self._exporting = False
+        # Material name -> ( material generation, context, key, fragment).
+        self._materials = {}
+        # Incremented whenever a material, texture, image or node tree changes.
+        self._material_generation = 0
+
+    def clear( self):
+        self._fingerprints = {}
+        self._dirty_objects = set()
+        self._generation += 1
+        self._projects = {}
+        self._materials = {}
+        self._material_generation += 1
+
+    def tag_objects( self, object_names):
+        self._dirty_objects.update( object_names)
+
+    def tag_data( self, updated):
+        if updated and not self._exporting:
+            self._generation += 1
+
+    def tag_materials( self):
+        self._material_generation += 1
+
+    def flush_updates( self, scene):
+        '''
+        Evaluate the pending changes of the scene, which runs the update handler.
+        '''
+        scene.update()
+
+    def begin_export( self, scene):
+        '''
+        Ignore the updates made by the export until finish_export(). The edits made before are counted first.
+        '''
+        self.flush_updates( scene)
+        self._exporting = True
+
+    def finish_export( self, scene):
+        '''
+        Stop ignoring updates once those left pending by the export are evaluated.
+        '''
+        try:
+            self.flush_updates( scene)
+        finally:
+            self._exporting = False
+
+    def end_export( self, file_path, scene):
+        '''
+        Record the state of the scene a project file was exported or patched from.
+        '''
+        if is_tracking():
+            self._projects[file_path] = ( _get_file_stat( file_path), self.get_scene_key( scene), get_settings_key( scene))
+
+    def get_changes( self, file_path, scene):
+        '''
+        Return what changed since the project file was last exported:
+        'none', 'settings' if only render settings changed, or 'scene'.
+        '''
+        keys = self._projects.get( file_path)
+        if keys is None or keys[0] != _get_file_stat( file_path) or keys[1] != self.get_scene_key( scene):
+            return 'scene'
+        return 'none' if keys[2] == get_settings_key( scene) else 'settings'
+
+    def get_scene_key( self, scene):
+        '''
+        Key of everything but the render settings that goes into the project file.
+        Edits of objects and other datablocks are counted by the update handler.
+        '''
+        digest = hashlib.sha1()
+        digest.update( repr( ( self._generation, scene.name, scene.frame_current, scene.frame_subframe,
+                               scene.camera.name if scene.camera else None,
+                               scene.world.name if scene.world else None,
+                               tuple( scene.layers))).encode( "utf8"))
+        # Linked and unlinked objects.
+        for ob in scene.objects:
+            digest.update( ob.name.encode( "utf8"))
+        _hash_struct( digest, scene.appleseed, SettingsProperties)
+        _hash_struct( digest, scene.appleseed_sky)
+        return digest.hexdigest()
+
+    def get_fingerprint( self, ob, scene, salt):
+        '''
+        Return mesh_writer.get_object_fingerprint() for the object, reusing the value
+        of the previous export if the object did not change since then.
+        '''
+        frame = ( scene.frame_current, scene.frame_subframe)
+        entry = self._fingerprints.get( ob.name)
+        if entry is not None and entry[0] == frame and entry[1] == salt and ob.name not in self._dirty_objects:
+            return entry[2]
+        fingerprint = mesh_writer.get_object_fingerprint( ob, salt)
+        if is_tracking():
+            self._fingerprints[ob.name] = ( frame, salt, fingerprint)
+            self._dirty_objects.discard( ob.name)
+        return fingerprint
+
+    def get_material( self, material, scene):
+        '''
+        Return the fragment stored for the material by a previous export or assembly,
+        or None if the material or one of its textures changed since then.
+        '''
+        entry = self._materials.get( material.name)
+        if entry is None:
+            return None
+        context = _get_material_context( scene)
+        if entry[1] != context:
+            return None
+        if entry[0] == self._material_generation and is_tracking():
+            return entry[3]
+        # Something changed, possibly not this material.
+        key = get_material_key( material, scene)
+        if entry[2] != key:
+            return None
+        self._materials[material.name] = ( self._material_generation, context, key, entry[3])
+        return entry[3]
+
+    def store_material( self, material, scene, fragment):
+        self._materials[material.name] = ( self._material_generation, _get_material_context( scene),
+                                           get_material_key( material, scene), fragment)
+
+_state = ExportState()
+
+#--------------------------------------------------------------------------------------------------
+# Render settings.
+#--------------------------------------------------------------------------------------------------
+
+# Scene settings that are only written to the configurations, or only used to launch appleseed.
+SettingsProperties = { 'decorrelate_pixels', 'display_mode', 'dl_light_samples', 'enable_diagnostics', 'filter_size',
+                       'force_aa', 'ibl_enable', 'ibl_env_samples', 'img_extension', 'lighting_engine', 'max_bounces',
+                       'max_ray_intensity', 'next_event_est', 'pixel_filter', 'pixel_sampler', 'premult_alpha', 'quality',
+                       'refresh_time', 'renderer_passes', 'rr_start', 'sampler_max_contrast', 'sampler_max_samples',
+                       'sampler_max_variation', 'sampler_min_samples', 'caustics_enable', 'direct_lighting',
+                       'sppm_alpha', 'sppm_dl_mode', 'sppm_env_photons', 'sppm_initial_radius', 'sppm_light_photons',
+                       'sppm_max_per_estimate', 'sppm_photon_max_length', 'sppm_photon_rr_start', 'sppm_photons_per_pass',
+                       'sppm_pt_max_length', 'sppm_pt_rr_start', 'studio_rendering_mode', 'threads', 'tile_ordering'}
+
+# Render properties of the frame, which also change the camera.
+FrameProperties = ( 'resolution_x', 'resolution_y', 'resolution_percentage', 'pixel_aspect_x', 'pixel_aspect_y',
+                    'use_border', 'border_min_x', 'border_min_y', 'border_max_x', 'border_max_y')
+
+def get_settings_key( scene):
+    '''
+    Key of the render settings: the configurations, the frame and the camera parameters
+    that depend on the resolution.
+    '''
+    appleseed = scene.appleseed
+    render = scene.render
+    return repr( ( [getattr( appleseed, name) for name in sorted( SettingsProperties)],
+                   [getattr( render, name) for name in FrameProperties],
+                   scene.get( "color_space")))
+
+#--------------------------------------------------------------------------------------------------
+# Materials.
+#--------------------------------------------------------------------------------------------------
+
+def _get_material_context( scene):
+    # Scene settings written into the materials.
+    return scene.appleseed.export_emitting_obj_as_lights, scene.appleseed.light_mats_radiance_multiplier
+
+def get_material_key( material, scene):
+    '''
+    Key of everything written for the material: its appleseed properties, its node tree
+    and the textures they name.
+    '''
+    digest = hashlib.sha1()
+    digest.update( repr( ( material.name, _get_material_context( scene))).encode( "utf8"))
+    strings = []
+    asr_mat = material.appleseed
+    _hash_struct( digest, asr_mat, strings = strings)
+
+    node_tree = bpy.data.node_groups.get( asr_mat.node_tree) if asr_mat.node_tree != "" else None
+    if node_tree is not None:
+        node_skip, socket_skip = _get_node_skip()
+        for node in node_tree.nodes:
+            # Node names include the node pointer.
+            digest.update( repr( ( node.name, node.bl_idname, node.as_pointer())).encode( "utf8"))
+            _hash_struct( digest, node, node_skip, strings)
+            for socket in node.inputs:
+                digest.update( repr( ( socket.identifier, socket.is_linked)).encode( "utf8"))
+                _hash_struct( digest, socket, socket_skip, strings)
+        for link in node_tree.links:
+            digest.update( repr( ( link.from_node.name, link.from_socket.identifier,
+                                   link.to_node.name, link.to_socket.identifier)).encode( "utf8"))
+
+    # Textures are named by string properties.
+    textures = bpy.data.textures
+    for name in sorted( set( strings)):
+        texture = textures.get( name)
+        if texture is None:
+            continue
+        image = texture.image if texture.type == 'IMAGE' else None
+        digest.update( repr( ( name, texture.type,
+                               image.filepath if image else None,
+                               image.colorspace_settings.name if image else None)).encode( "utf8"))
+    return digest.hexdigest()
+
+_node_skip = None
+
+def _get_node_skip():
+    # Properties common to all nodes and sockets: links, locations and other drawing state.
+    global _node_skip
+    if _node_skip is None:
+        _node_skip = ( set( prop.identifier for prop in bpy.types.Node.bl_rna.properties),
+                       set( prop.identifier for prop in bpy.types.NodeSocket.bl_rna.properties))
+    return _node_skip
+
+def _get_file_stat( file_path):
+    # Size and modification time, None if the file does not exist.
+    try:
+        stat = os.stat( file_path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+def _hash_struct( digest, struct, skip = (), strings = None):
+    # Hash the property values of a property group, following nested groups and collections.
+    # String values are also added to strings if given.
+    for prop in struct.bl_rna.properties:
+        identifier = prop.identifier
+        if identifier == 'rna_type' or identifier in skip:
+            continue
+        value = getattr( struct, identifier)
+        if prop.type == 'POINTER':
+            if isinstance( value, bpy.types.ID):
+                value = value.name
+            elif value is not None:
+                _hash_struct( digest, value, strings = strings)
+                continue
+        elif prop.type == 'COLLECTION':
+            for item in value:
+                _hash_struct( digest, item, strings = strings)
+            continue
+        elif prop.type == 'STRING' and strings is not None:
+            strings.append( value)
+        elif prop.type in { 'BOOLEAN', 'INT', 'FLOAT'} and prop.array_length > 0:
+            value = tuple( value)
+        elif prop.type == 'ENUM' and prop.is_enum_flag:
+            value = sorted( value)
+        digest.update( repr( ( identifier, value)).encode( "utf8"))
+
+def get_state():
+    return _state
+
+def is_tracking():
+    '''
+    Scene update handlers do not run for changes made by scripts in background mode.
+    '''
+    return not bpy.app.background
+
+#--------------------------------------------------------------------------------------------------
+# Update handlers.
+#--------------------------------------------------------------------------------------------------
+
+# Datablocks whose changes are written to the project file.
+DataCollections = ( 'objects', 'meshes', 'curves', 'metaballs', 'materials', 'textures', 'images', 'lamps', 'cameras',
+                    'worlds', 'node_groups', 'groups', 'particles')
+
+# Datablocks whose changes are written to the materials.
+MaterialCollections = { 'materials', 'textures', 'images', 'node_groups'}
+
+@persistent
+def appleseed_scene_updated( scene):
+    updated = [name for name in DataCollections if getattr( bpy.data, name).is_updated]
+    # Only count edits of existing datablocks: exports create and remove temporary meshes.
+    edited = set( name for name in updated if any( id.is_updated for id in getattr( bpy.data, name)))
+    _state.tag_data( bool( edited) or ( 'objects' in updated and any( ob.is_updated_data for ob in bpy.data.objects)))
+    if not edited.isdisjoint( MaterialCollections):
+        _state.tag_materials()
+
+    if 'objects' in updated or 'meshes' in updated:
+        meshes = bpy.data.meshes
+        updated_meshes = set( mesh.name for mesh in meshes if mesh.is_updated) if 'meshes' in updated else set()
+        _state.tag_objects( ob.name for ob in bpy.data.objects if ob.is_updated_data or ( ob.type == 'MESH' and ob.data.name in updated_meshes))
+
+@persistent
+def appleseed_file_changed( dummy):
+    # Object names may now refer to other objects.
+    _state.clear()
+
+def register():
+    bpy.app.handlers.scene_update_post.append( appleseed_scene_updated)
+    bpy.app.handlers.load_post.append( appleseed_file_changed)
+    bpy.app.handlers.undo_post.append( appleseed_file_changed)
+    bpy.app.handlers.redo_post.append( appleseed_file_changed)
+
+def unregister():
+    bpy.app.handlers.scene_update_post.remove( appleseed_scene_updated)
+    bpy.app.handlers.load_post.remove( appleseed_file_changed)
+    bpy.app.handlers.undo_post.remove( appleseed_file_changed)
+    bpy.app.handlers.redo_post.remove( appleseed_file_changed)
+    _state.clear()
@@ -0,0 +1,156 @@
+#
+# This source file is part of appleseed.
+# Visit http://appleseedhq.net/ for additional information and resources.
+#
+# This software is released under the MIT license.
+#
+# Copyright (c) 2013 Franz Beaune, Joel Daniels, Esteban Tovagliari.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+#
+# Compact encoding of object instances.
+#
+# Large particle / dupli scatters are written as one line per object instance:
+# all the transforms are converted and formatted as whole arrays at once, and
+# the surrounding XML is pasted around each formatted matrix.
+#
+
+from itertools import chain
+import numpy as np
+from . import mesh_encoder
+from . import scene_ir
+
+#--------------------------------------------------------------------------------------------------
+# Transforms.
+#--------------------------------------------------------------------------------------------------
+
+def get_instance_matrices( global_matrix, matrices):
+    '''
+    Return global_matrix * matrix for every 4x4 matrix, as a (N, 4, 4) array.
+    '''
+    count = len( matrices)
+    values = np.fromiter( chain.from_iterable( chain.from_iterable( matrices)), np.float64, count * 16).reshape( count, 4, 4)
+    return np.einsum( 'ij,njk->nik', np.array( global_matrix, dtype = np.float64), values)
+
+
+def get_instance_rows( global_matrix, matrices):
+    '''
+    Return the rows of the transform elements of global_matrix * matrix for a (..., 4, 4) array of matrices,
+    converted from Blender's Z-up to appleseed's Y-up coordinate system like ProjectFileWriter.__get_transform().
+    '''
+    return swap_axes( np.einsum( 'ij,...jk->...ik', np.array( global_matrix, dtype = np.float64), matrices))
+
+
+def swap_axes( matrices):
+    '''
+    Return the rows of the transform elements of a (..., 4, 4) array of matrices in Blender's coordinate system.
+    '''
+    rows = matrices[..., [0, 2, 1, 3], :]
+    rows[..., 2, :] *= -1.0
+    return rows
+
+
+def compose_particle_matrices( locations, rotations, scales):
+    '''
+    Return translation * rotation * scale for every particle, as a (N, 4, 4) array.
+    locations and scales are (N, 3), rotations are (N, 4) quaternions (w, x, y, z).
+    '''
+    count = len( locations)
+    rotations = np.asarray( rotations, dtype = np.float64)
+    norms = np.sqrt( ( rotations * rotations).sum( axis = 1))
+    # Particles that were never rotated have a null quaternion.
+    rotations = np.where( norms[:, None] > 0.0, rotations, [1.0, 0.0, 0.0, 0.0])
+    w, x, y, z = ( rotations / np.where( norms > 0.0, norms, 1.0)[:, None]).T
+
+    matrices = np.zeros( ( count, 4, 4))
+    matrices[:, 0, 0] = 1.0 - 2.0 * ( y * y + z * z)
+    matrices[:, 0, 1] = 2.0 * ( x * y - w * z)
+    matrices[:, 0, 2] = 2.0 * ( x * z + w * y)
+    matrices[:, 1, 0] = 2.0 * ( x * y + w * z)
+    matrices[:, 1, 1] = 1.0 - 2.0 * ( x * x + z * z)
+    matrices[:, 1, 2] = 2.0 * ( y * z - w * x)
+    matrices[:, 2, 0] = 2.0 * ( x * z - w * y)
+    matrices[:, 2, 1] = 2.0 * ( y * z + w * x)
+    matrices[:, 2, 2] = 1.0 - 2.0 * ( x * x + y * y)
+    matrices[:, :3, :3] *= np.asarray( scales, dtype = np.float64)[:, None, :]
+    matrices[:, :3, 3] = locations
+    matrices[:, 3, 3] = 1.0
+    return matrices
+
+
+def format_instance_matrices( matrices):
+    '''
+    Return the text of the matrix element of each (N, 4, 4) matrix, converted from
+    Blender's Z-up to appleseed's Y-up coordinate system like ProjectFileWriter.__get_transform().
+    Values are the float32 values of Blender matrices, written like __get_transform() writes them.
+    '''
+    rows = swap_axes( matrices)
+    text = mesh_encoder.format_rows( "%r " * 15 + "%r\n", rows.reshape( -1, 16).astype( np.float32).astype( np.float64))
+    return text.split( "\n")[:-1]
+
+
+def get_motion_transforms( rows, times):
+    '''
+    Return one scene_ir.Transform per motion key for the (keys, 4, 4) rows returned by get_instance_rows().
+    '''
+    return [scene_ir.Transform( tuple( tuple( row) for row in matrix), time) for time, matrix in zip( times, rows.tolist())]
+
+
+#--------------------------------------------------------------------------------------------------
+# Assembly instances.
+#--------------------------------------------------------------------------------------------------
+
+class DupliAssemblies( object):
+    '''
+    Assemblies of the duplis / particles with object motion blur. The assembly of a source object
+    is shared by all of its duplis, each dupli being placed by an assembly instance of its own.
+    '''
+
+    def __init__( self):
+        # Assembly name -> index of its last instance.
+        self._instance_count = {}
+
+    def place( self, object_name, transforms):
+        '''
+        Place one dupli of an object.
+        Returns ( assembly name, True if the assembly is not written yet, scene_ir.AssemblyInstance).
+        '''
+        assembly_name = "%s_dupli" % object_name
+        instance_index = self._instance_count.get( assembly_name, -1) + 1
+        self._instance_count[assembly_name] = instance_index
+        instance = scene_ir.AssemblyInstance( "%s.instance_%d" % ( assembly_name, instance_index), assembly_name, transforms)
+        return assembly_name, instance_index == 0, instance
+
+
+#--------------------------------------------------------------------------------------------------
+# Object instances.
+#--------------------------------------------------------------------------------------------------
+
+def encode_object_instances( object_name, instance_prefix, first_index, matrices_text, front_material_name, back_material_name):
+    '''
+    Return ( name, line) for one object_instance element per matrix formatted by format_instance_matrices(),
+    named instance_prefix + instance index. Lines have no indentation and no line break.
+    '''
+    middle = '" object="' + object_name + '"><transform><matrix>'
+    tail = ( '</matrix></transform><assign_material slot="0" side="front" material="' + front_material_name +
+             '" /><assign_material slot="0" side="back" material="' + back_material_name + '" /></object_instance>')
+    names = [instance_prefix + str( index) for index in range( first_index, first_index + len( matrices_text))]
+    return [( name, '<object_instance name="' + name + middle + matrix + tail) for name, matrix in zip( names, matrices_text)]
@@ -0,0 +1,106 @@
+#
+# This source file is part of appleseed.
+# Visit http://appleseedhq.net/ for additional information and resources.
+#
+# This software is released under the MIT license.
+#
+# Copyright (c) 2013 Franz Beaune, Joel Daniels, Esteban Tovagliari.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+import json
+import os
+
+#--------------------------------------------------------------------------------------------------
+# Persistent cache of exported mesh files.
+#--------------------------------------------------------------------------------------------------
+
+class MeshCache( object):
+    '''
+    Remembers the content hash, the object fingerprint and the mesh parts of every mesh file
+    written to the project's meshes directory, so that unchanged meshes are not written again.
+    The manifest is stored next to the mesh files and survives between sessions.
+    '''
+    ManifestName = "mesh_cache.json"
+    ManifestVersion = 1
+
+    def __init__( self, meshes_path):
+        self._meshes_path = meshes_path
+        self._manifest_path = os.path.join( meshes_path, self.ManifestName)
+        self._entries = {}
+        self._dirty = False
+        self.load()
+
+    def load( self):
+        self._entries = {}
+        if not os.path.exists( self._manifest_path):
+            return
+        try:
+            with open( self._manifest_path, "r", encoding = "utf8") as manifest_file:
+                manifest = json.load( manifest_file)
+        except ( IOError, ValueError):
+            # A damaged manifest only means every mesh gets written again.
+            return
+        if manifest.get( "version") == self.ManifestVersion:
+            self._entries = manifest.get( "meshes", {})
+
+    def save( self):
+        if not self._dirty:
+            return
+        if not os.path.exists( self._meshes_path):
+            os.mkdir( self._meshes_path)
+        temp_path = self._manifest_path + ".tmp"
+        with open( temp_path, "w", encoding = "utf8") as manifest_file:
+            json.dump( { "version": self.ManifestVersion, "meshes": self._entries}, manifest_file, sort_keys = True)
+        os.replace( temp_path, self._manifest_path)
+        self._dirty = False
+
+    def lookup( self, filename, key):
+        '''
+        Return the mesh parts of the file if it exists on disk and was written from
+        a mesh with the given content hash, None otherwise.
+        '''
+        entry = self._entries.get( filename)
+        if entry is None or entry["hash"] != key:
+            return None
+        return self.__get_parts( filename, entry)
+
+    def lookup_fingerprint( self, filename, fingerprint):
+        '''
+        Same as lookup(), but matches the fingerprint of the unevaluated object
+        so that the mesh does not need to be evaluated at all.
+        '''
+        entry = self._entries.get( filename)
+        if fingerprint is None or entry is None or entry.get( "fingerprint") != fingerprint:
+            return None
+        return self.__get_parts( filename, entry)
+
+    def store( self, filename, key, mesh_parts, fingerprint = None):
+        self._entries[filename] = { "hash": key, "parts": [list( part) for part in mesh_parts], "fingerprint": fingerprint}
+        self._dirty = True
+
+    def discard( self, filename):
+        if self._entries.pop( filename, None) is not None:
+            self._dirty = True
+
+    def __get_parts( self, filename, entry):
+        if not os.path.exists( os.path.join( self._meshes_path, filename)):
+            return None
+        return [( material_index, mesh_name) for material_index, mesh_name in entry["parts"]]
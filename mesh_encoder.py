@@ -0,0 +1,504 @@
+#
+# This source file is part of appleseed.
+# Visit http://appleseedhq.net/ for additional information and resources.
+#
+# This software is released under the MIT license.
+#
+# Copyright (c) 2013 Franz Beaune, Joel Daniels, Esteban Tovagliari.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+#
+# Vectorized mesh encoding.
+#
+# Nothing in this module touches bpy: the mesh buffers are pulled out of Blender
+# by mesh_writer.get_mesh_arrays(), and everything from there on (sorting,
+# deduplication, indexing and text encoding) works on plain NumPy arrays.
+#
+
+import hashlib
+import struct
+import numpy as np
+
+#--------------------------------------------------------------------------------------------------
+# Mesh buffers.
+#--------------------------------------------------------------------------------------------------
+
+class MeshArrays( object):
+    '''
+    Flat copies of the tessellated mesh buffers.
+    '''
+    __slots__ = ( "co", "vertex_normals", "face_vertices", "face_normals", "material_indices", "smooth", "uvs")
+
+    def __init__( self, co, vertex_normals, face_vertices, face_normals, material_indices, smooth, uvs = None):
+        self.co = co                            # (V, 3) float32
+        self.vertex_normals = vertex_normals    # (V, 3) float32
+        self.face_vertices = face_vertices      # (F, 4) int32, v4 == 0 for triangles
+        self.face_normals = face_normals        # (F, 3) float32
+        self.material_indices = material_indices  # (F,) int32
+        self.smooth = smooth                    # (F,) bool
+        self.uvs = uvs                          # (F, 4, 2) float32 or None
+
+    @property
+    def num_faces( self):
+        return len( self.material_indices)
+
+
+#--------------------------------------------------------------------------------------------------
+# Helpers.
+#--------------------------------------------------------------------------------------------------
+
+def group_rows( columns):
+    '''
+    Order-preserving deduplication of the rows formed by the given columns.
+    Returns the index of the first occurrence of every unique row, in order of
+    first occurrence, and the index of each input row into that list.
+    '''
+    count = len( columns[0])
+    if count == 0:
+        return np.zeros( 0, dtype = np.int64), np.zeros( 0, dtype = np.int64)
+
+    # lexsort is stable, so the first row of every run is its first occurrence.
+    order = np.lexsort( columns[::-1])
+    new_group = np.zeros( count, dtype = bool)
+    new_group[0] = True
+    for column in columns:
+        sorted_column = column[order]
+        new_group[1:] |= sorted_column[1:] != sorted_column[:-1]
+
+    group_ids = np.cumsum( new_group) - 1
+    first = order[new_group]
+
+    # Renumber the groups by first occurrence.
+    remap = np.empty( len( first), dtype = np.int64)
+    remap[np.argsort( first, kind = 'mergesort')] = np.arange( len( first))
+    inverse = np.empty( count, dtype = np.int64)
+    inverse[order] = remap[group_ids]
+
+    return np.sort( first), inverse
+
+
+def as_bytes( array):
+    '''
+    Raw little-endian bytes of an array, ready to be passed to file.write().
+    '''
+    return np.ascontiguousarray( array).ravel().view( np.uint8)
+
+
+def hash_mesh_arrays( arrays, salt = ""):
+    '''
+    Content hash of the mesh buffers. The salt folds in the export settings that change the written file.
+    '''
+    digest = hashlib.sha1( salt.encode( "utf8"))
+    for array in ( arrays.co, arrays.vertex_normals, arrays.face_vertices, arrays.face_normals,
+                   arrays.material_indices, arrays.smooth, arrays.uvs):
+        if array is None:
+            digest.update( b"-")
+        else:
+            digest.update( struct.pack( "<Q", array.size))
+            digest.update( as_bytes( array))
+    return digest.hexdigest()
+
+
+def format_rows( row_format, values):
+    '''
+    Format a (N, K) array with a single '%' operation over a repeated row format.
+    '''
+    if len( values) == 0:
+        return ""
+    return ( row_format * len( values)) % tuple( values.ravel().tolist())
+
+
+def shortest_float32_strings( values):
+    '''
+    Shortest decimal strings that read back as the same float32 values.
+    The number of significant digits is picked numerically (1 to 9, 9 always round-trips),
+    every value is formatted once, and the few values whose text does not read back
+    exactly because of rounding differences are formatted again with 9 digits.
+    '''
+    values = np.asarray( values, dtype = np.float32).ravel()
+    strings = np.empty( len( values), dtype = object)
+    if len( values) == 0:
+        return strings
+
+    # Pick the digits.
+    x = values.astype( np.float64)
+    finite = np.isfinite( x) & ( x != 0.0)
+    exponents = np.zeros( len( x))
+    exponents[finite] = np.floor( np.log10( np.abs( x[finite])))
+    value_digits = np.where( finite, 9, 1)
+    for digits in range( 8, 0, -1):
+        scale = 10.0 ** ( exponents - digits + 1)
+        exact = finite & (( np.round( x / scale) * scale).astype( np.float32) == values)
+        value_digits[exact] = digits
+    # Write 100 rather than 1e+02.
+    value_digits = np.where( finite & ( exponents >= 0) & ( exponents < 9), np.maximum( value_digits, exponents + 1), value_digits).astype( int)
+
+    # Format every group of values with the same number of digits at once.
+    for digits in np.unique( value_digits):
+        indices = np.flatnonzero( value_digits == digits)
+        strings[indices] = ((( "%%.%dg\n" % digits) * len( indices)) % tuple( x[indices].tolist())).split( "\n")[:-1]
+
+    # Check the round trip.
+    inexact = finite & ( strings.astype( np.float64).astype( np.float32) != values)
+    if inexact.any():
+        indices = np.flatnonzero( inexact)
+        strings[indices] = (( "%.9g\n" * len( indices)) % tuple( x[indices].tolist())).split( "\n")[:-1]
+    return strings
+
+
+def format_float_rows( row_format, values, precision = 'double', digits = 6):
+    '''
+    Format a (N, K) float array. Every %f in row_format is written according to precision:
+    'double' writes 15 decimals, 'fixed' the given number of decimals, and 'float32'
+    the shortest text that reads back as the same float32 value.
+    '''
+    if len( values) == 0:
+        return ""
+    if precision == 'float32':
+        return ( row_format.replace( "%f", "%s") * len( values)) % tuple( shortest_float32_strings( values).tolist())
+    spec = "%.15f" if precision == 'double' else "%%.%df" % digits
+    return format_rows( row_format.replace( "%f", spec), values)
+
+
+def sort_faces( arrays):
+    '''
+    Return the face indices sorted by material, keeping the original order within a material.
+    '''
+    return np.argsort( arrays.material_indices, kind = 'mergesort')
+
+
+def get_corners( arrays, face_order):
+    '''
+    Expand the sorted faces into face corners.
+    Returns the face index and vertex index of every corner, and the corner count of every face.
+    '''
+    face_vertices = arrays.face_vertices[face_order]
+    corner_mask = np.ones( face_vertices.shape, dtype = bool)
+    corner_mask[:, 3] = face_vertices[:, 3] != 0
+    face_sizes = corner_mask.sum( axis = 1)
+    corner_faces = np.repeat( face_order, face_sizes)
+    corner_vertices = face_vertices[corner_mask]
+    return corner_faces, corner_vertices, corner_mask, face_sizes
+
+
+def get_corner_normals( arrays, corner_faces, corner_vertices):
+    '''
+    Normal of every corner: the vertex normal on smooth faces, the face normal on flat faces.
+    '''
+    smooth = arrays.smooth[corner_faces]
+    return np.where( smooth[:, None], arrays.vertex_normals[corner_vertices], arrays.face_normals[corner_faces])
+
+
+def get_normal_sources( arrays, corner_faces, corner_vertices):
+    '''
+    Source of the normal of every corner: the vertex index on smooth faces, the number of vertices
+    plus the face index on flat faces. Meshes of the same topology have the same sources.
+    '''
+    return np.where( arrays.smooth[corner_faces], corner_vertices, len( arrays.co) + corner_faces)
+
+
+def get_normal_keys( normals, tolerance):
+    '''
+    Exact keys for tolerance 0, where -0.0 and 0.0 share a key as they do in a Python dict.
+    Otherwise integer keys quantized to a grid of the given spacing.
+    '''
+    if tolerance <= 0.0:
+        return normals + np.float32( 0.0)
+    return np.floor( normals / tolerance + 0.5).astype( np.int64)
+
+
+def get_uv_keys( uvs):
+    '''
+    Same truncated keys as mesh_writer.get_array2_key().
+    '''
+    return np.trunc( uvs.astype( np.float64) * 1000000).astype( np.int64)
+
+
+#--------------------------------------------------------------------------------------------------
+# Deformation motion keys.
+#--------------------------------------------------------------------------------------------------
+
+def same_topology( arrays, other):
+    '''
+    True if both meshes have the same number of vertices and the same faces, materials and smoothing.
+    '''
+    return ( len( arrays.co) == len( other.co) and
+             np.array_equal( arrays.face_vertices, other.face_vertices) and
+             np.array_equal( arrays.material_indices, other.material_indices) and
+             np.array_equal( arrays.smooth, other.smooth))
+
+
+def get_vertex_key_arrays( arrays, open_arrays):
+    '''
+    The positions and normals of a motion key with the faces of the shutter open mesh, without
+    texture coordinates. Both meshes must have the same topology, see same_topology().
+    '''
+    return MeshArrays( arrays.co, arrays.vertex_normals, open_arrays.face_vertices, arrays.face_normals, open_arrays.material_indices, open_arrays.smooth)
+
+
+#--------------------------------------------------------------------------------------------------
+# Wavefront OBJ encoding.
+#--------------------------------------------------------------------------------------------------
+
+def get_mesh_parts( arrays):
+    '''
+    The mesh parts encode_obj() and encode_binarymesh() return, without encoding the mesh.
+    '''
+    return [( int( material_index), "part_%d" % material_index) for material_index in np.unique( arrays.material_indices)]
+
+
+# Upper bound of the transient Python memory needed to format one row (a vertex,
+# normal, texture coordinate or face line), used to turn a memory budget into rows.
+ObjRowBytes = 1024
+
+def get_chunk_rows( chunk_bytes):
+    return max( 1, chunk_bytes // ObjRowBytes)
+
+
+def iter_rows( row_format, values, chunk_rows, precision = 'double', digits = 6):
+    for start in range( 0, len( values), chunk_rows):
+        yield format_float_rows( row_format, values[start:start + chunk_rows], precision, digits)
+
+
+def iter_obj_chunks( arrays, chunk_rows = None, normal_tolerance = 0.0, precision = 'double', digits = 6):
+    '''
+    Encode the mesh buffers as Wavefront OBJ text, yielding pieces of at most chunk_rows lines
+    so that the text never needs to be held in memory at once. None formats each section in one go.
+    Normals that round to the same multiple of normal_tolerance are written once;
+    0 only merges identical normals. None writes every vertex and face normal used,
+    whatever its value, like encode_binarymesh(), so that deformation motion keys of the same topology
+    have the same normals. See format_float_rows() for precision and digits.
+    '''
+    if chunk_rows is None:
+        chunk_rows = max( len( arrays.co), 4 * arrays.num_faces, 1)
+
+    face_order = sort_faces( arrays)
+    corner_faces, corner_vertices, corner_mask, face_sizes = get_corners( arrays, face_order)
+
+    # Vertices.
+    for chunk in iter_rows( "v %f %f %f\n", arrays.co, chunk_rows, precision, digits):
+        yield chunk
+
+    # Deduplicate normals.
+    corner_normals = get_corner_normals( arrays, corner_faces, corner_vertices)
+    if normal_tolerance is None:
+        first_normals, normal_indices = group_rows( [get_normal_sources( arrays, corner_faces, corner_vertices)])
+    else:
+        normal_keys = get_normal_keys( corner_normals, normal_tolerance)
+        first_normals, normal_indices = group_rows( [normal_keys[:, 0], normal_keys[:, 1], normal_keys[:, 2]])
+        del normal_keys
+    for chunk in iter_rows( "vn %f %f %f\n", corner_normals[first_normals], chunk_rows, precision, digits):
+        yield chunk
+    del corner_normals, first_normals
+
+    # Deduplicate texture coordinates.
+    texcoord_indices = None
+    if arrays.uvs is not None:
+        corner_uvs = arrays.uvs[face_order][corner_mask]
+        uv_keys = get_uv_keys( corner_uvs)
+        first_uvs, texcoord_indices = group_rows( [uv_keys[:, 0], uv_keys[:, 1]])
+        for chunk in iter_rows( "vt %f %f\n", corner_uvs[first_uvs], chunk_rows, precision, digits):
+            yield chunk
+        del corner_uvs, uv_keys, first_uvs
+
+    # Faces, one object per material.
+    if texcoord_indices is not None:
+        corner_format = " %d/%d/%d"
+        corner_values = np.column_stack(( corner_vertices + 1, texcoord_indices + 1, normal_indices + 1))
+    else:
+        corner_format = " %d//%d"
+        corner_values = np.column_stack(( corner_vertices + 1, normal_indices + 1))
+    face_formats = np.array( ["f" + corner_format * 3 + "\n", "f" + corner_format * 4 + "\n"], dtype = object)
+
+    material_indices = arrays.material_indices[face_order]
+    run_starts = np.flatnonzero( np.concatenate(( [True], material_indices[1:] != material_indices[:-1])))
+    run_ends = np.append( run_starts[1:], len( material_indices))
+    corner_starts = np.concatenate(( [0], np.cumsum( face_sizes)))
+    for start, end in zip( run_starts, run_ends):
+        yield "o part_%d\n" % material_indices[start]
+        for chunk_start in range( start, end, chunk_rows):
+            chunk_end = min( chunk_start + chunk_rows, end)
+            faces_format = ('').join( face_formats[face_sizes[chunk_start:chunk_end] - 3].tolist())
+            values = corner_values[corner_starts[chunk_start]:corner_starts[chunk_end]]
+            yield faces_format % tuple( values.ravel().tolist())
+
+
+def encode_obj( arrays):
+    '''
+    Encode the mesh buffers as a Wavefront OBJ string.
+    Output is identical to mesh_writer.write_mesh_to_disk().
+    Returns the OBJ text and the list of mesh parts.
+    '''
+    return ('').join( iter_obj_chunks( arrays)), get_mesh_parts( arrays)
+
+
+#--------------------------------------------------------------------------------------------------
+# appleseed curves encoding.
+#--------------------------------------------------------------------------------------------------
+
+def get_curve_steps( steps, num_points):
+    '''
+    Path steps to sample for num_points points per hair, evenly spaced from the root
+    (step 0) to the tip (step steps). 0 samples every step, as saved by earlier versions,
+    and a strand always has its root and tip.
+    '''
+    if num_points == 0 or num_points > steps + 1:
+        num_points = steps + 1
+    return np.round( np.linspace( 0, steps, max( num_points, 2))).astype( int)
+
+
+def iter_curve_rows( points, chunk_rows = None, precision = 'double', digits = 6):
+    '''
+    Encode hair points, a (C, P, 4) array of x, y, z and radius, as the lines of an
+    appleseed .curves file, one line per curve, in pieces of at most chunk_rows lines.
+    See format_float_rows() for precision and digits, except that 'double' keeps the formats
+    of the files written before the precision setting: 6 decimals, 4 for radii.
+    '''
+    num_curves = len( points)
+    if chunk_rows is None:
+        chunk_rows = max( num_curves, 1)
+    if precision == 'double':
+        row_format = "%.6f %.6f %.6f %.4f " * points.shape[1] + "\n"
+    else:
+        row_format = "%f %f %f %f " * points.shape[1] + "\n"
+    return iter_rows( row_format, points.reshape( num_curves, 4 * points.shape[1]), chunk_rows, precision, digits)
+
+
+#--------------------------------------------------------------------------------------------------
+# appleseed binary mesh encoding.
+#--------------------------------------------------------------------------------------------------
+
+# Uncompressed variant of appleseed's .binarymesh format. The compressed variants
+# use LZO / LZ4, which are not available to Blender's Python.
+BinaryMeshSignature = b"BINARYMESH"
+BinaryMeshVersion = 1
+
+def binarymesh_string( s):
+    data = s.encode( "utf8")
+    return struct.pack( "<H", len( data)) + data
+
+
+def binarymesh_face_records( face_sizes, vertex_indices, normal_indices, texcoord_indices):
+    '''
+    Pack the faces of one mesh: vertex count, vertex, normal and texture coordinate
+    indices, material slot. Triangles are packed first, then quads.
+    '''
+    corner_starts = np.concatenate(( [0], np.cumsum( face_sizes)[:-1]))
+    chunks = []
+    for size in ( 3, 4):
+        starts = corner_starts[face_sizes == size]
+        if len( starts) == 0:
+            continue
+        corners = starts[:, None] + np.arange( size)
+        records = np.zeros( len( starts), dtype = [( "count", "<u2"),
+                                                   ( "vertices", "<u4", size),
+                                                   ( "normals", "<u4", size),
+                                                   ( "texcoords", "<u4", size),
+                                                   ( "material", "<u2")])
+        records["count"] = size
+        records["vertices"] = vertex_indices[corners]
+        records["normals"] = normal_indices[corners]
+        records["texcoords"] = texcoord_indices[corners]
+        chunks.append( as_bytes( records))
+    return chunks
+
+
+def encode_binarymesh( arrays):
+    '''
+    Encode the mesh buffers in appleseed's binary mesh format, one mesh per material part.
+    Normals are indexed by source (vertex normal or face normal) rather than by value,
+    so that deformation motion keys of the same topology always have matching counts.
+    Returns a list of byte chunks and the list of mesh parts.
+    '''
+    face_order = sort_faces( arrays)
+    corner_faces, corner_vertices, corner_mask, face_sizes = get_corners( arrays, face_order)
+    corner_normals = get_corner_normals( arrays, corner_faces, corner_vertices)
+    normal_sources = get_normal_sources( arrays, corner_faces, corner_vertices)
+    if arrays.uvs is not None:
+        corner_uvs = arrays.uvs[face_order][corner_mask]
+    else:
+        corner_uvs = np.zeros(( len( corner_vertices), 2), dtype = np.float32)
+    uv_keys = get_uv_keys( corner_uvs)
+
+    chunks = [BinaryMeshSignature, struct.pack( "<H", BinaryMeshVersion)]
+    mesh_parts = []
+    material_indices = arrays.material_indices[face_order]
+    run_starts = np.flatnonzero( np.concatenate(( [True], material_indices[1:] != material_indices[:-1])))
+    run_ends = np.append( run_starts[1:], len( material_indices))
+    corner_starts = np.concatenate(( [0], np.cumsum( face_sizes)))
+    for start, end in zip( run_starts, run_ends):
+        material_index = int( material_indices[start])
+        mesh_name = "part_%d" % material_index
+        mesh_parts.append(( material_index, mesh_name))
+        corners = slice( corner_starts[start], corner_starts[end])
+
+        # Every part is a separate mesh with its own, locally indexed, vertex arrays.
+        first_vertices, vertex_indices = group_rows( [corner_vertices[corners]])
+        first_normals, normal_indices = group_rows( [normal_sources[corners]])
+        part_uv_keys = uv_keys[corners]
+        first_uvs, texcoord_indices = group_rows( [part_uv_keys[:, 0], part_uv_keys[:, 1]])
+
+        chunks.append( binarymesh_string( mesh_name))
+        chunks.append( struct.pack( "<I", len( first_vertices)))
+        chunks.append( as_bytes( arrays.co[corner_vertices[corners][first_vertices]].astype( "<f8")))
+        chunks.append( struct.pack( "<I", len( first_normals)))
+        chunks.append( as_bytes( corner_normals[corners][first_normals].astype( "<f8")))
+        chunks.append( struct.pack( "<I", len( first_uvs)))
+        chunks.append( as_bytes( corner_uvs[corners][first_uvs].astype( "<f8")))
+        chunks.append( struct.pack( "<H", 0))
+        chunks.append( struct.pack( "<I", end - start))
+        chunks.extend( binarymesh_face_records( face_sizes[start:end], vertex_indices, normal_indices, texcoord_indices))
+
+    return chunks, mesh_parts
+
+
+#--------------------------------------------------------------------------------------------------
+# Mesh files.
+#--------------------------------------------------------------------------------------------------
+
+def write_mesh_file( arrays, file_format, filepath, obj_options = None):
+    '''
+    Encode the mesh buffers and write them to filepath. Returns the mesh parts.
+    obj_options are passed on to iter_obj_chunks().
+    '''
+    if file_format == 'binarymesh':
+        chunks, mesh_parts = encode_binarymesh( arrays)
+        with open( filepath, "wb") as mesh_file:
+            for chunk in chunks:
+                mesh_file.write( chunk)
+    else:
+        mesh_parts = get_mesh_parts( arrays)
+        with open( filepath, "w", encoding = "utf8") as mesh_file:
+            for chunk in iter_obj_chunks( arrays, **( obj_options or {})):
+                mesh_file.write( chunk)
+    return mesh_parts
+
+def save_mesh_arrays( arrays, filepath):
+    '''
+    Save the mesh buffers to an uncompressed .npz file, read back by load_mesh_arrays().
+    '''
+    buffers = dict(( slot, getattr( arrays, slot)) for slot in MeshArrays.__slots__ if getattr( arrays, slot) is not None)
+    with open( filepath, "wb") as arrays_file:
+        np.savez( arrays_file, **buffers)
+
+def load_mesh_arrays( filepath):
+    with np.load( filepath) as buffers:
+        return MeshArrays( **dict(( slot, buffers[slot]) for slot in buffers.files))
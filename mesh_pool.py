@@ -0,0 +1,182 @@
+#
+# This source file is part of appleseed.
+# Visit http://appleseedhq.net/ for additional information and resources.
+#
+# This software is released under the MIT license.
+#
+# Copyright (c) 2013 Franz Beaune, Joel Daniels, Esteban Tovagliari.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+
+#
+# Parallel mesh encoding.
+#
+# bpy may only be used from the main thread, so the exporter extracts the mesh
+# buffers there, saves them to a temporary file and hands the file to a pool of
+# worker processes that encode and write the mesh files. The workers run
+# mesh_worker.py with Blender's Python interpreter: Blender itself is never forked.
+# Like mesh_encoder, nothing in this module touches bpy.
+#
+
+import json
+import os
+import queue
+import shutil
+import subprocess
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from . import mesh_encoder
+
+WorkerScript = os.path.join( os.path.dirname( os.path.abspath( __file__)), "mesh_worker.py")
+
+# CREATE_NO_WINDOW, keeps the workers from opening consoles on Windows.
+CreateNoWindow = 0x08000000
+
+#--------------------------------------------------------------------------------------------------
+# Worker pool.
+#--------------------------------------------------------------------------------------------------
+
+class MeshEncoderPool( object):
+    '''
+    Encodes and writes mesh files in worker processes while the export goes on.
+    Falls back to encoding on the calling thread when no Python interpreter is given,
+    when the workers cannot be started or when a single process is requested.
+    '''
+    def __init__( self, processes, python = None):
+        self._processes = processes
+        self._python = python or None
+        self._workers = []
+        # Workers waiting for a job.
+        self._idle = None
+        # One thread per worker, waiting for its answers.
+        self._executor = None
+        self._directory = None
+        self._job_count = 0
+        # (filepath, future) of the files being written.
+        self._pending = []
+        self._failures = []
+
+    @property
+    def parallel( self):
+        return self._processes > 1 and self._python is not None
+
+    def submit( self, arrays, file_format, filepath, obj_options = None):
+        '''
+        Write the mesh file, in the background if possible.
+        Errors of background writes are reported by join().
+        '''
+        if self.parallel and self._executor is None:
+            try:
+                self.__start()
+            except OSError:
+                self.__stop()
+                self._python = None
+        if not self.parallel:
+            mesh_encoder.write_mesh_file( arrays, file_format, filepath, obj_options)
+            return
+
+        # Bound the number of buffer files waiting for a worker.
+        self.__collect( max_pending = 2 * self._processes - 1)
+
+        self._job_count += 1
+        arrays_path = os.path.join( self._directory, "%d.npz" % self._job_count)
+        mesh_encoder.save_mesh_arrays( arrays, arrays_path)
+        job = { "arrays": arrays_path, "format": file_format, "filepath": filepath, "options": obj_options or {}}
+        future = self._executor.submit( self.__run, ( json.dumps( job) + "\n").encode( "utf8"), arrays_path)
+        self._pending.append(( filepath, future))
+
+    def join( self):
+        '''
+        Wait for all the files to be written and stop the workers.
+        Returns a list of ( filepath, exception) for the files that could not be written.
+        '''
+        self.__collect( max_pending = 0)
+        self.__stop()
+        failures, self._failures = self._failures, []
+        return failures
+
+    def __start( self):
+        self._directory = tempfile.mkdtemp( prefix = "appleseed_meshes_")
+        self._idle = queue.Queue()
+        creationflags = CreateNoWindow if sys.platform == 'win32' else 0
+        for i in range( self._processes):
+            worker = subprocess.Popen( [self._python, WorkerScript], stdin = subprocess.PIPE, stdout = subprocess.PIPE,
+                                       creationflags = creationflags)
+            self._workers.append( worker)
+            self._idle.put( worker)
+        self._executor = ThreadPoolExecutor( self._processes)
+
+    def __stop( self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        for worker in self._workers:
+            # The workers exit at the end of their input.
+            worker.stdin.close()
+            worker.wait()
+            worker.stdout.close()
+        self._workers = []
+        if self._directory is not None:
+            shutil.rmtree( self._directory, ignore_errors = True)
+            self._directory = None
+
+    def __run( self, job, arrays_path):
+        '''
+        Runs on an executor thread: send the job to an idle worker and wait for its answer.
+        '''
+        worker = self._idle.get()
+        try:
+            worker.stdin.write( job)
+            worker.stdin.flush()
+            answer = worker.stdout.readline()
+        finally:
+            self._idle.put( worker)
+            try:
+                os.remove( arrays_path)
+            except OSError:
+                pass
+        if not answer:
+            raise RuntimeError( "the mesh encoding process exited")
+        error = json.loads( answer.decode( "utf8"))["error"]
+        if error is not None:
+            raise RuntimeError( error)
+
+    def __collect( self, max_pending):
+        '''
+        Check the files written so far, waiting for the oldest ones
+        until at most max_pending files are still being written.
+        '''
+        while len( self._pending) > max_pending:
+            self.__check( *self._pending.pop( 0))
+        pending = []
+        for filepath, future in self._pending:
+            if future.done():
+                self.__check( filepath, future)
+            else:
+                pending.append(( filepath, future))
+        self._pending = pending
+
+    def __check( self, filepath, future):
+        try:
+            future.result()
+        except Exception as e:
+            self._failures.append(( filepath, e))
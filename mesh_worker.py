@@ -0,0 +1,60 @@
+#
+# This source file is part of appleseed.
+# Visit http://appleseedhq.net/ for additional information and resources.
+#
+# This software is released under the MIT license.
+#
+# Copyright (c) 2013 Franz Beaune, Joel Daniels, Esteban Tovagliari.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+
+#
+# Mesh encoding worker process.
+#
+# Run by mesh_pool with Blender's Python interpreter, outside of Blender.
+# Reads one job per line from stdin, encodes and writes the mesh file, and
+# answers with one line on stdout. Python puts this script's directory first
+# on sys.path, so mesh_encoder is imported without the add-on package, which needs bpy.
+#
+
+import json
+import sys
+import mesh_encoder
+
+def main():
+    stdin = sys.stdin.buffer
+    stdout = sys.stdout.buffer
+    while True:
+        line = stdin.readline()
+        if not line:
+            break
+        job = json.loads( line.decode( "utf8"))
+        try:
+            arrays = mesh_encoder.load_mesh_arrays( job["arrays"])
+            mesh_encoder.write_mesh_file( arrays, job["format"], job["filepath"], job["options"])
+            error = None
+        except Exception as e:
+            error = "{0}: {1}".format( type( e).__name__, e)
+        stdout.write(( json.dumps( { "error": error}) + "\n").encode( "utf8"))
+        stdout.flush()
+
+if __name__ == "__main__":
+    main()
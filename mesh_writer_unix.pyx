@@ -27,8 +27,12 @@
 #
 
 import bpy
+import hashlib
 import os
+import numpy as np
+from itertools import chain
 from . import util
+from . import mesh_encoder
 
 #--------------------------------------------------------------------------------------------------
 # Write a mesh object to disk in Wavefront OBJ format.
@@ -170,6 +174,162 @@ def write_mesh_to_disk( ob, scene, mesh, filepath):
     return mesh_parts
     # End with block
 
+#--------------------------------------------------------------------------------------------------
+# Write a mesh object to disk from bulk-extracted buffers.
+#--------------------------------------------------------------------------------------------------
+
+def get_mesh_arrays( mesh):
+    '''
+    Copy the tessellated mesh buffers into NumPy arrays with foreach_get.
+    '''
+    vertices = mesh.vertices
+    faces = mesh.tessfaces
+    uvtex = mesh.tessface_uv_textures
+    num_vertices = len( vertices)
+    num_faces = len( faces)
+
+    co = np.empty( num_vertices * 3, dtype = np.float32)
+    vertices.foreach_get( "co", co)
+    vertex_normals = np.empty( num_vertices * 3, dtype = np.float32)
+    vertices.foreach_get( "normal", vertex_normals)
+
+    face_vertices = np.empty( num_faces * 4, dtype = np.int32)
+    faces.foreach_get( "vertices_raw", face_vertices)
+    face_normals = np.empty( num_faces * 3, dtype = np.float32)
+    faces.foreach_get( "normal", face_normals)
+    material_indices = np.empty( num_faces, dtype = np.int32)
+    faces.foreach_get( "material_index", material_indices)
+    smooth = np.empty( num_faces, dtype = bool)
+    faces.foreach_get( "use_smooth", smooth)
+
+    uvs = None
+    if uvtex and uvtex.active:
+        uvs = np.empty( num_faces * 8, dtype = np.float32)
+        uvtex.active.data.foreach_get( "uv_raw", uvs)
+        uvs = uvs.reshape( num_faces, 4, 2)
+
+    return mesh_encoder.MeshArrays( co.reshape( num_vertices, 3),
+                                    vertex_normals.reshape( num_vertices, 3),
+                                    face_vertices.reshape( num_faces, 4),
+                                    face_normals.reshape( num_faces, 3),
+                                    material_indices,
+                                    smooth,
+                                    uvs)
+
+# Modifiers whose result depends on the current frame or on simulation caches.
+TimeDependentModifiers = { 'CLOTH', 'DYNAMIC_PAINT', 'EXPLODE', 'FLUID_SIMULATION', 'MESH_CACHE',
+                           'OCEAN', 'PARTICLE_INSTANCE', 'SMOKE', 'SOFT_BODY', 'WAVE'}
+
+def get_object_fingerprint( ob, salt = ""):
+    '''
+    Cheap hash of everything to_mesh() depends on, computed from the original mesh
+    and the modifier settings without evaluating the modifier stack.
+    Return None if the evaluated mesh can change without the object itself changing:
+    shape keys, simulations and modifiers that reference other datablocks (armatures, lattices...).
+    '''
+    if ob.type != 'MESH':
+        return None
+    mesh = ob.data
+    if mesh.shape_keys is not None:
+        return None
+
+    digest = hashlib.sha1( salt.encode( "utf8"))
+    for modifier in ob.modifiers:
+        if modifier.type in TimeDependentModifiers:
+            return None
+        for prop in modifier.bl_rna.properties:
+            if prop.identifier == 'rna_type':
+                continue
+            value = getattr( modifier, prop.identifier)
+            if prop.type == 'POINTER':
+                if isinstance( value, bpy.types.ID):
+                    return None
+                continue
+            if prop.type == 'COLLECTION':
+                if len( value) > 0:
+                    return None
+                continue
+            if prop.type == 'STRING' and prop.identifier.startswith( "vertex_group") and value != "":
+                # Vertex weights are not cheap to read back.
+                return None
+            if prop.type in { 'BOOLEAN', 'INT', 'FLOAT'} and prop.array_length > 0:
+                value = tuple( value)
+            digest.update( repr( ( prop.identifier, value)).encode( "utf8"))
+
+    buffers = [( mesh.vertices, "co", np.float32, 3),
+               ( mesh.edges, "vertices", np.int32, 2),
+               ( mesh.edges, "crease", np.float32, 1),
+               ( mesh.edges, "use_edge_sharp", bool, 1),
+               ( mesh.loops, "vertex_index", np.int32, 1),
+               ( mesh.polygons, "loop_start", np.int32, 1),
+               ( mesh.polygons, "loop_total", np.int32, 1),
+               ( mesh.polygons, "material_index", np.int32, 1),
+               ( mesh.polygons, "use_smooth", bool, 1)]
+    if mesh.uv_layers.active is not None:
+        buffers.append( ( mesh.uv_layers.active.data, "uv", np.float32, 2))
+    for collection, attribute, dtype, width in buffers:
+        values = np.empty( len( collection) * width, dtype = dtype)
+        collection.foreach_get( attribute, values)
+        digest.update( attribute.encode( "utf8"))
+        digest.update( mesh_encoder.as_bytes( values))
+    return digest.hexdigest()
+
+def get_float_options( scene):
+    '''
+    Keyword arguments of the text encoders in mesh_encoder for the scene's export settings.
+    '''
+    return { "chunk_rows": mesh_encoder.get_chunk_rows( scene.appleseed.mesh_chunk_size * 1024 * 1024),
+             "precision": scene.appleseed.float_precision,
+             "digits": scene.appleseed.float_digits}
+
+def get_obj_options( scene):
+    '''
+    Keyword arguments of mesh_encoder.iter_obj_chunks() for the scene's export settings.
+    '''
+    options = get_float_options( scene)
+    options["normal_tolerance"] = scene.appleseed.normal_tolerance
+    return options
+
+def write_mesh_to_disk_numpy( ob, scene, mesh, filepath, arrays = None):
+    '''
+    Same output as write_mesh_to_disk(), with extraction, sorting,
+    deduplication and indexing done on whole buffers at once.
+    Pass arrays to reuse buffers already extracted with get_mesh_arrays().
+    '''
+    try:
+        obj_file = open( filepath, "w", encoding = "utf8")
+    except:
+        util.asUpdate( "Cannot create file %s. Check directory permissions." % filepath)
+        return
+
+    with obj_file:
+        if arrays is None:
+            arrays = get_mesh_arrays( mesh)
+        # Stream the text out in chunks, to bound the memory used by large meshes.
+        for chunk in mesh_encoder.iter_obj_chunks( arrays, **get_obj_options( scene)):
+            obj_file.write( chunk)
+
+    return mesh_encoder.get_mesh_parts( arrays)
+
+def write_binarymesh_to_disk( ob, scene, mesh, filepath, arrays = None):
+    '''
+    Write the mesh in appleseed's binary mesh format.
+    '''
+    try:
+        mesh_file = open( filepath, "wb")
+    except:
+        util.asUpdate( "Cannot create file %s. Check directory permissions." % filepath)
+        return
+
+    with mesh_file:
+        if arrays is None:
+            arrays = get_mesh_arrays( mesh)
+        chunks, mesh_parts = mesh_encoder.encode_binarymesh( arrays)
+        for chunk in chunks:
+            mesh_file.write( chunk)
+
+    return mesh_parts
+
 def write_curves_to_disk( ob, scene, psys, filepath):
     '''
     Write curves object to file.
@@ -179,28 +339,35 @@ def write_curves_to_disk( ob, scene, psys, filepath):
 
         psys.set_resolution( scene, ob, 'RENDER')
         steps = 2 ** psys.settings.render_step
+        asr_psys = psys.settings.appleseed
+        curve_steps = mesh_encoder.get_curve_steps( steps, asr_psys.curve_points).tolist()
+        num_points = len( curve_steps)
 
         # Write the number of hairs to the file
         num_curves = len( psys.particles) if len(psys.child_particles) == 0 else len( psys.child_particles)
         fw( "%d\n" % num_curves)
         
         # Write the number of points per hair to the file
-        fw( "%d\n" % steps)
-
-        root_size = psys.settings.appleseed.root_size * psys.settings.appleseed.scaling
-        tip_size = psys.settings.appleseed.tip_size * psys.settings.appleseed.scaling
-        radius_decrement = util.calc_decrement( root_size, tip_size, steps)
-        for p in range( 0, num_curves):
-            p_radius = root_size
-            for step in range( 0, steps):
-                # A hack for now, to keep the points at max of 4
-                if step == 4:
-                    break
-                co = psys.co_hair( ob, p, step)
-                radius = p_radius
-                fw( "%.6f %.6f %.6f %.4f " % ( co.x, co.y, co.z, radius))
-                p_radius -= radius_decrement
-            fw( "\n")
+        fw( "%d\n" % num_points)
+
+        # Radius tapered from root to tip.
+        radii = np.linspace( asr_psys.root_size, asr_psys.tip_size, num_points) * asr_psys.scaling
+
+        # co_hair() is the only access to child hair paths, so the points are collected
+        # with a single call per point straight into an array, a batch of hairs at a time.
+        options = get_float_options( scene)
+        batch_size = max( 1, options.pop( "chunk_rows") // num_points)
+        co_hair = psys.co_hair
+        for first_curve in range( 0, num_curves, batch_size):
+            curves = range( first_curve, min( first_curve + batch_size, num_curves))
+            co = np.fromiter( chain.from_iterable( co_hair( ob, p, step) for p in curves for step in curve_steps),
+                              dtype = np.float32,
+                              count = len( curves) * num_points * 3)
+            points = np.empty(( len( curves), num_points, 4), dtype = np.float32)
+            points[:, :, :3] = co.reshape( len( curves), num_points, 3)
+            points[:, :, 3] = radii
+            for chunk in mesh_encoder.iter_curve_rows( points, **options):
+                fw( chunk)
         psys.set_resolution( scene, ob, 'PREVIEW')
     return
     
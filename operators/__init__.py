@@ -181,8 +181,9 @@ class AppleseedExportOperator( bpy.types.Operator):
 
         file_path = os.path.join( util.realpath( scene.appleseed.project_path), scene.name + ".appleseed")
         
+        # Only export what changed since the last render.
         appleseed_proj = project_file_writer.write_project_file()
-        appleseed_proj.export( scene, file_path)
+        appleseed_proj.update( scene, file_path)
             
         return {'FINISHED'}
 
@@ -28,10 +28,19 @@
 
 import bpy, bl_ui, bl_operators
 import math, mathutils
-import os, subprocess, time
+import io, os, subprocess, time
 from shutil   import copyfile
 from datetime import datetime
 from .        import util
+from .        import mesh_cache
+from .        import mesh_encoder
+from .        import instance_encoder
+from .        import xml_emitter
+from .        import scene_ir
+from .        import scene_serializer
+from .        import project_index
+from .        import mesh_pool
+from .        import export_state
 import sys
 
 if sys.platform == 'win32':
@@ -71,12 +80,25 @@ class write_project_file( object):
             self.__error("No scene to export.")
             return
 
+        # The frame changes made while exporting are not edits of the scene.
+        state = export_state.get_state()
+        state.begin_export( scene)
+        try:
+            self.__export( scene, file_path)
+        finally:
+            state.finish_export( scene)
+
+    def __export( self, scene, file_path):
         # Transformation matrix applied to all entities of the scene.
         self._global_scale = 1
         self._global_matrix = mathutils.Matrix.Scale(self._global_scale, 4)
         
         # Store textures as they are exported.
         self._textures_set = set()    
+
+        # Names of the texture entities emitted, and the textures of the material being captured.
+        self._emitted_textures = set()
+        self._captured_textures = None
         
         # Collect objects with motion blur.
         self._def_mblur_obs = {ob.name: '' for ob in scene.objects if ob.appleseed.mblur_enable and ob.appleseed.mblur_type == 'deformation'}
@@ -93,15 +115,41 @@ class write_project_file( object):
 
         # Object name -> instance count.
         self._instance_count = {}
-        self._assembly_count = {}
-        self._assembly_instance_count = {}
+
+        # Assemblies and assembly instances of motion blurred duplis / particles.
+        self._dupli_assemblies = instance_encoder.DupliAssemblies()
+
+        # Objects whose mesh file was written during this export.
+        self._written_meshes = set()
+
+        # Names of the dupli groups being emitted, innermost last.
+        self._group_stack = []
+        # Group assemblies emitted in the scene assembly and in each enclosing group assembly, innermost last.
+        self._group_assemblies = [set()]
         
         # Object name -> (material index, mesh name).
         self._mesh_parts = {}
 
-        # Instanced particle objects.
-        # Write mesh files but do not write to appleseed file.
-        self._no_export = {ob.name for ob in util.get_all_psysobs()}
+        # Object name -> name of the object whose mesh object it instances.
+        # Geometry key -> name of the object that emitted the mesh object.
+        self._mesh_sources = {}
+        self._shared_meshes = {}
+
+        # Dupli lists of the objects being emitted.
+        self._dupli_cache = util.DupliCache()
+
+        # Fingerprints of the objects unchanged since the previous export.
+        self._export_state = export_state.get_state()
+
+        # Content hashes of the mesh files already on disk.
+        self._mesh_cache = mesh_cache.MeshCache( os.path.join( util.realpath( scene.appleseed.project_path), "meshes"))
+
+        # Worker processes encoding mesh files in the background, run by Blender's Python interpreter.
+        self._mesh_pool = mesh_pool.MeshEncoderPool( scene.appleseed.mesh_export_processes, bpy.app.binary_path_python)
+
+        # Objects used as particles or dupli group members, if they should only be rendered as such.
+        # Their mesh files are written when they are first instanced, they get no instance of their own.
+        self._instance_sources = util.get_instance_sources( scene) if scene.appleseed.skip_instance_sources else set()
 
         self.__info("")
         self.__info("Starting export of scene '{0}' to {1}...".format(scene.name, file_path))
@@ -109,18 +157,93 @@ class write_project_file( object):
         start_time = datetime.now()
 
         try:
-            with open(file_path, "w") as self._output_file:
-                self._indent = 0
+            with open(file_path, "wb") as output_file:
+                self._output_file = xml_emitter.XmlEmitter( output_file, index = True)
                 self.__emit_file_header()
-                self.__emit_project(scene)
+                try:
+                    self.__emit_project(scene)
+                finally:
+                    self._output_file.flush()
+                    # Wait for the mesh files still being written before closing the project file.
+                    self.__join_mesh_pool()
         except IOError:
             self.__error("Could not write to {0}.".format(file_path))
             return
 
+        try:
+            project_index.save_index( file_path, self._output_file.get_index())
+        except IOError:
+            self.__warning("Could not write the project index, the project cannot be patched.")
+        else:
+            self._export_state.end_export( file_path, scene)
+
+        try:
+            self._mesh_cache.save()
+        except IOError:
+            self.__warning("Could not write the mesh cache manifest, all meshes will be exported again next time.")
+
         elapsed_time = datetime.now() - start_time
 
         self.__info("Finished exporting in {0}".format(elapsed_time))
 
+    def patch( self, scene, file_path):
+        '''
+        Rewrite the camera, the frame and the configurations of a project file written by export()
+        in place, using the index written next to it.
+        Return False if the project file has to be exported again instead.
+        '''
+        if scene.appleseed.mblur_enable and scene.appleseed.cam_mblur:
+            # The camera transforms are sampled with the rest of the scene.
+            return False
+        index = project_index.load_index( file_path)
+        if index is None:
+            return False
+
+        self._global_scale = 1
+        self._global_matrix = mathutils.Matrix.Scale(self._global_scale, 4)
+        self._textures_set = set()
+        self._emitted_textures = set()
+        self._captured_textures = None
+
+        replacements = {}
+        for scope, emit in ( ( ( "project", "scene"), self.__emit_camera),
+                             ( ( "project", "output"), self.__emit_frame_element),
+                             ( ( "project", "configurations"), lambda scene: scene_serializer.write_all( self._output_file, self.__get_configurations( scene)))):
+            buffer = io.BytesIO()
+            self._output_file = xml_emitter.XmlEmitter( buffer, level = len( scope), index = True)
+            emit( scene)
+            self._output_file.flush()
+            data = buffer.getvalue()
+            for entry_scope, kind, name, level, start, end in self._output_file.get_index():
+                if len( entry_scope) == 0:
+                    replacements[( scope, kind, name)] = data[start:end]
+
+        try:
+            if not project_index.patch_project( file_path, index, replacements):
+                return False
+        except IOError:
+            self.__error("Could not write to {0}.".format(file_path))
+            return False
+        self.__info("Patched camera and render settings of {0}.".format(file_path))
+        export_state.get_state().end_export( file_path, scene)
+        return True
+
+    def update( self, scene, file_path):
+        '''
+        Bring the project file up to date with the scene: keep it if nothing changed since it was
+        exported, patch it if only render settings changed, and export it again otherwise.
+        '''
+        state = export_state.get_state()
+        # Count the edits the update handler was not told about yet.
+        state.flush_updates( scene)
+        changes = state.get_changes( file_path, scene)
+        if changes == 'none':
+            self.__info("Scene '{0}' is unchanged since the last export, keeping {1}.".format(scene.name, file_path))
+            return
+        if changes == 'settings' and self.patch( scene, file_path):
+            return
+        self.export( scene, file_path)
+
     #----------------------------------------------------------------------------------------------
     # Export the project.
     #----------------------------------------------------------------------------------------------
@@ -147,12 +270,45 @@ class write_project_file( object):
     #----------------------------------------------------------------------------------------------
 
     def __emit_scene(self, scene):
-        self.__open_element( "scene")
-        self.__emit_camera( scene)
-        self.__emit_environment( scene)
-        self.__emit_assembly( scene)
-        self.__emit_assembly_instance( scene)
-        self.__close_element( "scene")
+        current_frame = scene.frame_current
+        try:
+            # Sample everything that moves in a single sweep, then emit the scene at shutter open.
+            self.__sample_motion( scene)
+            self.__open_element( "scene")
+            self.__emit_camera( scene)
+            self.__emit_environment( scene)
+            self.__emit_assembly( scene)
+            self.__emit_assembly_instance( scene)
+            self.__close_element( "scene")
+        finally:
+            # Reset timeline.
+            if scene.appleseed.mblur_enable:
+                scene.frame_set( current_frame)
+
+    #--------------------------------
+    def __sample_motion( self, scene):
+        '''
+        Sample the camera, object, dupli and particle transformations at shutter close and shutter open,
+        writing the deformation motion blur meshes while the scene is at shutter close.
+        The scene is left at shutter open.
+        '''
+        self._motion = util.MotionSnapshot()
+        # Objects whose deformation motion blur geometry was written during the sweep.
+        self._def_mblur_sampled = set()
+        # Object name -> (mesh file path, mesh buffers) of the vertex-only deformation keys
+        # waiting for the shutter open mesh.
+        self._def_mblur_keys = {}
+        if scene.appleseed.mblur_enable:
+            self._motion = util.sample_motion( scene, self._global_matrix, lambda: self.__emit_def_geometry_objects( scene), self._dupli_cache)
+
+    #--------------------------------
+    def __emit_def_geometry_objects( self, scene):
+        '''
+        Write the deformation motion blur geometry of every exported object.
+        '''
+        for object in scene.objects:
+            if util.do_export( object, scene) and object.type != 'LAMP' and util.def_mblur_enabled( object, scene):
+                self.__emit_def_geometry( scene, object)
 
     #--------------------------------
     def __emit_assembly(self, scene):
@@ -171,33 +327,13 @@ class write_project_file( object):
         Write a scene assembly instance,
         or write an assembly instance for an object with transformation motion blur.
         '''
-        asr_scn = scene.appleseed
-        shutter_open = asr_scn.shutter_open if asr_scn.mblur_enable else 0
-        shutter_close = asr_scn.shutter_close if asr_scn.mblur_enable else 1
         if obj is not None:
-            # Write object assembly for an object with motion blur.
+            # Write object assembly for an object with motion blur, with the matrices sampled at each motion key.
             obj_name = obj.name
-            self.__open_element( 'assembly_instance name="%s_instance" assembly="%s"' % (obj_name, obj_name))
-            current_frame = scene.frame_current
-
-            # Advance to shutter open, collect matrix.
-            scene.frame_set( current_frame, subframe = shutter_open)
-            instance_matrix = self._global_matrix * obj.matrix_world
-
-            # Advance to next frame, collect matrix.
-            scene.frame_set( current_frame, subframe = shutter_close)
-            next_matrix = self._global_matrix * obj.matrix_world
-
-            # Reset timeline.
-            scene.frame_set( current_frame)
-
-            self.__emit_transform_element( instance_matrix, 0)
-            self.__emit_transform_element( next_matrix, 1)
-            self.__close_element( "assembly_instance")
+            self.__write( scene_ir.AssemblyInstance( "%s_instance" % obj_name, obj_name, self.__get_motion_transforms( self._motion.matrices[obj_name])))
         else:
             # No object, write an assembly for the whole scene.
-            self.__open_element( 'assembly_instance name="%s_instance" assembly="%s"' % (scene.name, scene.name))
-            self.__close_element( "assembly_instance")
+            self.__write( scene_ir.AssemblyInstance( "%s_instance" % scene.name, scene.name, []))
 
     #--------------------------------
     def __emit_object_assembly( self, scene, object):
@@ -212,49 +348,30 @@ class write_project_file( object):
         self.__close_element( "assembly")
 
     #--------------------------------
-    def __emit_dupli_assembly( self, scene, object, matrices):
+    def __emit_dupli_assembly( self, scene, object, transforms):
         ''' 
-        Write an assembly for a dupli/particle with transformation motion blur.
+        Write an instance of the assembly of a dupli/particle with transformation motion blur.
+        The assembly is shared by all the duplis of the same object and only written the first time,
+        from the object alone: the transforms of each dupli, one per motion key, are on its assembly instance.
         '''
-        object_name = object.name
-        # Figure out the instance number of this assembly instance.
-        if object_name in self._assembly_count:
-            instance_index = self._assembly_count[object_name] + 1
-        else:
-            instance_index = 0
-        self._assembly_count[object_name] = instance_index
+        assembly_name, new_assembly, assembly_instance = self._dupli_assemblies.place( object.name, transforms)
+        if new_assembly:
+            self.__open_element( 'assembly name="%s"' % assembly_name)
+            self.__emit_physical_surface_shader_element()
+            self.__emit_default_material( scene)
+            self.__emit_dupli_object( scene, object, identity_matrix, True, new_assembly = True)
+            self.__close_element( "assembly")
+        # Emit the instance of the dupli object assembly.
+        self.__write( assembly_instance)
 
-        assembly_name = "%s_%d" % ( object_name, instance_index)
-        self.__open_element( 'assembly name="%s"' % assembly_name)
-        self.__emit_physical_surface_shader_element()
-        self.__emit_default_material( scene)
-        self.__emit_dupli_object( scene, object, matrices, True, new_assembly = True)
-        self.__close_element( "assembly")
-        # Emit an instance of the dupli object assembly.
-        self.__emit_dupli_assembly_instance( scene, assembly_name, matrices)
-        
-    #--------------------------------     
-    def __emit_dupli_assembly_instance( self, scene, assembly_name, matrices):
+    #--------------------------------
+    def __get_motion_transforms( self, matrices):
         '''
-        Write an instance of the dupli object assembly (for duplis/particles with motion blur).
+        Return one transform per motion key.
+        matrices are mathutils matrices or 4x4 arrays, converted with the global matrix in one batch.
         '''
-        asr_scn = scene.appleseed
-        # Figure out the instance number of this assembly instance.
-        if assembly_name in self._assembly_instance_count:
-            instance_index = self._assembly_instance_count[assembly_name] + 1
-        else:
-            instance_index = 0
-        self._assembly_instance_count[assembly_name] = instance_index
-        
-        self.__open_element( 'assembly_instance name="%s.instance_%d" assembly="%s"' % (assembly_name, instance_index, assembly_name))
-
-        instance_matrix = self._global_matrix * matrices[0].copy()
-        next_matrix = self._global_matrix * matrices[1].copy()
-        
-        # Emit transformation matrices with their respective times.
-        self.__emit_transform_element( instance_matrix, 0)
-        self.__emit_transform_element( next_matrix, 1)
-        self.__close_element( "assembly_instance")
+        rows = instance_encoder.swap_axes( instance_encoder.get_instance_matrices( self._global_matrix, matrices))
+        return instance_encoder.get_motion_transforms( rows, self._motion.times)
 
     #--------------------------------
     def __emit_objects( self, scene):
@@ -262,28 +379,31 @@ class write_project_file( object):
         Emit the objects in the scene.
         '''
         for object in scene.objects:
-            if util.do_export( object, scene):  # Skip objects marked as non-renderable.
+            group_instance = util.do_export_group_instance( object, scene)
+            if group_instance or util.do_export( object, scene):  # Skip objects marked as non-renderable.
                 if object.type == 'LAMP':
                     self.__emit_light( scene, object)
+                elif object.name in self._instance_sources:
+                    continue
+                elif group_instance:
+                    self.__emit_group_instance( scene, object)
                 else:
                     self._dupli_objects.clear()
                     if util.ob_mblur_enabled( object, scene):
                         if object.is_duplicator and object.dupli_type in {'VERTS', 'FACES'}:
                             # Motion blur enabled on a dupli parent 
-                            self._dupli_objects = util.get_instances( object, scene)
+                            self._dupli_objects = self._motion.duplis.get( object.name, [])
                             for dupli_obj in self._dupli_objects:
                                 # Each "dupli" in dupli_objects is a nested list: [dupli.object, [object.matrix1, object.matrix2]]
                                 inst_mats = dupli_obj[1]
-                                self.__emit_dupli_assembly( scene, dupli_obj[0], inst_mats )
+                                self.__emit_dupli_assembly( scene, dupli_obj[0], self.__get_motion_transforms( inst_mats))
                          
                         elif util.is_psys_emitter( object):
                             # Motion blur enabled on a particle system emitter.
-                            particle_obs = util.get_psys_instances( object, scene)
-                            for ob in particle_obs:             # each 'ob' is a particle, as dict key
-                                                                # The value is a list: dupli.object and another list of two matrices
-                                dupli_obj = particle_obs[ob][0]     # The dupli.object
-                                inst_mats = particle_obs[ob][1]     # The list of matrices
-                                self.__emit_dupli_assembly( scene, dupli_obj, inst_mats)
+                            particle_obs = self._motion.particles.get( object.name, [])
+                            for particle_ob in particle_obs:    # Each "particle_ob" is a list: dupli.object and the rows of its transforms
+                                # The particle transforms are already converted with the global matrix.
+                                self.__emit_dupli_assembly( scene, particle_ob[0], instance_encoder.get_motion_transforms( particle_ob[1], self._motion.times))
                                  
                             if util.render_emitter( object):
                                 self.__emit_object_assembly( scene, object)
@@ -295,6 +415,64 @@ class write_project_file( object):
                     else:
                         # No motion blur enabled.
                         self.__emit_geometric_object( scene, object, False)
+                    self._dupli_cache.release( object)
+
+    #--------------------------------
+    def __emit_group_instance( self, scene, object):
+        '''
+        Write an assembly instance placing the dupli group of the object, and the assembly
+        of the group the first time it is placed in the enclosing assembly.
+        '''
+        group = object.dupli_group
+        if group.name in self._group_stack:
+            self.__warning("Skipping dupli group '{0}' placed by '{1}' because the group contains itself.".format( group.name, object.name))
+            return
+
+        assembly_name = "%s_group" % group.name
+        if assembly_name not in self._group_assemblies[-1]:
+            self._group_assemblies[-1].add( assembly_name)
+            self.__emit_group_assembly( scene, group, assembly_name)
+
+        # The objects of the assembly are already converted with the global matrix.
+        offset_matrix = mathutils.Matrix.Translation( -group.dupli_offset)
+        global_inverse = self._global_matrix.inverted()
+        if util.ob_mblur_enabled( object, scene) and object.name in self._motion.matrices:
+            # The matrices sampled at each motion key.
+            transforms = [self.__get_transform( self._global_matrix * matrix * offset_matrix * global_inverse, time)
+                          for time, matrix in zip( self._motion.times, self._motion.matrices[object.name])]
+        else:
+            transforms = [self.__get_transform( self._global_matrix * object.matrix_world * offset_matrix * global_inverse, None)]
+        self.__write( scene_ir.AssemblyInstance( "%s_instance" % object.name, assembly_name, transforms))
+
+    #--------------------------------
+    def __emit_group_assembly( self, scene, group, assembly_name):
+        '''
+        Write the assembly of a dupli group. Dupli groups placed by its objects become nested assemblies.
+        '''
+        self.__open_element( 'assembly name="%s"' % assembly_name)
+        self.__emit_physical_surface_shader_element()
+        self.__emit_default_material( scene)
+
+        self._group_stack.append( group.name)
+        self._group_assemblies.append( set())
+        # Instances, materials and shared meshes of the enclosing assemblies are not visible from this one.
+        enclosing_scope = ( self._instance_count, self._emitted_materials, self._mesh_sources, self._shared_meshes)
+        self._instance_count = {}
+        self._emitted_materials = {}
+        self._mesh_sources = {}
+        self._shared_meshes = {}
+
+        for member in group.objects:
+            if util.is_group_instance( member):
+                self.__emit_group_instance( scene, member)
+            elif not member.hide_render and member.type in { 'MESH', 'SURFACE', 'META', 'TEXT', 'CURVE'}:
+                self.__emit_geometric_object( scene, member, False)
+                self._dupli_cache.release( member)
+
+        self._instance_count, self._emitted_materials, self._mesh_sources, self._shared_meshes = enclosing_scope
+        self._group_assemblies.pop()
+        self._group_stack.pop()
+        self.__close_element( "assembly")
 
     #----------------------------------------------------------------------------------------------
     # Geometry.
@@ -310,11 +488,11 @@ class write_project_file( object):
             self._dupli_objects.clear()
 
             if object.parent and object.parent.dupli_type in { 'VERTS', 'FACES' }:  
-                # todo: what about dupli type 'GROUP'?
+                # Emitted as duplis of the parent.
                 return
 
             if object.is_duplicator:
-                self._dupli_objects.extend( util.get_instances( object, scene))
+                self._dupli_objects.extend( util.get_instances( object, scene, self._dupli_cache))
                 if util.is_psys_emitter( object) and util.render_emitter( object):
                     self._dupli_objects.append( [object, object.matrix_world])
                     
@@ -327,17 +505,34 @@ class write_project_file( object):
             self._dupli_objects = [ (object, identity_matrix)]
             
         # Emit the dupli objects.
-        for dupli_object in self._dupli_objects:
-            self.__emit_dupli_object( scene, dupli_object[0], dupli_object[1], ob_mblur)
+        if scene.appleseed.instancing_mode == 'compact' and not ob_mblur:
+            self.__emit_dupli_objects_compact( scene, self._dupli_objects)
+        else:
+            for dupli_object in self._dupli_objects:
+                self.__emit_dupli_object( scene, dupli_object[0], dupli_object[1], ob_mblur)
+
+    #--------------------------------
+    def __emit_dupli_objects_compact( self, scene, dupli_objects):
+        '''
+        Emit objects / dupli objects, writing the new instances of objects already emitted in one batch per object.
+        '''
+        batches = {}
+        for dupli_object, dupli_matrix in dupli_objects:
+            export_hair = scene.appleseed.export_hair and util.has_hairsys( dupli_object)
+            if dupli_object.name in self._instance_count and not export_hair:
+                # The mesh object and its materials are already emitted: only the instance is new.
+                batches.setdefault( dupli_object.name, ( dupli_object, []))[1].append( dupli_matrix)
+            else:
+                self.__emit_dupli_object( scene, dupli_object, dupli_matrix, False)
+
+        for dupli_object, matrices in batches.values():
+            self.__emit_object_instances_compact( scene, dupli_object, matrices)
 
     #--------------------------------
     def __emit_dupli_object(self, scene, object, object_matrix, ob_mblur, new_assembly = False):
         '''
         Emit objects / dupli objects.
         '''
-        asr_scn = scene.appleseed
-        shutter_open = asr_scn.shutter_open if asr_scn.mblur_enable else 0
-        current_frame = scene.frame_current
         # Emit the mesh object (and write it to disk) only the first time it is encountered.
         # If it's a new assembly (for dupli motion blur), only emit the object without tesselating mesh.
         export_mesh = True
@@ -349,44 +544,20 @@ class write_project_file( object):
                     if not util.render_emitter( object):
                         export_mesh = False
                         
-                #-----------------------------------------------------------------------
-                # If deformation motion blur is enabled, write deformation mesh to disk.
-                if util.def_mblur_enabled( object, scene):
+                # If deformation motion blur is enabled, the deformation mesh is written by the motion pre-pass.
+                if util.def_mblur_enabled( object, scene) and object.name not in self._def_mblur_sampled:
+                    # Not reached by the pre-pass (e.g. instanced by a dupli parent): sample it now.
+                    asr_scn = scene.appleseed
+                    current_frame = scene.frame_current
                     scene.frame_set( current_frame, subframe = asr_scn.shutter_close)
-                    # Tessellate the object at the next frame to export mesh for deformation motion blur.
-                    if export_mesh:
-                        def_mesh = object.to_mesh( scene, True, 'RENDER', calc_tessface = True)
-                        mesh_faces = def_mesh.tessfaces
-                        mesh_uvtex = def_mesh.tessface_uv_textures
-                        # Write the deformation motion blur mesh to disk.
-                        self.__emit_def_mesh_object( scene, object, def_mesh, mesh_faces, mesh_uvtex)
-                        # Delete the mesh.
-                        bpy.data.meshes.remove( def_mesh)
-                        
-                    if export_hair:
-                        for mod in object.modifiers:
-                            if mod.type == 'PARTICLE_SYSTEM' and mod.show_render:
-                                psys = mod.particle_system
-                                if psys.settings.type == 'HAIR' and psys.settings.render_type == 'PATH':
-                                    mat_index = psys.settings.material - 1
-                                    material = object.material_slots[mat_index].name
-                                    # Write the deformation motion blur hair mesh to disk.
-                                    self.__emit_def_curves_object( scene, object, psys.name)
-
-                    # Reset the timeline to current frame
-                    scene.frame_set( current_frame) 
-                #-----------------------------------------------------------------------
-                
-                # Tessellate the object at shutter open.
-                scene.frame_set( current_frame, subframe = shutter_open)
+                    self.__emit_def_geometry( scene, object)
+                    scene.frame_set( current_frame, subframe = asr_scn.shutter_open)
+
+                # The scene is at shutter open.
                 if export_mesh:
-                    mesh = object.to_mesh(scene, True, 'RENDER', calc_tessface = True)
-                    mesh_faces = mesh.tessfaces
-                    mesh_uvtex = mesh.tessface_uv_textures
-                    # Write the geometry to disk and emit a mesh object element.
-                    self._mesh_parts[object.name] = self.__emit_mesh_object(scene, object, mesh, mesh_faces, mesh_uvtex, new_assembly)
-                    # Delete the mesh
-                    bpy.data.meshes.remove( mesh)
+                    # Objects in their own assembly, or with per-object deformation or hair files, cannot share a mesh object.
+                    shareable = not ( ob_mblur or new_assembly or export_hair or util.def_mblur_enabled( object, scene))
+                    self.__emit_mesh_geometry( scene, object, new_assembly, shareable)
                     
                 if export_hair:
                     for mod in object.modifiers:
@@ -401,9 +572,6 @@ class write_project_file( object):
                                 # Emit the curves object instance.
                                 self.__emit_mesh_object_instance( scene, object, self._global_matrix, new_assembly, hair = True, hair_material = material, psys_name = psys.name)
 
-                # Reset timeline.
-                scene.frame_set( current_frame)
-
             except RuntimeError:
                 self.__info("Skipping object '{0}' of type '{1}' because it could not be converted to a mesh.".format(object.name, object.type))
                 return
@@ -412,6 +580,63 @@ class write_project_file( object):
         if export_mesh:
             self.__emit_mesh_object_instance( scene, object, object_matrix, new_assembly)
 
+    #--------------------------------
+    def __emit_mesh_geometry( self, scene, object, new_assembly, shareable):
+        '''
+        Evaluate the object's mesh, write it to disk and emit its mesh object element, unless
+        the mesh file is up to date or an object with the same geometry was already emitted.
+        '''
+        fingerprint = self.__get_mesh_fingerprint( scene, object)
+        shared_keys = []
+        if shareable:
+            # Linked duplicates without modifiers evaluate to the same mesh.
+            if object.type != 'META' and len( object.modifiers) == 0:
+                shared_keys.append(( "data", object.data.as_pointer()))
+            if fingerprint is not None:
+                shared_keys.append(( "fingerprint", fingerprint))
+            if self.__share_mesh( object, shared_keys):
+                return
+
+        mesh_parts = self.__get_cached_mesh_parts( scene, object, fingerprint)
+        if mesh_parts is not None:
+            # Unchanged since the last export: emit the mesh object element without evaluating the modifiers.
+            self._mesh_parts[object.name] = mesh_parts
+            self.__emit_object_element( object.name, object.name + self.__get_mesh_extension( scene), object, scene)
+        else:
+            mesh = object.to_mesh(scene, True, 'RENDER', calc_tessface = True)
+            arrays = None
+            mesh_key = None
+            if shareable:
+                # The buffers and their hash are reused to write the mesh file.
+                arrays = mesh_writer.get_mesh_arrays( mesh)
+                mesh_key = mesh_encoder.hash_mesh_arrays( arrays, self.__get_mesh_cache_salt( scene))
+                shared_keys.append(( "geometry", mesh_key))
+                if self.__share_mesh( object, shared_keys):
+                    bpy.data.meshes.remove( mesh)
+                    return
+            mesh_faces = mesh.tessfaces
+            mesh_uvtex = mesh.tessface_uv_textures
+            # Write the geometry to disk and emit a mesh object element.
+            self._mesh_parts[object.name] = self.__emit_mesh_object(scene, object, mesh, mesh_faces, mesh_uvtex, new_assembly, fingerprint, arrays, mesh_key)
+            # Delete the mesh
+            bpy.data.meshes.remove( mesh)
+
+        for key in shared_keys:
+            self._shared_meshes[key] = object.name
+
+    #--------------------------------
+    def __share_mesh( self, object, shared_keys):
+        '''
+        Make the object instance the mesh object of an already emitted object with the same geometry, if any.
+        '''
+        for key in shared_keys:
+            source_name = self._shared_meshes.get( key)
+            if source_name is not None:
+                self._mesh_sources[object.name] = source_name
+                self._mesh_parts[object.name] = self._mesh_parts[source_name]
+                return True
+        return False
+
     #--------------------------------
     def __emit_curves_object( self, scene, object, psys, new_assembly = False):
         '''
@@ -450,85 +675,225 @@ class write_project_file( object):
         
         
     #--------------------------------
-    def __emit_mesh_object( self, scene, object, mesh, mesh_faces, mesh_uvtex, new_assembly):
+    def __emit_mesh_object( self, scene, object, mesh, mesh_faces, mesh_uvtex, new_assembly, fingerprint = None, arrays = None, mesh_key = None):
         '''
         Emit the mesh object element and write to disk.
+        arrays and mesh_key are passed on to __write_mesh().
         Return mesh parts to self._mesh_parts[object.name]
         '''
         if len( mesh_faces) == 0:
             self.__info("Skipping object '{0}' since it has no faces once converted to a mesh.".format(object.name))
+            if object.name in self._def_mblur_keys:
+                # No shutter open topology to share: write the whole deformation mesh.
+                self.__write_def_mesh_key( scene, object, None)
             return []
 
         object_name = object.name
+        # Deformation keys that only carry positions and normals need the normals of this mesh indexed by vertex and face.
+        vertex_keys = object_name in self._def_mblur_keys
+        if vertex_keys and arrays is None:
+            arrays = mesh_writer.get_mesh_arrays( mesh)
             
-        mesh_filename = object_name + ".obj"
+        mesh_filename = object_name + self.__get_mesh_extension( scene)
         meshes_path = os.path.join( util.realpath( scene.appleseed.project_path), "meshes")
         export_mesh = False
         if scene.appleseed.generate_mesh_files:
             mesh_filepath = os.path.join( meshes_path, mesh_filename)
             if not os.path.exists( meshes_path):
                 os.mkdir( meshes_path)
-            if scene.appleseed.export_mode == 'all':
-                export_mesh = True
-            if scene.appleseed.export_mode == 'partial' and not os.path.exists( mesh_filepath):
+            if scene.appleseed.export_mode in { 'all', 'partial'}:
                 export_mesh = True
             if scene.appleseed.export_mode == 'selected' and object.name in self._selected_objects:
                 export_mesh = True
             if new_assembly and object.name in self._instance_count:
                 export_mesh = False
+            if object_name in self._written_meshes:
+                # Already written for another assembly.
+                export_mesh = False
             if export_mesh:
-                # Export the mesh to disk.
-                self.__progress("Exporting object '{0}' to {1}...".format( object_name, mesh_filename))
+                # Export the mesh to disk, unless the cached file is up to date.
                 try:
-                    mesh_parts = mesh_writer.write_mesh_to_disk( object, scene, mesh, mesh_filepath)
+                    mesh_parts = self.__write_mesh( scene, object, mesh, mesh_filepath, use_cache = scene.appleseed.export_mode == 'partial', fingerprint = fingerprint,
+                                                    arrays = arrays, mesh_key = mesh_key, source_normals = vertex_keys)
                 except IOError:
                     self.__error("While exporting object '{0}': could not write to {1}, skipping this object.".format(object.name, mesh_filepath))
                     return []
+                self._written_meshes.add( object_name)
                     
         if scene.appleseed.generate_mesh_files == False or export_mesh == False:
             # Build a list of mesh parts just as if we had exported the mesh to disk.
             material_indices = set()
             for face in mesh_faces:
                 material_indices.add( face.material_index)
-            mesh_parts = map(lambda material_index : ( material_index, "part_%d" % material_index), material_indices)
+            mesh_parts = [( material_index, "part_%d" % material_index) for material_index in material_indices]
             
+        if vertex_keys:
+            # Write the deformation key against the shutter open topology.
+            self.__write_def_mesh_key( scene, object, arrays)
+
         # Emit object.
         self.__emit_object_element( object_name, mesh_filename, object, scene)
 
         return mesh_parts
 
+    #--------------------------------
+    def __get_mesh_extension( self, scene):
+        return ".binarymesh" if scene.appleseed.mesh_file_format == 'binarymesh' else ".obj"
+
+    #--------------------------------
+    def __get_mesh_cache_salt( self, scene):
+        '''
+        Export settings that change the contents of a mesh file, folded into its cache key.
+        '''
+        asr_scn = scene.appleseed
+        if asr_scn.mesh_file_format == 'obj':
+            # The legacy export method ignores the tolerance and precision settings.
+            return "obj %s %r %s %d" % ( asr_scn.mesh_export_method, asr_scn.normal_tolerance, asr_scn.float_precision, asr_scn.float_digits)
+        return asr_scn.mesh_file_format
+
+    #--------------------------------
+    def __get_mesh_fingerprint( self, scene, object):
+        '''
+        Fingerprint of the unevaluated object, or None if its mesh always has to be evaluated.
+        Objects that did not change since the previous export keep their fingerprint.
+        Only computed when the mesh cache can skip the evaluation: the 'all' export mode writes
+        every mesh, and shares meshes by data and geometry only.
+        '''
+        asr_scn = scene.appleseed
+        if not asr_scn.generate_mesh_files or asr_scn.export_mode == 'all' or util.def_mblur_enabled( object, scene):
+            return None
+        return self._export_state.get_fingerprint( object, scene, self.__get_mesh_cache_salt( scene))
+
+    #--------------------------------
+    def __get_cached_mesh_parts( self, scene, object, fingerprint):
+        '''
+        Return the mesh parts recorded in the mesh cache if the mesh file on disk
+        is up to date and does not need to be written, None otherwise.
+        '''
+        if fingerprint is None:
+            return None
+        export_mode = scene.appleseed.export_mode
+        if export_mode == 'partial' or ( export_mode == 'selected' and object.name not in self._selected_objects):
+            return self._mesh_cache.lookup_fingerprint( object.name + self.__get_mesh_extension( scene), fingerprint)
+        return None
+
+    #--------------------------------
+    def __write_mesh( self, scene, object, mesh, mesh_filepath, use_cache = False, fingerprint = None, arrays = None, mesh_key = None, source_normals = False):
+        '''
+        Write the mesh to disk with the format and export method selected in the scene settings.
+        If use_cache is set, the file is only written when the content hash of the mesh
+        differs from the one recorded when the file was last written.
+        Pass arrays, with or instead of mesh, to write buffers already extracted with mesh_writer.get_mesh_arrays(),
+        and mesh_key if their content hash is already known.
+        If source_normals is set, normals are written per vertex and face rather than deduplicated by value,
+        so that the deformation motion keys of the mesh have the same normals.
+        Return the mesh parts.
+        '''
+        mesh_filename = os.path.basename( mesh_filepath)
+        obj_options = mesh_writer.get_obj_options( scene)
+        salt = self.__get_mesh_cache_salt( scene)
+        if source_normals:
+            obj_options["normal_tolerance"] = None
+            salt += " source normals"
+            mesh_key = None
+        if arrays is None:
+            arrays = mesh_writer.get_mesh_arrays( mesh)
+            mesh_key = None
+        if mesh_key is None:
+            mesh_key = mesh_encoder.hash_mesh_arrays( arrays, salt)
+        if use_cache:
+            mesh_parts = self._mesh_cache.lookup( mesh_filename, mesh_key)
+            if mesh_parts is not None:
+                self.__info("Object '{0}' is unchanged, keeping {1}.".format( object.name, mesh_filename))
+                # Remember the new fingerprint so that the next export skips the evaluation.
+                self._mesh_cache.store( mesh_filename, mesh_key, mesh_parts, fingerprint)
+                return mesh_parts
+
+        self.__progress("Exporting object '{0}' to {1}...".format( object.name, mesh_filename))
+        use_encoder = mesh is None or source_normals or scene.appleseed.mesh_file_format == 'binarymesh' or scene.appleseed.mesh_export_method == 'numpy'
+        if use_encoder and self._mesh_pool.parallel:
+            # Hand the buffers over to a worker process and move on to the next object.
+            self._mesh_pool.submit( arrays, scene.appleseed.mesh_file_format, mesh_filepath, obj_options)
+            mesh_parts = mesh_encoder.get_mesh_parts( arrays)
+        elif scene.appleseed.mesh_file_format == 'binarymesh':
+            mesh_parts = mesh_writer.write_binarymesh_to_disk( object, scene, mesh, mesh_filepath, arrays = arrays)
+        elif use_encoder:
+            mesh_parts = mesh_writer.write_mesh_to_disk_numpy( object, scene, mesh, mesh_filepath, arrays = arrays, obj_options = obj_options)
+        else:
+            mesh_parts = mesh_writer.write_mesh_to_disk( object, scene, mesh, mesh_filepath)
+        if mesh_parts is not None:
+            self._mesh_cache.store( mesh_filename, mesh_key, mesh_parts, fingerprint)
+        return mesh_parts
+
+    #--------------------------------
+    def __join_mesh_pool( self):
+        '''
+        Wait for the mesh files being written in the background and report those that failed.
+        '''
+        for mesh_filepath, exception in self._mesh_pool.join():
+            self.__error("Could not write {0}: {1}.".format( mesh_filepath, exception))
+            self._mesh_cache.discard( os.path.basename( mesh_filepath))
+
     #--------------------------------
     def __emit_object_element( self, object_name, mesh_file, object, scene):
         '''
         Emit an object element to the project file.
         '''
-        mesh_filename = "meshes" + os.path.sep + mesh_file
-        self.__open_element('object name="' + object_name + '" model="mesh_object"')
-        if util.def_mblur_enabled( object, scene):
-            self.__open_element('parameters name="filename"')
-            self.__emit_parameter("0", mesh_filename)
-            self.__emit_parameter("1", "meshes" + os.path.sep + self._def_mblur_obs[object_name])
-            self.__close_element("parameters")
-        else:
-            self.__emit_parameter("filename", mesh_filename)
-        self.__close_element("object")
+        self.__write( self.__get_object_entity( object_name, "mesh_object", "filename", mesh_file, object, scene))
 
     #--------------------------------
     def __emit_curves_element( self, curves_name, curves_file, object, scene):
         '''
         Emit a curves object element to the project file.
         '''
-        curves_filename = "meshes" + os.path.sep + curves_file
-        self.__open_element('object name="' + curves_name + '" model="curve_object"')
+        self.__write( self.__get_object_entity( curves_name, "curve_object", "filepath", curves_file, object, scene))
+
+    #--------------------------------
+    def __get_object_entity( self, object_name, model, file_parameter, file_name, object, scene):
+        '''
+        Return the object entity of a mesh or curves file, with the file at shutter close
+        when the object has deformation motion blur.
+        '''
+        file_path = "meshes" + os.path.sep + file_name
+        entity = scene_ir.Entity( "object", object_name, model)
         if util.def_mblur_enabled( object, scene):
-            self.__open_element('parameters name="filepath"')
-            self.__emit_parameter("0", curves_filename)
-            self.__emit_parameter("1", "meshes" + os.path.sep + self._def_mblur_obs[curves_name])
-            self.__close_element("parameters")
+            entity.groups.append( scene_ir.ParameterGroup( file_parameter, [( "0", file_path),
+                                                                            ( "1", "meshes" + os.path.sep + self._def_mblur_obs[object_name])]))
         else:
-            self.__emit_parameter("filepath", curves_filename)
-        self.__close_element("object")
-        
+            entity.parameters.append( ( file_parameter, file_path))
+        return entity
+
+    # --------------------------------------------------
+    # Write deformation mblur geometry at shutter close.
+    # --------------------------------------------------
+    def __emit_def_geometry( self, scene, object):
+        '''
+        Write the deformation mesh and hair of an object. The scene must be at shutter close.
+        '''
+        self._def_mblur_sampled.add( object.name)
+        export_hair = scene.appleseed.export_hair and util.has_hairsys( object)
+        try:
+            if not export_hair or util.render_emitter( object):
+                # Tessellate the object to export mesh for deformation motion blur.
+                def_mesh = object.to_mesh( scene, True, 'RENDER', calc_tessface = True)
+                mesh_faces = def_mesh.tessfaces
+                mesh_uvtex = def_mesh.tessface_uv_textures
+                # Write the deformation motion blur mesh to disk.
+                self.__emit_def_mesh_object( scene, object, def_mesh, mesh_faces, mesh_uvtex)
+                # Delete the mesh.
+                bpy.data.meshes.remove( def_mesh)
+        except RuntimeError:
+            # The object is skipped when it is emitted at shutter open.
+            return
+
+        if export_hair:
+            for mod in object.modifiers:
+                if mod.type == 'PARTICLE_SYSTEM' and mod.show_render:
+                    psys = mod.particle_system
+                    if psys.settings.type == 'HAIR' and psys.settings.render_type == 'PATH':
+                        # Write the deformation motion blur hair mesh to disk.
+                        self.__emit_def_curves_object( scene, object, psys)
+
     # --------------------------------------------------
     # Emit object mesh for deformation mblur evaluation.
     # --------------------------------------------------
@@ -541,7 +906,7 @@ class write_project_file( object):
             return []
 
         object_name = object.name            
-        mesh_filename = object_name + "_deform.obj"
+        mesh_filename = object_name + "_deform" + self.__get_mesh_extension( scene)
 
         self._def_mblur_obs[object_name] = mesh_filename
 
@@ -551,20 +916,39 @@ class write_project_file( object):
             mesh_filepath = os.path.join( meshes_path, mesh_filename)
             if not os.path.exists( meshes_path):
                 os.mkdir( meshes_path)
-            if scene.appleseed.export_mode == 'all':
-                export_mesh = True
-            if scene.appleseed.export_mode == 'partial' and not os.path.exists( mesh_filepath):
+            if scene.appleseed.export_mode in { 'all', 'partial'}:
                 export_mesh = True
             if scene.appleseed.export_mode == 'selected' and object.name in self._selected_objects:
                 export_mesh = True
-            if export_mesh:
-                # Export the mesh to disk.
-                self.__progress("Exporting object '{0}' to {1}...".format( object_name, mesh_filename))
+            if export_mesh and scene.appleseed.def_mblur_keys == 'vertex':
+                # Written once the shutter open mesh is known, see __write_def_mesh_key.
+                self._def_mblur_keys[object_name] = ( mesh_filepath, mesh_writer.get_mesh_arrays( mesh))
+            elif export_mesh:
+                # Export the mesh to disk, unless the cached file is up to date.
                 try:
-                    mesh_writer.write_mesh_to_disk( object, scene, mesh, mesh_filepath)
+                    self.__write_mesh( scene, object, mesh, mesh_filepath, use_cache = scene.appleseed.export_mode == 'partial')
                 except IOError:
                     self.__error("While exporting object '{0}': could not write to {1}, skipping this object.".format(object.name, mesh_filepath))
 
+    #--------------------------------
+    def __write_def_mesh_key( self, scene, object, open_arrays):
+        '''
+        Write the vertex-only deformation key of an object. When the topology at shutter close
+        matches the shutter open mesh buffers, only the positions and normals of the vertices and faces are written,
+        with the faces of the shutter open mesh. Otherwise, or without open_arrays, the full mesh is written.
+        '''
+        mesh_filepath, def_arrays = self._def_mblur_keys.pop( object.name)
+        source_normals = open_arrays is not None and mesh_encoder.same_topology( open_arrays, def_arrays)
+        if source_normals:
+            def_arrays = mesh_encoder.get_vertex_key_arrays( def_arrays, open_arrays)
+        elif open_arrays is not None:
+            self.__info("Topology of object '{0}' changes while the shutter is open, writing a full deformation mesh.".format( object.name))
+        try:
+            self.__write_mesh( scene, object, None, mesh_filepath, use_cache = scene.appleseed.export_mode == 'partial', arrays = def_arrays,
+                               source_normals = source_normals)
+        except IOError:
+            self.__error("While exporting object '{0}': could not write to {1}, skipping this object.".format(object.name, mesh_filepath))
+
     # --------------------------------------------------
     # Emit curves object for deformation mblur evaluation.
     # --------------------------------------------------
@@ -621,7 +1005,7 @@ class write_project_file( object):
                 continue
             if new_assembly or material not in self._emitted_materials:
                 # Need to emit material again if it's in a separate assembly.
-                self._emitted_materials[material] = self.__emit_material(material, scene)
+                self._emitted_materials[material] = self.__emit_cached_material(material, scene)
 
         # Figure out the instance number of this object.
         if not new_assembly and object_name in self._instance_count:
@@ -631,14 +1015,17 @@ class write_project_file( object):
         self._instance_count[object_name] = instance_index
 
         # Emit object parts instances.
+        mesh_object_name = self._mesh_sources.get( object_name, object_name)
         for (material_index, mesh_name) in self._mesh_parts[object_name]:
             # A hack for now:
             # Is there a bug in how this is being interpreted by appleseed?
             if not hair:
-                part_name = "{0}.{1}".format(object_name, mesh_name)
+                part_name = "{0}.{1}".format(mesh_object_name, mesh_name)
+                # Named after the instanced object even when its mesh is shared, so render layer rules keep matching.
+                instance_name = "{0}.{1}.instance_{2}".format(object_name, mesh_name, instance_index)
             else:
                 part_name = object_name
-            instance_name = "{0}.instance_{1}".format(part_name, instance_index)
+                instance_name = "{0}.instance_{1}".format(part_name, instance_index)
             front_material_name = "__default_material"
             back_material_name = "__default_material"
             if material_index < len(object.material_slots):
@@ -653,6 +1040,52 @@ class write_project_file( object):
                 util.debug( object_name, object_matrix)
             self.__emit_object_instance_element(part_name, instance_name, object_matrix, front_material_name, back_material_name, object, scene)
 
+    #--------------------------------
+    def __emit_object_instances_compact( self, scene, object, matrices):
+        '''
+        Emit instances of an object already emitted, one line per object instance,
+        with the transforms converted and formatted in chunks of the mesh chunk size.
+        '''
+        object_name = object.name
+        first_index = self._instance_count[object_name] + 1
+        self._instance_count[object_name] += len( matrices)
+
+        global_matrix = self._global_matrix
+        if util.ob_mblur_enabled( object, scene) and not self._group_stack:
+            # The transforms are on the object's assembly instance.
+            global_matrix = identity_matrix
+            matrices = [identity_matrix] * len( matrices)
+
+        # Materials of the object parts.
+        mesh_object_name = self._mesh_sources.get( object_name, object_name)
+        parts = []
+        for material_index, mesh_name in self._mesh_parts[object_name]:
+            front_material_name = "__default_material"
+            back_material_name = "__default_material"
+            if material_index < len( object.material_slots):
+                material = object.material_slots[material_index].material
+                if material:
+                    front_material_name, back_material_name = self._emitted_materials[material]
+            part_name = "{0}.{1}".format( mesh_object_name, mesh_name)
+            instance_prefix = "{0}.{1}.instance_".format( object_name, mesh_name)
+            parts.append( ( part_name, instance_prefix, front_material_name, back_material_name))
+
+        emitter = self._output_file
+        chunk_rows = mesh_writer.get_float_options( scene)["chunk_rows"]
+        for start in range( 0, len( matrices), chunk_rows):
+            instance_matrices = instance_encoder.get_instance_matrices( global_matrix, matrices[start:start + chunk_rows])
+            matrices_text = instance_encoder.format_instance_matrices( instance_matrices)
+            for part_name, instance_prefix, front_material_name, back_material_name in parts:
+                # Each object instance is an entry of the project index, like the ones written by scene_serializer.
+                for instance_name, line in instance_encoder.encode_object_instances( part_name, instance_prefix, first_index + start,
+                                                                                      matrices_text, front_material_name, back_material_name):
+                    entry_start = emitter.begin_entry()
+                    emitter.emit_line( line)
+                    emitter.add_entry( "object_instance", instance_name, entry_start)
+
+        if bool(object.appleseed.render_layer):
+            self._rules[ object.name] = object.appleseed.render_layer
+
     #---------------------------------------------
     # Emit an object instance to the project file.
     #---------------------------------------------
@@ -660,16 +1093,14 @@ class write_project_file( object):
         '''
         Emit an object instance element to the project file.
         '''
-        self.__open_element('object_instance name="{0}" object="{1}"'.format(instance_name, object_name))
-        if util.ob_mblur_enabled( object, scene):
-            self.__emit_transform_element( identity_matrix, None)
-        else:
-            self.__emit_transform_element( instance_matrix, None)
-        self.__emit_line('<assign_material slot="0" side="front" material="{0}" />'.format(front_material_name))
-        self.__emit_line('<assign_material slot="0" side="back" material="{0}" />'.format(back_material_name))
+        # Objects with motion blur are in their own assembly, whose instance has the transforms.
+        # Members of a dupli group are placed with their own matrix: the motion is on the group's assembly instance.
+        if util.ob_mblur_enabled( object, scene) and not self._group_stack:
+            instance_matrix = identity_matrix
+        self.__write( scene_ir.ObjectInstance( instance_name, object_name, [self.__get_transform( instance_matrix, None)],
+                                               front_material_name, back_material_name))
         if bool(object.appleseed.render_layer):
             self._rules[ object.name] = object.appleseed.render_layer
-        self.__close_element("object_instance")
 
 
     #----------------------------------------------------------------------------------------------
@@ -689,17 +1120,55 @@ class write_project_file( object):
             return node.node_type == 'material' 
 
     def __emit_physical_surface_shader_element(self):
-        self.__emit_line('<surface_shader name="physical_surface_shader" model="physical_surface_shader" />')
+        self.__write( scene_ir.Entity( "surface_shader", "physical_surface_shader", "physical_surface_shader"))
 
     def __emit_default_material(self, scene):
         self.__emit_solid_linear_rgb_color_element("__default_material_bsdf_reflectance", [ 0.8 ], 1.0)
 
-        self.__open_element('bsdf name="__default_material_bsdf" model="lambertian_brdf"')
-        self.__emit_parameter("reflectance", "__default_material_bsdf_reflectance")
-        self.__close_element("bsdf")
+        self.__write( scene_ir.Entity( "bsdf", "__default_material_bsdf", "lambertian_brdf", [( "reflectance", "__default_material_bsdf_reflectance")]))
 
         self.__emit_material_element("__default_material", "__default_material_bsdf", "", "physical_surface_shader", scene, "")
 
+    #-------------------------------------------
+    # Material fragment cache.
+    #-------------------------------------------
+    def __emit_cached_material( self, material, scene):
+        '''
+        Emit the material from the fragment cached by a previous export or assembly if the material
+        and its textures did not change, and return the front and back material names.
+        '''
+        fragment = self._export_state.get_material( material, scene)
+        if fragment is None:
+            fragment = self.__capture_material( material, scene)
+            self._export_state.store_material( material, scene, fragment)
+        front_material_name, back_material_name, textures, texture_keys, text = fragment
+
+        for texture_name, texture_text in textures:
+            if texture_name not in self._emitted_textures:
+                self._emitted_textures.add( texture_name)
+                self._output_file.emit_lines( texture_text)
+        self._textures_set.update( texture_keys)
+        self._output_file.emit_lines( text)
+        return front_material_name, back_material_name
+
+    def __capture_material( self, material, scene):
+        '''
+        Emit the material to a fragment, independently of the textures already emitted:
+        ( front material name, back material name, [( texture name, texture text)], texture keys, material text).
+        '''
+        enclosing_state = ( self._output_file, self._textures_set, self._captured_textures)
+        buffer = io.BytesIO()
+        self._output_file = xml_emitter.XmlEmitter( buffer)
+        self._textures_set = set()
+        self._captured_textures = []
+        try:
+            front_material_name, back_material_name = self.__emit_material( material, scene)
+            self._output_file.flush()
+            fragment = ( front_material_name, back_material_name, self._captured_textures, self._textures_set, buffer.getvalue().decode( "utf8"))
+        finally:
+            self._output_file, self._textures_set, self._captured_textures = enclosing_state
+        return fragment
+
     #-------------------------------------------
     # Write the material.
     #-------------------------------------------
@@ -1043,10 +1512,8 @@ class write_project_file( object):
                                                        layer.lambertian_reflectance,
                                                        1)
         # Emit BRDF.
-        self.__open_element('bsdf name="{0}" model="lambertian_brdf"'.format(bsdf_name))
-        self.__emit_parameter("reflectance", reflectance_name)
-        self.__emit_parameter("reflectance_multiplier", reflectance_multiplier)
-        self.__close_element("bsdf")
+        self.__write( scene_ir.Entity( "bsdf", bsdf_name, "lambertian_brdf", [( "reflectance", reflectance_name),
+                                                                              ( "reflectance_multiplier", reflectance_multiplier)]))
 
 
     #-----------------------
@@ -1183,19 +1650,17 @@ class write_project_file( object):
                         self.__emit_texture( bpy.data.textures[layer.disney_subsurface_tex], False, scene)
                         self._textures_set.add( subsurface)
 
-        self.__open_element('bsdf name="{0}" model="disney_brdf"'.format(bsdf_name))
-        self.__emit_parameter("anisotropic", aniso)
-        self.__emit_parameter("base_color", base_coat_name)
-        self.__emit_parameter("specular", spec)
-        self.__emit_parameter("specular_tint", spec_tint)
-        self.__emit_parameter("clearcoat", clearcoat)
-        self.__emit_parameter("clearcoat_gloss", clearcoat_gloss)
-        self.__emit_parameter("metallic", metallic)
-        self.__emit_parameter("roughness", roughness)
-        self.__emit_parameter("sheen", sheen)
-        self.__emit_parameter("sheen_tint", sheen_tint)
-        self.__emit_parameter("subsurface", subsurface)
-        self.__close_element("bsdf")
+        self.__write( scene_ir.Entity( "bsdf", bsdf_name, "disney_brdf", [( "anisotropic", aniso),
+                                                                          ( "base_color", base_coat_name),
+                                                                          ( "specular", spec),
+                                                                          ( "specular_tint", spec_tint),
+                                                                          ( "clearcoat", clearcoat),
+                                                                          ( "clearcoat_gloss", clearcoat_gloss),
+                                                                          ( "metallic", metallic),
+                                                                          ( "roughness", roughness),
+                                                                          ( "sheen", sheen),
+                                                                          ( "sheen_tint", sheen_tint),
+                                                                          ( "subsurface", subsurface)]))
             
     #-----------------------
     # Write Oren-Nayar BRDF.
@@ -1244,11 +1709,9 @@ class write_project_file( object):
                                                        layer.orennayar_reflectance,
                                                        1)
 
-        self.__open_element('bsdf name="{0}" model="orennayar_brdf"'.format(bsdf_name))
-        self.__emit_parameter("reflectance", reflectance_name)
-        self.__emit_parameter("reflectance_multiplier", reflectance_multiplier)
-        self.__emit_parameter("roughness", roughness)
-        self.__close_element("bsdf")
+        self.__write( scene_ir.Entity( "bsdf", bsdf_name, "orennayar_brdf", [( "reflectance", reflectance_name),
+                                                                             ( "reflectance_multiplier", reflectance_multiplier),
+                                                                             ( "roughness", roughness)]))
 
     #----------------------
     # Write Diffuse BTDF.
@@ -1294,10 +1757,8 @@ class write_project_file( object):
             # TODO: add texture support for multiplier
             transmittance = layer.transmittance_multiplier
                                   
-        self.__open_element('bsdf name="{0}" model="diffuse_btdf"'.format(bsdf_name))
-        self.__emit_parameter("transmittance", transmittance_name)
-        self.__emit_parameter("transmittance_multiplier", transmittance)
-        self.__close_element("bsdf")
+        self.__write( scene_ir.Entity( "bsdf", bsdf_name, "diffuse_btdf", [( "transmittance", transmittance_name),
+                                                                           ( "transmittance_multiplier", transmittance)]))
 
     #-----------------------------
     # Write Ashikhmin-Shirley BRDF.
@@ -1363,14 +1824,12 @@ class write_project_file( object):
             diffuse_multiplier = layer.ashikhmin_multiplier
             fresnel = 1
             
-        self.__open_element('bsdf name="{0}" model="ashikhmin_brdf"'.format(bsdf_name))
-        self.__emit_parameter("diffuse_reflectance", diffuse_reflectance_name)
-        self.__emit_parameter("diffuse_reflectance_multiplier", diffuse_multiplier)
-        self.__emit_parameter("glossy_reflectance", glossy_reflectance_name)
-        self.__emit_parameter("shininess_u", shininess_u)
-        self.__emit_parameter("shininess_v", shininess_v)
-        self.__emit_parameter("fresnel_multiplier", fresnel)
-        self.__close_element("bsdf")
+        self.__write( scene_ir.Entity( "bsdf", bsdf_name, "ashikhmin_brdf", [( "diffuse_reflectance", diffuse_reflectance_name),
+                                                                             ( "diffuse_reflectance_multiplier", diffuse_multiplier),
+                                                                             ( "glossy_reflectance", glossy_reflectance_name),
+                                                                             ( "shininess_u", shininess_u),
+                                                                             ( "shininess_v", shininess_v),
+                                                                             ( "fresnel_multiplier", fresnel)]))
 
     #----------------------
     # Write Specular BRDF.
@@ -1410,10 +1869,8 @@ class write_project_file( object):
             # TODO: add texture support for multiplier
             multiplier = layer.specular_multiplier
             
-        self.__open_element('bsdf name="{0}" model="specular_brdf"'.format(bsdf_name))
-        self.__emit_parameter("reflectance", reflectance_name)
-        self.__emit_parameter("reflectance_multiplier", multiplier)
-        self.__close_element("bsdf")
+        self.__write( scene_ir.Entity( "bsdf", bsdf_name, "specular_brdf", [( "reflectance", reflectance_name),
+                                                                            ( "reflectance_multiplier", multiplier)]))
 
     #----------------------
     # Write Specular BTDF.
@@ -1487,14 +1944,12 @@ class write_project_file( object):
                 to_ior = layer.spec_btdf_from_ior
 
 
-        self.__open_element('bsdf name="{0}" model="specular_btdf"'.format(bsdf_name))
-        self.__emit_parameter("reflectance", reflectance_name)
-        self.__emit_parameter("reflectance_multiplier", reflectance_multiplier)
-        self.__emit_parameter("transmittance", transmittance_name)
-        self.__emit_parameter("transmittance_multiplier", transmittance_multiplier)
-        self.__emit_parameter("from_ior", from_ior)
-        self.__emit_parameter("to_ior", to_ior)
-        self.__close_element("bsdf")
+        self.__write( scene_ir.Entity( "bsdf", bsdf_name, "specular_btdf", [( "reflectance", reflectance_name),
+                                                                            ( "reflectance_multiplier", reflectance_multiplier),
+                                                                            ( "transmittance", transmittance_name),
+                                                                            ( "transmittance_multiplier", transmittance_multiplier),
+                                                                            ( "from_ior", from_ior),
+                                                                            ( "to_ior", to_ior)]))
     
     #-----------------------
     # Write Microfacet BRDF.
@@ -1549,14 +2004,12 @@ class write_project_file( object):
             microfacet_mdf_multiplier = layer.microfacet_mdf_multiplier
             microfacet_fresnel = layer.microfacet_fresnel
             
-        self.__open_element('bsdf name="{0}" model="microfacet_brdf"'.format(bsdf_name))
-        self.__emit_parameter("mdf", microfacet_model)
-        self.__emit_parameter("reflectance", reflectance_name)
-        self.__emit_parameter("reflectance_multiplier", microfacet_multiplier)
-        self.__emit_parameter("glossiness", mdf_refl)
-        self.__emit_parameter("glossiness_multiplier", microfacet_mdf_multiplier)
-        self.__emit_parameter("fresnel_multiplier", microfacet_fresnel)
-        self.__close_element("bsdf")
+        self.__write( scene_ir.Entity( "bsdf", bsdf_name, "microfacet_brdf", [( "mdf", microfacet_model),
+                                                                              ( "reflectance", reflectance_name),
+                                                                              ( "reflectance_multiplier", microfacet_multiplier),
+                                                                              ( "glossiness", mdf_refl),
+                                                                              ( "glossiness_multiplier", microfacet_mdf_multiplier),
+                                                                              ( "fresnel_multiplier", microfacet_fresnel)]))
                
     #----------------------
     # Write Kelemen BRDF.
@@ -1616,13 +2069,11 @@ class write_project_file( object):
             kelemen_specular_multiplier = layer.kelemen_specular_multiplier
             kelemen_matte_multiplier = layer.kelemen_matte_multiplier
             
-        self.__open_element('bsdf name="{0}" model="kelemen_brdf"'.format(bsdf_name))
-        self.__emit_parameter("matte_reflectance", reflectance_name)
-        self.__emit_parameter("matte_reflectance_multiplier", kelemen_matte_multiplier)
-        self.__emit_parameter("roughness", kelemen_roughness)
-        self.__emit_parameter("specular_reflectance", spec_refl_name)
-        self.__emit_parameter("specular_reflectance_multiplier", kelemen_specular_multiplier)
-        self.__close_element("bsdf")
+        self.__write( scene_ir.Entity( "bsdf", bsdf_name, "kelemen_brdf", [( "matte_reflectance", reflectance_name),
+                                                                           ( "matte_reflectance_multiplier", kelemen_matte_multiplier),
+                                                                           ( "roughness", kelemen_roughness),
+                                                                           ( "specular_reflectance", spec_refl_name),
+                                                                           ( "specular_reflectance_multiplier", kelemen_specular_multiplier)]))
     
     #----------------------
     # Write BSDF Mixes.
@@ -1631,12 +2082,10 @@ class write_project_file( object):
         '''
         Emit BSDF mix to project file.
         '''
-        self.__open_element('bsdf name="{0}" model="bsdf_mix"'.format(bsdf_name))
-        self.__emit_parameter("bsdf0", bsdf0_name)
-        self.__emit_parameter("weight0", bsdf0_weight)
-        self.__emit_parameter("bsdf1", bsdf1_name)
-        self.__emit_parameter("weight1", bsdf1_weight)
-        self.__close_element("bsdf")
+        self.__write( scene_ir.Entity( "bsdf", bsdf_name, "bsdf_mix", [( "bsdf0", bsdf0_name),
+                                                                       ( "weight0", bsdf0_weight),
+                                                                       ( "bsdf1", bsdf1_name),
+                                                                       ( "weight1", bsdf1_weight)]))
 
     #----------------------
     # Write BSDF Blend.
@@ -1654,11 +2103,9 @@ class write_project_file( object):
             if isinstance(weight, float):
                 weight = 1 - weight
                 
-        self.__open_element('bsdf name="{0}" model="bsdf_blend"'.format(bsdf_name))
-        self.__emit_parameter("bsdf0", bsdf0_name)
-        self.__emit_parameter("bsdf1", bsdf1_name)
-        self.__emit_parameter("weight", weight)
-        self.__close_element("bsdf")
+        self.__write( scene_ir.Entity( "bsdf", bsdf_name, "bsdf_blend", [( "bsdf0", bsdf0_name),
+                                                                         ( "bsdf1", bsdf1_name),
+                                                                         ( "weight", weight)]))
 
     #----------------------
     # Write material emission.
@@ -1700,13 +2147,11 @@ class write_project_file( object):
             importance_multiplier = asr_mat.importance_multiplier
             light_near_start = asr_mat.light_near_start
             
-        self.__open_element('edf name="{0}" model="diffuse_edf"'.format(edf_name))
-        self.__emit_parameter("radiance", radiance_name)
-        self.__emit_parameter("radiance_multiplier", radiance_multiplier)
-        self.__emit_parameter("cast_indirect_light", cast_indirect)
-        self.__emit_parameter("importance_multiplier", importance_multiplier)
-        self.__emit_parameter("light_near_start", light_near_start)
-        self.__close_element("edf")
+        self.__write( scene_ir.Entity( "edf", edf_name, "diffuse_edf", [( "radiance", radiance_name),
+                                                                        ( "radiance_multiplier", radiance_multiplier),
+                                                                        ( "cast_indirect_light", cast_indirect),
+                                                                        ( "importance_multiplier", importance_multiplier),
+                                                                        ( "light_near_start", light_near_start)]))
 
     #----------------------------------------------------------------------------------------------
     # Export textures, if any exist on the material
@@ -1733,15 +2178,26 @@ class write_project_file( object):
 
             filepath = util.realpath( texture.image.filepath)
             texture_name = texture.name if bump_bool == False else texture.name + "_bump"
+
+        if self._captured_textures is not None:
+            # Capturing a material: keep the texture apart, it is only emitted if no other material emitted it.
+            output_file = self._output_file
+            buffer = io.BytesIO()
+            self._output_file = xml_emitter.XmlEmitter( buffer)
+        else:
+            self._emitted_textures.add( texture_name)
             
-        self.__open_element('texture name="{0}" model="disk_texture_2d"'.format( texture_name))
-        self.__emit_parameter("color_space", color_space)
-        self.__emit_parameter("filename", filepath)
-        self.__close_element("texture")
+        self.__write( scene_ir.Entity( "texture", texture_name, "disk_texture_2d", [( "color_space", color_space),
+                                                                                    ( "filename", filepath)]))
         
         # Now create texture instance.
         self.__emit_texture_instance(texture, texture_name, bump_bool, node, material_name, scene_texture)
 
+        if self._captured_textures is not None:
+            self._output_file.flush()
+            self._output_file = output_file
+            self._captured_textures.append( ( texture_name, buffer.getvalue().decode( "utf8")))
+
     # Write texture instance.
     def __emit_texture_instance(self, texture, texture_name, bump_bool, node = None, material_name = None, scene_texture = False):
         if scene_texture:
@@ -1751,10 +2207,8 @@ class write_project_file( object):
         else:
             mode = "wrap" if texture.extension == "REPEAT" else "clamp"        
             
-        self.__open_element('texture_instance name="{0}_inst" texture="{1}"'.format(texture_name, texture_name))
-        self.__emit_parameter("addressing_mode", mode)
-        self.__emit_parameter("filtering_mode", "bilinear")
-        self.__close_element("texture_instance")   
+        self.__write( scene_ir.TextureInstance( texture_name + "_inst", texture_name, [( "addressing_mode", mode),
+                                                                                      ( "filtering_mode", "bilinear")]))
         
         
     #----------------------------------------------------------------------------------------------
@@ -1802,22 +2256,22 @@ class write_project_file( object):
                 else:
                     material_alpha_map = asr_mat.material_alpha
                 
-        self.__open_element( 'material name="{0}" model="generic_material"'.format(material_name))
+        parameters = []
         if material_alpha_map != 1.0:
-            self.__emit_parameter( "alpha_map", material_alpha_map)
+            parameters.append( ( "alpha_map", material_alpha_map))
         if len( bsdf_name) > 0:
-            self.__emit_parameter( "bsdf", bsdf_name)
+            parameters.append( ( "bsdf", bsdf_name))
         if len( edf_name) > 0:
-            self.__emit_parameter("edf", edf_name)
+            parameters.append( ( "edf", edf_name))
         
         if bump_map != "":
-            self.__emit_parameter( "displacement_map", bump_map)
-        self.__emit_parameter( "bump_amplitude", material_bump_amplitude)
-        self.__emit_parameter( "displacement_method", method)
-        self.__emit_parameter( "normal_map_up", "z")
-        self.__emit_parameter( "shade_alpha_cutouts", "false")
-        self.__emit_parameter( "surface_shader", surface_shader_name)
-        self.__close_element( "material")
+            parameters.append( ( "displacement_map", bump_map))
+        parameters.extend( [( "bump_amplitude", material_bump_amplitude),
+                            ( "displacement_method", method),
+                            ( "normal_map_up", "z"),
+                            ( "shade_alpha_cutouts", "false"),
+                            ( "surface_shader", surface_shader_name)])
+        self.__write( scene_ir.Entity( "material", material_name, "generic_material", parameters))
 
     #----------------------------------------------------------------------------------------------
     # Camera.
@@ -1856,68 +2310,53 @@ class write_project_file( object):
 
         asr_cam = camera.data.appleseed
         cam_model = asr_cam.camera_type
-        self.__open_element('camera name="' + camera.name + '" model="{}_camera"'.format(cam_model))
+        entity = scene_ir.Entity( "camera", camera.name, "{}_camera".format(cam_model))
+        parameters = entity.parameters
         if cam_model == "thinlens":
-            self.__emit_parameter("f_stop", asr_cam.camera_dof)
-            self.__emit_parameter("focal_distance", focal_distance)
-            self.__emit_parameter("diaphragm_blades", asr_cam.diaphragm_blades)
-            self.__emit_parameter("diaphragm_tilt_angle", asr_cam.diaphragm_angle)
+            parameters.extend( [( "f_stop", asr_cam.camera_dof),
+                                ( "focal_distance", focal_distance),
+                                ( "diaphragm_blades", asr_cam.diaphragm_blades),
+                                ( "diaphragm_tilt_angle", asr_cam.diaphragm_angle)])
             emit_diaphragm_map = False
             if asr_cam.diaphragm_map != '' and asr_cam.diaphragm_map[-3:] in { 'png', 'exr'}:
                 emit_diaphragm_map = True
                 texture_name = asr_cam.diaphragm_map.split( util.sep)[-1][:-4]
-                self.__emit_parameter("diaphragm_map", texture_name + "_inst")
-        self.__emit_parameter("film_width", film_width)
-        self.__emit_parameter("aspect_ratio", aspect_ratio)
-        self.__emit_parameter("horizontal_fov", fov)
-        self.__emit_parameter("shutter_open_time", shutter_open)
-        self.__emit_parameter("shutter_close_time", shutter_close)
+                parameters.append( ( "diaphragm_map", texture_name + "_inst"))
+        parameters.extend( [( "film_width", film_width),
+                            ( "aspect_ratio", aspect_ratio),
+                            ( "horizontal_fov", fov),
+                            ( "shutter_open_time", shutter_open),
+                            ( "shutter_close_time", shutter_close)])
 
-        current_frame = scene.frame_current
-        scene.frame_set( current_frame, subframe = shutter_open)
-        origin_1, forward_1, up_1, target_1 = util.get_camera_matrix( camera, self._global_matrix)
-        
         # Write respective transforms if using camera motion blur.
         if scene.appleseed.mblur_enable and scene.appleseed.cam_mblur:
-            scene.frame_set(current_frame, subframe = asr_scn.shutter_close)
-            origin_2, forward_2, up_2, target_2 = util.get_camera_matrix( camera, self._global_matrix)
-            # Return the timeline to original frame.
-            scene.frame_set(current_frame)
-            
-            self.__open_element('transform time="0"')
-            self.__emit_line('<look_at origin="{0} {1} {2}" target="{3} {4} {5}" up="{6} {7} {8}" />'.format( \
-                             origin_1[0], origin_1[2], -origin_1[1],
-                             target_1[0], target_1[2], -target_1[1],
-                             up_1[0], up_1[2], -up_1[1]))
-            self.__close_element("transform")
-            
-            self.__open_element('transform time="1"')
-            self.__emit_line('<look_at origin="{0} {1} {2}" target="{3} {4} {5}" up="{6} {7} {8}" />'.format( \
-                             origin_2[0], origin_2[2], -origin_2[1],
-                             target_2[0], target_2[2], -target_2[1],
-                             up_2[0], up_2[2], -up_2[1]))
-            self.__close_element("transform")
+            # Camera matrices sampled at each motion key.
+            for time, camera_matrix in zip( self._motion.times, self._motion.camera):
+                entity.transforms.append( self.__get_look_at( camera_matrix, time))
         else:
-            self.__open_element("transform")
-            self.__emit_line('<look_at origin="{0} {1} {2}" target="{3} {4} {5}" up="{6} {7} {8}" />'.format( \
-                             origin_1[0], origin_1[2], -origin_1[1],
-                             target_1[0], target_1[2], -target_1[1],
-                             up_1[0], up_1[2], -up_1[1]))
-            self.__close_element("transform")
+            # The scene is at shutter open.
+            entity.transforms.append( self.__get_look_at( util.get_camera_matrix( camera, self._global_matrix), None))
             
-        self.__close_element("camera")
+        self.__write( entity)
 
         # Write diaphragm texture to Scene, if enabled.
         if emit_diaphragm_map:
             self.__emit_texture( util.realpath( asr_cam.diaphragm_map), False, scene, scene_texture = True)
             
     def __emit_default_camera_element(self):
-        self.__open_element('camera name="camera" model="pinhole_camera"')
-        self.__emit_parameter("film_width", 0.024892)
-        self.__emit_parameter("film_height", 0.018669)
-        self.__emit_parameter("focal_length", 0.035)
-        self.__close_element("camera")
-        return
+        self.__write( scene_ir.Entity( "camera", "camera", "pinhole_camera", [( "film_width", 0.024892),
+                                                                            ( "film_height", 0.018669),
+                                                                            ( "focal_length", 0.035)]))
+
+    def __get_look_at( self, camera_matrix, time):
+        '''
+        Return the look at transform of a camera matrix from util.get_camera_matrix().
+        '''
+        origin, forward, up, target = camera_matrix
+        return scene_ir.LookAt( ( origin[0], origin[2], -origin[1]),
+                                ( target[0], target[2], -target[1]),
+                                ( up[0], up[2], -up[1]),
+                                time)
 
     #----------------------------------------------------------------------------------------------
     # Environment.
@@ -1957,79 +2396,61 @@ class write_project_file( object):
 
             # Write the environment EDF.
             env_edf_name = "environment_edf"
+            gradient_parameters = [( "horizon_radiance", "horizon_radiance"), ( "zenith_radiance", "zenith_radiance")]
             if scene.appleseed_sky.env_type == "gradient":
-                self.__open_element('environment_edf name="{0}" model="gradient_environment_edf"'.format(env_edf_name))
-                self.__emit_parameter("horizon_radiance", "horizon_radiance")
-                self.__emit_parameter("zenith_radiance", "zenith_radiance")
-                self.__close_element('environment_edf')
+                env_edf = scene_ir.Entity( "environment_edf", env_edf_name, "gradient_environment_edf", gradient_parameters)
                 
             elif scene.appleseed_sky.env_type == "constant":
-                self.__open_element('environment_edf name="{0}" model="constant_environment_edf"'.format(env_edf_name))
-                self.__emit_parameter("radiance", "horizon_radiance")
-                self.__close_element('environment_edf')
+                env_edf = scene_ir.Entity( "environment_edf", env_edf_name, "constant_environment_edf", [( "radiance", "horizon_radiance")])
                 
             elif scene.appleseed_sky.env_type == "constant_hemisphere":
-                self.__open_element('environment_edf name="{0}" model="constant_hemisphere_environment_edf"'.format(env_edf_name))
-                self.__emit_parameter("lower_hemi_radiance", "horizon_radiance")
-                self.__emit_parameter("upper_hemi_radiance", "zenith_radiance")
-                self.__close_element('environment_edf')
+                env_edf = scene_ir.Entity( "environment_edf", env_edf_name, "constant_hemisphere_environment_edf", [( "lower_hemi_radiance", "horizon_radiance"),
+                                                                                                                  ( "upper_hemi_radiance", "zenith_radiance")])
                 
             elif scene.appleseed_sky.env_type == "mirrorball_map":
                 if scene.appleseed_sky.env_tex != "":
                     self.__emit_texture(bpy.data.textures[scene.appleseed_sky.env_tex], False, scene)
-                    self.__open_element('environment_edf name="{0}" model="mirrorball_map_environment_edf"'.format(env_edf_name))
-                    self.__emit_parameter("radiance", scene.appleseed_sky.env_tex + "_inst")
-                    self.__emit_parameter("radiance_multiplier", scene.appleseed_sky.env_tex_mult)
-                    self.__close_element('environment_edf')
+                    env_edf = scene_ir.Entity( "environment_edf", env_edf_name, "mirrorball_map_environment_edf", [( "radiance", scene.appleseed_sky.env_tex + "_inst"),
+                                                                                                                 ( "radiance_multiplier", scene.appleseed_sky.env_tex_mult)])
                 else:
                     self.__warning("Mirror Ball environment texture is enabled, but no texture is assigned. Using gradient environment.")
-                    self.__open_element('environment_edf name="{0}" model="gradient_environment_edf"'.format(env_edf_name))
-                    self.__emit_parameter("horizon_radiance", "horizon_radiance")
-                    self.__emit_parameter("zenith_radiance", "zenith_radiance")
-                    self.__close_element('environment_edf')
+                    env_edf = scene_ir.Entity( "environment_edf", env_edf_name, "gradient_environment_edf", gradient_parameters)
                     
             elif scene.appleseed_sky.env_type == "latlong_map":
                 if scene.appleseed_sky.env_tex != "":
                     self.__emit_texture(bpy.data.textures[scene.appleseed_sky.env_tex], False, scene)
-                    self.__open_element('environment_edf name="{0}" model="latlong_map_environment_edf"'.format(env_edf_name))
-                    self.__emit_parameter("radiance", scene.appleseed_sky.env_tex + "_inst")
-                    self.__emit_parameter("radiance_multiplier", scene.appleseed_sky.env_tex_mult)
-                    self.__close_element('environment_edf')
+                    env_edf = scene_ir.Entity( "environment_edf", env_edf_name, "latlong_map_environment_edf", [( "radiance", scene.appleseed_sky.env_tex + "_inst"),
+                                                                                                              ( "radiance_multiplier", scene.appleseed_sky.env_tex_mult)])
                 else:
                     self.__warning("Latitude-Longitude environment texture is enabled, but no texture is assigned. Using gradient environment.")
-                    self.__open_element('environment_edf name="{0}" model="gradient_environment_edf"'.format(env_edf_name))
-                    self.__emit_parameter("horizon_radiance", "horizon_radiance")
-                    self.__emit_parameter("zenith_radiance", "zenith_radiance")
-                    self.__close_element('environment_edf')
+                    env_edf = scene_ir.Entity( "environment_edf", env_edf_name, "gradient_environment_edf", gradient_parameters)
                     
             elif scene.appleseed_sky.env_type == "sunsky":
                 asr_sky = scene.appleseed_sky
-                self.__open_element('environment_edf name="{0}" model="{1}"'.format(env_edf_name, asr_sky.sun_model))
+                env_edf = scene_ir.Entity( "environment_edf", env_edf_name, asr_sky.sun_model)
                 if asr_sky.sun_model == "hosek_environment_edf":
-                    self.__emit_parameter("ground_albedo", asr_sky.ground_albedo)
-                self.__emit_parameter("horizon_shift", asr_sky.horiz_shift)
-                self.__emit_parameter("luminance_multiplier", asr_sky.luminance_multiplier)
-                self.__emit_parameter("saturation_multiplier", asr_sky.saturation_multiplier)
-                self.__emit_parameter("sun_phi", asr_sky.sun_phi)
-                self.__emit_parameter("sun_theta", asr_sky.sun_theta)
-                self.__emit_parameter("turbidity", asr_sky.turbidity)
-                self.__emit_parameter("turbidity_max", asr_sky.turbidity_max)
-                self.__emit_parameter("turbidity_min", asr_sky.turbidity_min)
-                self.__close_element('environment_edf')
+                    env_edf.parameters.append( ( "ground_albedo", asr_sky.ground_albedo))
+                env_edf.parameters.extend( [( "horizon_shift", asr_sky.horiz_shift),
+                                            ( "luminance_multiplier", asr_sky.luminance_multiplier),
+                                            ( "saturation_multiplier", asr_sky.saturation_multiplier),
+                                            ( "sun_phi", asr_sky.sun_phi),
+                                            ( "sun_theta", asr_sky.sun_theta),
+                                            ( "turbidity", asr_sky.turbidity),
+                                            ( "turbidity_max", asr_sky.turbidity_max),
+                                            ( "turbidity_min", asr_sky.turbidity_min)])
+            self.__write( env_edf)
 
             # Write the environment shader.
             env_shader_name = "environment_shader"
-            self.__open_element('environment_shader name="{0}" model="edf_environment_shader"'.format(env_shader_name))
-            self.__emit_parameter("environment_edf", env_edf_name)
-            self.__close_element('environment_shader')
+            self.__write( scene_ir.Entity( "environment_shader", env_shader_name, "edf_environment_shader", [( "environment_edf", env_edf_name)]))
 
         # Write the environment element.
-        self.__open_element('environment name="environment" model="generic_environment"')
+        environment = scene_ir.Entity( "environment", "environment", "generic_environment")
         if len(env_edf_name) > 0:
-            self.__emit_parameter("environment_edf", env_edf_name)
+            environment.parameters.append( ( "environment_edf", env_edf_name))
         if len(env_shader_name) > 0:
-            self.__emit_parameter("environment_shader", env_shader_name)
-        self.__close_element('environment')
+            environment.parameters.append( ( "environment_shader", env_shader_name))
+        self.__write( environment)
     
     #----------------------------------------------------------------------------------------------
     # Lights.
@@ -2060,17 +2481,12 @@ class write_project_file( object):
         use_sunsky = sunsky.env_type == "sunsky"
         environment_edf = "environment_edf"
         
-        self.__open_element('light name="{0}" model="sun_light"'.format(lamp.name))
-        if bool(lamp.appleseed.render_layer):
-            self._rules[ lamp.name] = lamp.appleseed.render_layer
+        parameters = []
         if use_sunsky:    
-            self.__emit_parameter("environment_edf", environment_edf)
-        self.__emit_parameter("radiance_multiplier", sunsky.radiance_multiplier if use_sunsky else asr_light.radiance_multiplier)
-        self.__emit_parameter("turbidity", asr_light.turbidity)
-        self.__emit_parameter("cast_indirect_light", str( asr_light.cast_indirect).lower())
-        self.__emit_parameter("importance_multiplier", asr_light.importance_multiplier)
-        self.__emit_transform_element(self._global_matrix * lamp.matrix_world, None)
-        self.__close_element("light")
+            parameters.append( ( "environment_edf", environment_edf))
+        parameters.extend( [( "radiance_multiplier", sunsky.radiance_multiplier if use_sunsky else asr_light.radiance_multiplier),
+                            ( "turbidity", asr_light.turbidity)])
+        self.__write( self.__get_light_entity( lamp, "sun_light", parameters))
 
         
     def __emit_point_light(self, scene, lamp):
@@ -2080,15 +2496,8 @@ class write_project_file( object):
         
         self.__emit_solid_linear_rgb_color_element(radiance_name, asr_light.radiance, 1)
 
-        self.__open_element('light name="{0}" model="point_light"'.format(lamp.name))
-        if bool( lamp.appleseed.render_layer):
-            self._rules[ lamp.name] = lamp.appleseed.render_layer
-        self.__emit_parameter("radiance", radiance_name)
-        self.__emit_parameter("radiance_mutliplier", asr_light.radiance_multiplier)
-        self.__emit_parameter("cast_indirect_light", str( asr_light.cast_indirect).lower())
-        self.__emit_parameter("importance_multiplier", asr_light.importance_multiplier)
-        self.__emit_transform_element(self._global_matrix * lamp.matrix_world, None)
-        self.__close_element("light")
+        self.__write( self.__get_light_entity( lamp, "point_light", [( "radiance", radiance_name),
+                                                                    ( "radiance_mutliplier", asr_light.radiance_multiplier)]))
 
 
     def __emit_spot_light(self, scene, lamp):
@@ -2117,17 +2526,10 @@ class write_project_file( object):
         outer_angle = math.degrees(lamp.data.spot_size)
         inner_angle = (1.0 - lamp.data.spot_blend) * outer_angle
 
-        self.__open_element('light name="{0}" model="spot_light"'.format(lamp.name))
-        if bool(lamp.appleseed.render_layer):
-            self._rules[ lamp.name] = lamp.appleseed.render_layer
-        self.__emit_parameter("radiance", radiance_name)
-        self.__emit_parameter("radiance_multiplier", radiance_multiplier)
-        self.__emit_parameter("inner_angle", inner_angle)
-        self.__emit_parameter("outer_angle", outer_angle)
-        self.__emit_parameter("cast_indirect_light", str( asr_light.cast_indirect).lower())
-        self.__emit_parameter("importance_multiplier", asr_light.importance_multiplier)
-        self.__emit_transform_element(self._global_matrix * lamp.matrix_world, None)
-        self.__close_element("light")
+        self.__write( self.__get_light_entity( lamp, "spot_light", [( "radiance", radiance_name),
+                                                                   ( "radiance_multiplier", radiance_multiplier),
+                                                                   ( "inner_angle", inner_angle),
+                                                                   ( "outer_angle", outer_angle)]))
 
     def __emit_directional_light(self, scene, lamp):
         lamp_data = lamp.data
@@ -2136,15 +2538,21 @@ class write_project_file( object):
         
         self.__emit_solid_linear_rgb_color_element(radiance_name, asr_light.radiance, 1)
 
-        self.__open_element('light name="{0}" model="directional_light"'.format(lamp.name))
+        self.__write( self.__get_light_entity( lamp, "directional_light", [( "radiance", radiance_name),
+                                                                          ( "radiance_multiplier", asr_light.radiance_multiplier)]))
+
+    def __get_light_entity( self, lamp, model, parameters):
+        '''
+        Return the light entity of a lamp, with the parameters common to all light models
+        appended to the model specific ones.
+        '''
+        asr_light = lamp.data.appleseed
         if bool(lamp.appleseed.render_layer):
             self._rules[ lamp.name] = lamp.appleseed.render_layer
-        self.__emit_parameter("radiance", radiance_name)
-        self.__emit_parameter("radiance_multiplier", asr_light.radiance_multiplier)
-        self.__emit_parameter("cast_indirect_light", str( asr_light.cast_indirect).lower())
-        self.__emit_parameter("importance_multiplier", asr_light.importance_multiplier)
-        self.__emit_transform_element(self._global_matrix * lamp.matrix_world, None)
-        self.__close_element("light")
+        parameters.extend( [( "cast_indirect_light", str( asr_light.cast_indirect).lower()),
+                            ( "importance_multiplier", asr_light.importance_multiplier)])
+        return scene_ir.Entity( "light", lamp.name, model, parameters,
+                                transforms = [self.__get_transform( self._global_matrix * lamp.matrix_world, None)])
         
     #----------------------------------------------------------------------------------------------
     # Output.
@@ -2158,14 +2566,13 @@ class write_project_file( object):
     def __emit_frame_element(self, scene):
         camera = scene.camera
         width, height = self.__get_frame_resolution(scene.render)
-        self.__open_element("frame name=\"beauty\"")
-        self.__emit_parameter("camera", "camera" if camera is None else camera.name)
-        self.__emit_parameter("resolution", "{0} {1}".format(width, height))
-        self.__emit_custom_prop(scene, "color_space", "srgb")
+        frame = scene_ir.Entity( "frame", "beauty", parameters = [( "camera", "camera" if camera is None else camera.name),
+                                                                  ( "resolution", "{0} {1}".format(width, height)),
+                                                                  ( "color_space", self.__get_custom_prop(scene, "color_space", "srgb"))])
         if scene.render.use_border:
             X, Y, endX, endY = self.__get_border_limits(scene, width, height)
-            self.__emit_parameter("crop_window", "{0} {1} {2} {3}".format(X, Y, endX, endY))
-        self.__close_element("frame")
+            frame.parameters.append( ( "crop_window", "{0} {1} {2} {3}".format(X, Y, endX, endY)))
+        self.__write( frame)
 
     def __get_frame_resolution(self, render):
         scale = render.resolution_percentage / 100.0
@@ -2201,110 +2608,95 @@ class write_project_file( object):
                         
     def _emit_render_layer_assignment( self, rule_name, ob_name, render_layer):
         # For now, all assignments are to "All" entity types
-        self.__open_element( 'render_layer_assignment name="%s" model="regex"' % rule_name)
-        self.__emit_parameter( "render_layer", render_layer)
-        self.__emit_parameter( "order", 1)
-        self.__emit_parameter( "pattern", ob_name)
-        self.__close_element( "render_layer_assignment")
+        self.__write( scene_ir.Entity( "render_layer_assignment", rule_name, "regex", [( "render_layer", render_layer),
+                                                                                     ( "order", 1),
+                                                                                     ( "pattern", ob_name)]))
     #----------------------------------------------------------------------------------------------
     # Configurations.
     #----------------------------------------------------------------------------------------------
 
     def __emit_configurations(self, scene):
         self.__open_element("configurations")
-        self.__emit_interactive_configuration_element(scene)
-        self.__emit_final_configuration_element(scene)
+        scene_serializer.write_all( self._output_file, self.__get_configurations( scene))
         self.__close_element("configurations")
 
-    def __emit_interactive_configuration_element(self, scene):
-        self.__open_element('configuration name="interactive" base="base_interactive"')
-        self.__emit_common_configuration_parameters(scene, "interactive")
-        self.__close_element("configuration")
-
-    def __emit_final_configuration_element(self, scene):
-        self.__open_element('configuration name="final" base="base_final"')
-        self.__emit_common_configuration_parameters(scene, "final")
-        self.__open_element('parameters name="generic_tile_renderer"')
-        self.__emit_parameter("min_samples", scene.appleseed.sampler_min_samples)
-        self.__emit_parameter("max_samples", scene.appleseed.sampler_max_samples)
-        self.__close_element("parameters")
-        self.__close_element("configuration")
-
-    def __emit_common_configuration_parameters(self, scene, type):
+    def __get_configurations( self, scene):
+        '''
+        Return the interactive and final configurations.
+        '''
+        interactive = scene_ir.Configuration( "interactive", "base_interactive", *self.__get_common_configuration_parameters(scene, "interactive"))
+        final = scene_ir.Configuration( "final", "base_final", *self.__get_common_configuration_parameters(scene, "final"))
+        final.groups.append( scene_ir.ParameterGroup( "generic_tile_renderer", [( "min_samples", scene.appleseed.sampler_min_samples),
+                                                                               ( "max_samples", scene.appleseed.sampler_max_samples)]))
+        return [interactive, final]
+
+    def __get_common_configuration_parameters(self, scene, type):
+        '''
+        Return the parameters and parameter groups common to both configurations.
+        '''
         # Interactive: always use drt
         lighting_engine = 'drt' if type == "interactive" else scene.appleseed.lighting_engine
         
-        self.__emit_parameter("lighting_engine", lighting_engine)
-        self.__emit_parameter("pixel_renderer", scene.appleseed.pixel_sampler)
-        self.__emit_parameter("rendering_threads", scene.appleseed.threads)
-        self.__open_element('parameters name="adaptive_pixel_renderer"')
-        self.__emit_parameter("enable_diagnostics", scene.appleseed.enable_diagnostics)
-        self.__emit_parameter("max_samples", scene.appleseed.sampler_max_samples)
-        self.__emit_parameter("min_samples", scene.appleseed.sampler_min_samples)
-        self.__emit_parameter("quality", scene.appleseed.quality)
-        self.__close_element("parameters")
-
-        self.__open_element('parameters name="uniform_pixel_renderer"')
-        self.__emit_parameter("decorrelate_pixels", "true" if scene.appleseed.decorrelate_pixels else "false")
-        self.__emit_parameter("force_antialiasing", "true" if scene.appleseed.force_aa else "false")
-        self.__emit_parameter("samples", scene.appleseed.sampler_max_samples)
-        self.__close_element("parameters")
-
-        self.__open_element('parameters name="generic_frame_renderer"')
-        self.__emit_parameter("passes", scene.appleseed.renderer_passes)
-        self.__emit_parameter("tile_ordering", scene.appleseed.tile_ordering)
-        self.__close_element("parameters")
+        parameters = [( "lighting_engine", lighting_engine),
+                      ( "pixel_renderer", scene.appleseed.pixel_sampler),
+                      ( "rendering_threads", scene.appleseed.threads)]
+        groups = []
+        groups.append( scene_ir.ParameterGroup( "adaptive_pixel_renderer", [( "enable_diagnostics", scene.appleseed.enable_diagnostics),
+                                                                           ( "max_samples", scene.appleseed.sampler_max_samples),
+                                                                           ( "min_samples", scene.appleseed.sampler_min_samples),
+                                                                           ( "quality", scene.appleseed.quality)]))
+
+        groups.append( scene_ir.ParameterGroup( "uniform_pixel_renderer", [( "decorrelate_pixels", "true" if scene.appleseed.decorrelate_pixels else "false"),
+                                                                          ( "force_antialiasing", "true" if scene.appleseed.force_aa else "false"),
+                                                                          ( "samples", scene.appleseed.sampler_max_samples)]))
+
+        groups.append( scene_ir.ParameterGroup( "generic_frame_renderer", [( "passes", scene.appleseed.renderer_passes),
+                                                                          ( "tile_ordering", scene.appleseed.tile_ordering)]))
         
-        self.__open_element('parameters name="{0}"'.format(scene.appleseed.lighting_engine))
         # IBL can be enabled with all three engines.
-        self.__emit_parameter("enable_ibl", "true" if scene.appleseed.ibl_enable else "false")
+        engine_parameters = [( "enable_ibl", "true" if scene.appleseed.ibl_enable else "false")]
         
         if scene.appleseed.lighting_engine == 'pt':
-            self.__emit_parameter("enable_dl", "true" if scene.appleseed.direct_lighting else "false")
-            self.__emit_parameter("enable_caustics", "true" if scene.appleseed.caustics_enable else "false")
-            self.__emit_parameter("next_event_estimation", "true" if scene.appleseed.next_event_est else "false")
+            engine_parameters.append( ( "enable_dl", "true" if scene.appleseed.direct_lighting else "false"))
+            engine_parameters.append( ( "enable_caustics", "true" if scene.appleseed.caustics_enable else "false"))
+            engine_parameters.append( ( "next_event_estimation", "true" if scene.appleseed.next_event_est else "false"))
             if scene.appleseed.max_ray_intensity > 0.0:
-                self.__emit_parameter("max_ray_intensity", scene.appleseed.max_ray_intensity)
+                engine_parameters.append( ( "max_ray_intensity", scene.appleseed.max_ray_intensity))
 
         if scene.appleseed.lighting_engine == 'pt' or scene.appleseed.lighting_engine == 'drt':
-            self.__emit_parameter("dl_light_samples", scene.appleseed.dl_light_samples)
-            self.__emit_parameter("ibl_env_samples", scene.appleseed.ibl_env_samples)
-            self.__emit_parameter("max_path_length", scene.appleseed.max_bounces)
-            self.__emit_parameter("rr_min_path_length", scene.appleseed.rr_start)
+            engine_parameters.append( ( "dl_light_samples", scene.appleseed.dl_light_samples))
+            engine_parameters.append( ( "ibl_env_samples", scene.appleseed.ibl_env_samples))
+            engine_parameters.append( ( "max_path_length", scene.appleseed.max_bounces))
+            engine_parameters.append( ( "rr_min_path_length", scene.appleseed.rr_start))
 
         else:
-            self.__emit_parameter("alpha", scene.appleseed.sppm_alpha)
-            self.__emit_parameter("dl_mode", scene.appleseed.sppm_dl_mode)
-            self.__emit_parameter("enable_caustics", "true" if scene.appleseed.caustics_enable else "false")
-            self.__emit_parameter("env_photons_per_pass", scene.appleseed.sppm_env_photons)
-            self.__emit_parameter("initial_radius", scene.appleseed.sppm_initial_radius)
-            self.__emit_parameter("light_photons_per_pass", scene.appleseed.sppm_light_photons)
+            engine_parameters.append( ( "alpha", scene.appleseed.sppm_alpha))
+            engine_parameters.append( ( "dl_mode", scene.appleseed.sppm_dl_mode))
+            engine_parameters.append( ( "enable_caustics", "true" if scene.appleseed.caustics_enable else "false"))
+            engine_parameters.append( ( "env_photons_per_pass", scene.appleseed.sppm_env_photons))
+            engine_parameters.append( ( "initial_radius", scene.appleseed.sppm_initial_radius))
+            engine_parameters.append( ( "light_photons_per_pass", scene.appleseed.sppm_light_photons))
 
             # Leave at 0 for now - not in appleseed.studio GUI
-            self.__emit_parameter("max_path_length", 0)     
-            self.__emit_parameter("max_photons_per_estimate", scene.appleseed.sppm_max_per_estimate)
-            self.__emit_parameter("path_tracing_max_path_length", scene.appleseed.sppm_pt_max_length)
-            self.__emit_parameter("path_tracing_rr_min_path_length", scene.appleseed.sppm_pt_rr_start)
-            self.__emit_parameter("photon_tracing_max_path_length", scene.appleseed.sppm_photon_max_length)
-            self.__emit_parameter("photon_tracing_rr_min_path_length", scene.appleseed.sppm_photon_rr_start)
+            engine_parameters.append( ( "max_path_length", 0))
+            engine_parameters.append( ( "max_photons_per_estimate", scene.appleseed.sppm_max_per_estimate))
+            engine_parameters.append( ( "path_tracing_max_path_length", scene.appleseed.sppm_pt_max_length))
+            engine_parameters.append( ( "path_tracing_rr_min_path_length", scene.appleseed.sppm_pt_rr_start))
+            engine_parameters.append( ( "photon_tracing_max_path_length", scene.appleseed.sppm_photon_max_length))
+            engine_parameters.append( ( "photon_tracing_rr_min_path_length", scene.appleseed.sppm_photon_rr_start))
             
             # Leave RR path length at 3 - also not in appleseed.studio GUI
-            self.__emit_parameter("rr_min_path_length", 3)  
+            engine_parameters.append( ( "rr_min_path_length", 3))
             
-        self.__close_element('parameters')
+        groups.append( scene_ir.ParameterGroup( scene.appleseed.lighting_engine, engine_parameters))
+        return parameters, groups
 
     #----------------------------------------------------------------------------------------------
     # Common elements.
     #----------------------------------------------------------------------------------------------
 
     def __emit_color_element(self, name, color_space, values, alpha, multiplier):
-        self.__open_element('color name="{0}"'.format(name))
-        self.__emit_parameter("color_space", color_space)
-        self.__emit_parameter("multiplier", multiplier)
-        self.__emit_line("<values>{0}</values>".format(" ".join(map(str, values))))
-        if alpha:
-            self.__emit_line("<alpha>{0}</alpha>".format(" ".join(map(str, alpha))))
-        self.__close_element("color")
+        self.__write( scene_ir.Color( name, color_space, values, alpha, multiplier))
 
     #
     # A note on color spaces:
@@ -2321,7 +2713,7 @@ class write_project_file( object):
     def __emit_solid_srgb_color_element(self, name, values, multiplier):
         self.__emit_color_element(name, "srgb", values, None, multiplier)
 
-    def __emit_transform_element(self, m, time):
+    def __get_transform(self, m, time):
         #
         # We have the following conventions:
         #
@@ -2336,21 +2728,11 @@ class write_project_file( object):
         # appleseed's one by rotating by +90 degrees around the X axis. That means that Blender
         # objects must be rotated by -90 degrees around X before being exported to appleseed.
         #
-        if time is not None:
-            self.__open_element('transform time="%.2f"' % time)
-        else: 
-            self.__open_element("transform")
-        self.__open_element("matrix")
-        self.__emit_line("{0} {1} {2} {3}".format( m[0][0],  m[0][1],  m[0][2],  m[0][3]))
-        self.__emit_line("{0} {1} {2} {3}".format( m[2][0],  m[2][1],  m[2][2],  m[2][3]))
-        self.__emit_line("{0} {1} {2} {3}".format(-m[1][0], -m[1][1], -m[1][2], -m[1][3]))
-        self.__emit_line("{0} {1} {2} {3}".format( m[3][0],  m[3][1],  m[3][2],  m[3][3]))
-        self.__close_element("matrix")
-        self.__close_element("transform")
-
-    def __emit_custom_prop( self, object, prop_name, default_value):
-        value = self.__get_custom_prop(object, prop_name, default_value)
-        self.__emit_parameter(prop_name, value)
+        return scene_ir.Transform( (( m[0][0],  m[0][1],  m[0][2],  m[0][3]),
+                                    ( m[2][0],  m[2][1],  m[2][2],  m[2][3]),
+                                    (-m[1][0], -m[1][1], -m[1][2], -m[1][3]),
+                                    ( m[3][0],  m[3][1],  m[3][2],  m[3][3])),
+                                   time)
 
     def __get_custom_prop( self, object, prop_name, default_value):
         if prop_name in object:
@@ -2358,35 +2740,21 @@ class write_project_file( object):
         else:
             return default_value
 
-    def __emit_parameter( self, name, value):
-        self.__emit_line("<parameter name=\"" + name + "\" value=\"" + str(value) + "\" />")
-    
     #----------------------------------------------------------------------------------------------
     # Utilities.
     #----------------------------------------------------------------------------------------------
 
     def __open_element( self, name):
-        self.__emit_line("<" + name + ">")
-        self.__indent()
+        self._output_file.open_element( name)
 
     def __close_element( self, name):
-        self.__unindent()
-        self.__emit_line("</" + name + ">")
+        self._output_file.close_element( name)
 
     def __emit_line( self, line):
-        self.__emit_indent()
-        self._output_file.write(line + "\n")
-
-    def __indent( self):
-        self._indent += 1
-
-    def __unindent( self):
-        assert self._indent > 0
-        self._indent -= 1
+        self._output_file.emit_line( line)
 
-    def __emit_indent( self):
-        IndentSize = 4
-        self._output_file.write(" " * self._indent * IndentSize)
+    def __write( self, node):
+        scene_serializer.write( self._output_file, node)
 
     def __error( self, message):
         self.__print_message( "error", message)
@@ -2419,13 +2787,15 @@ class write_project_file( object):
         '''Write the .appleseed project file for preview rendering'''
         
         self._textures_set = set()
+        self._emitted_textures = set()
+        self._captured_textures = None
         asr_mat = mat.appleseed
         sphere_a = True if mesh == 'sphere_a' else False
         mesh = 'sphere' if mesh in {'sphere', 'sphere_a'} else mesh
         
         try:
-            with open(file_path, "w") as self._output_file:
-                self._indent = 0
+            with open(file_path, "wb") as output_file:
+                self._output_file = xml_emitter.XmlEmitter( output_file)
                 self.__emit_file_header()
                 aspect_ratio = self.__get_frame_aspect_ratio(scene.render)
 
@@ -2682,6 +3052,7 @@ class write_project_file( object):
         </configuration>
     </configurations>
 </project>""".format(int(width), int(height), asr_mat.preview_quality))
+                self._output_file.flush()
             return True
         except:
             self.__error( "Could not open %s for writing" % file_path) 
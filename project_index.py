@@ -0,0 +1,173 @@
+#
+# This source file is part of appleseed.
+# Visit http://appleseedhq.net/ for additional information and resources.
+#
+# This software is released under the MIT license.
+#
+# Copyright (c) 2013 Franz Beaune, Joel Daniels, Esteban Tovagliari.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+
+import json
+import os
+
+#
+# Sidecar index of the entities of a project file, and in-place patching.
+#
+# The index stores the byte range of every entity written by the scene
+# serializer (object instances, materials, lights, configurations...), keyed
+# by its enclosing elements, kind and name. patch_project() replaces some of
+# these entities with new fragments by copying the rest of the file in large
+# sequential blocks.
+#
+
+IndexVersion = 1
+CopyBlockSize = 4 * 1024 * 1024
+
+#--------------------------------------------------------------------------------------------------
+# Index.
+#--------------------------------------------------------------------------------------------------
+
+class ProjectIndex( object):
+    '''
+    Byte ranges of the entities of a project file. Entries are
+    ( scope, kind, name, level, start, end) tuples, scope being the tuple of the
+    enclosing elements and level the indentation level of the entity.
+    '''
+    def __init__( self, entries):
+        self.entries = entries
+        # Key -> entry position, None if several entities have the same key.
+        self._keys = {}
+        for position, entry in enumerate( entries):
+            key = entry[:3]
+            self._keys[key] = None if key in self._keys else position
+
+    def get( self, scope, kind, name):
+        '''
+        Return the entry of an entity, None if it is not in the index or not unique.
+        '''
+        position = self._keys.get( ( scope, kind, name))
+        return self.entries[position] if position is not None else None
+
+def get_index_path( project_path):
+    return project_path + ".index"
+
+def save_index( project_path, entries):
+    '''
+    Write the index of the project file, which must be complete on disk.
+    '''
+    stat = os.stat( project_path)
+    index = { "version": IndexVersion,
+              "size": stat.st_size,
+              "mtime": stat.st_mtime_ns,
+              "entries": [[list( scope), kind, name, level, start, end] for scope, kind, name, level, start, end in entries]}
+    index_path = get_index_path( project_path)
+    temp_path = index_path + ".tmp"
+    with open( temp_path, "w", encoding = "utf8") as index_file:
+        json.dump( index, index_file)
+    os.replace( temp_path, index_path)
+
+def load_index( project_path):
+    '''
+    Return the ProjectIndex of the project file, None if there is none or if the file
+    was modified since the index was written.
+    '''
+    index_path = get_index_path( project_path)
+    try:
+        stat = os.stat( project_path)
+        with open( index_path, "r", encoding = "utf8") as index_file:
+            index = json.load( index_file)
+    except ( IOError, OSError, ValueError):
+        return None
+    if index.get( "version") != IndexVersion or index.get( "size") != stat.st_size or index.get( "mtime") != stat.st_mtime_ns:
+        return None
+    return ProjectIndex( [( tuple( scope), kind, name, level, start, end) for scope, kind, name, level, start, end in index["entries"]])
+
+#--------------------------------------------------------------------------------------------------
+# Patching.
+#--------------------------------------------------------------------------------------------------
+
+def patch_project( project_path, index, replacements):
+    '''
+    Replace entities of the project file in place and update its index.
+    replacements maps ( scope, kind, name) keys of the index to the UTF-8 encoded
+    fragments replacing the entities, indented at the entity's level.
+    Return False, leaving the file untouched, if an entity is not in the index.
+    '''
+    spans = []
+    for ( scope, kind, name), data in replacements.items():
+        entry = index.get( scope, kind, name)
+        if entry is None:
+            return False
+        spans.append( ( entry[4], entry[5], data))
+    spans.sort( key = lambda span: span[0])
+    for previous, span in zip( spans, spans[1:]):
+        if span[0] < previous[1]:
+            return False
+
+    temp_path = project_path + ".tmp"
+    with open( project_path, "rb") as source, open( temp_path, "wb") as target:
+        position = 0
+        for start, end, data in spans:
+            _copy( source, target, start - position)
+            target.write( data)
+            source.seek( end)
+            position = end
+        while True:
+            block = source.read( CopyBlockSize)
+            if not block:
+                break
+            target.write( block)
+    os.replace( temp_path, project_path)
+
+    save_index( project_path, _shift_entries( index.entries, spans))
+    return True
+
+def _copy( source, target, size):
+    while size > 0:
+        block = source.read( min( size, CopyBlockSize))
+        if not block:
+            raise IOError( "Unexpected end of file")
+        target.write( block)
+        size -= len( block)
+
+def _shift_entries( entries, spans):
+    # Move the entries after each replaced range by its change in size.
+    # Entries nested in a replaced entity are dropped.
+    replaced = dict( ( span[0], span) for span in spans)
+    shifted = []
+    for scope, kind, name, level, start, end in entries:
+        span = replaced.get( start)
+        if span is not None and span[1] == end:
+            new_start = _shift( start, spans)
+            shifted.append( ( scope, kind, name, level, new_start, new_start + len( span[2])))
+            continue
+        if any( span_start < start < span_end for span_start, span_end, data in spans):
+            continue
+        shifted.append( ( scope, kind, name, level, _shift( start, spans), _shift( end, spans)))
+    return shifted
+
+def _shift( offset, spans):
+    delta = 0
+    for start, end, data in spans:
+        if end <= offset:
+            delta += len( data) - ( end - start)
+    return offset + delta
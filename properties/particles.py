@@ -30,6 +30,12 @@ class AppleseedPsysProps( bpy.types.PropertyGroup):
                                         min = 0,
                                         max = 2)
                                         
+    curve_points = IntProperty( name = "Points",
+                                        description = "Points written per strand, evenly spaced from root to tip. More points follow the strand more closely but take longer to export. Values above the number of render steps write every step",
+                                        default = 4,
+                                        min = 2,
+                                        max = 256)
+
     scaling = FloatProperty( name = "Scaling",
                                         description = "Multiplier of width properties",
                                         default = 0.01,
@@ -95,14 +95,72 @@ class AppleseedRenderSettings( bpy.types.PropertyGroup):
                                             max = 30)
 
         cls.generate_mesh_files = bpy.props.BoolProperty( name="Export Geometry",
-                                            description = "Write geometry to disk as .obj files",
+                                            description = "Write geometry to disk",
                                             default = True)
 
+        cls.mesh_file_format = bpy.props.EnumProperty( name = "Format",
+                                            description = "File format of exported meshes",
+                                            items = [
+                                            ( 'obj', "OBJ", "Wavefront .obj text files"),
+                                            ( 'binarymesh', "Binary Mesh", "appleseed .binarymesh files, much faster to load than .obj")],
+                                            default = 'obj')
+
+        cls.mesh_export_method = bpy.props.EnumProperty( name = "Method",
+                                            description = "How meshes are written to disk",
+                                            items = [
+                                            ( 'numpy', "NumPy", "Extract mesh buffers in bulk and encode them vectorized"),
+                                            ( 'python', "Python", "Walk vertices and faces one by one (slower)")],
+                                            default = 'numpy')
+
+        cls.float_precision = bpy.props.EnumProperty( name = "Precision",
+                                            description = "How numbers are written to .obj and .curves files",
+                                            items = [
+                                            ( 'float32', "Float32", "Shortest text that reads back as the same single precision value, lossless for Blender data"),
+                                            ( 'fixed', "Fixed", "Fixed number of decimals"),
+                                            ( 'double', "Double", "15 decimals, 6 in .curves files (4 for radii), as written by previous versions")],
+                                            default = 'double')
+
+        cls.float_digits = bpy.props.IntProperty( name = "Decimals",
+                                            description = "Number of decimals written with fixed precision",
+                                            default = 6,
+                                            min = 1,
+                                            max = 15)
+
+        cls.normal_tolerance = bpy.props.FloatProperty( name = "Normal Tolerance",
+                                            description = "Normals closer than this are written once to .obj files. 0 only merges identical normals",
+                                            default = 0.0,
+                                            min = 0.0,
+                                            max = 0.1,
+                                            precision = 5)
+
+        cls.mesh_chunk_size = bpy.props.IntProperty( name = "Chunk Size (MB)",
+                                            description = "Memory used to format each piece of an .obj file. Large meshes are written in several pieces",
+                                            default = 64,
+                                            min = 1,
+                                            max = 4096)
+
+        cls.mesh_export_processes = bpy.props.IntProperty( name = "Processes",
+                                            description = "Number of processes encoding mesh files in the background. 1 encodes them during the export",
+                                            default = threads,
+                                            min = 1,
+                                            max = max_threads)
+
+        cls.instancing_mode = bpy.props.EnumProperty( name = "Instances",
+                                            description = "How dupli and particle instances are written to the project file",
+                                            items = [
+                                            ( 'standard', "Standard", "Write each object instance as an indented element"),
+                                            ( 'compact', "Compact", "Write the instances of each object in one batch, one line per instance, with vectorized matrix formatting")],
+                                            default = 'standard')
+
+        cls.skip_instance_sources = bpy.props.BoolProperty( name = "Skip Instance Sources",
+                                            description = "Do not render the objects used as particles or dupli group members at their own location. Off by default for compatibility with Blender, which renders them there when they are on a visible layer, and with projects exported by previous versions",
+                                            default = False)
+
         cls.export_mode = bpy.props.EnumProperty( name = "", 
                                             description = "Geometry export mode",
                                             items = [
                                             ( 'all', "All", "Export all geometry, overwriting existing .obj files"),
-                                            ( 'partial', "Partial", "Only export geometry that has not been written to disk"),
+                                            ( 'partial', "Partial", "Only write geometry that changed since it was last written to disk"),
                                             ( 'selected', "Selected", "Only export selected geometry")],
                                             default = 'all')
                                             
@@ -370,13 +428,22 @@ class AppleseedRenderSettings( bpy.types.PropertyGroup):
                                             default = False)
 
         cls.mblur_samples = bpy.props.IntProperty( name = "Motion Blur Samples",
-                                            description = "Number of samples to use for motion blur",
-                                            default = 2)
+                                            description = "Number of evenly spaced transformation keys written for objects and cameras with motion blur",
+                                            default = 2,
+                                            min = 2,
+                                            max = 32)
 
         cls.def_mblur = bpy.props.BoolProperty( name = "Deformation Motion Blur",
                                             description = "Global toggle for rendering of deformation motion blur. Warning - objects with deformation motion blur enabled will add to export time!",
                                             default = False)
 
+        cls.def_mblur_keys = bpy.props.EnumProperty( name = "Deformation Keys",
+                                            description = "Contents of the mesh files written for the shutter close key of deformation motion blur",
+                                            items = [
+                                            ( 'full', "Full Mesh", "Write a complete mesh file"),
+                                            ( 'vertex', "Vertices Only", "Write positions and normals only, sharing the shutter open topology. A full mesh file is written when the topology changes")],
+                                            default = 'full')
+
         cls.ob_mblur = bpy.props.BoolProperty( name = "Object Motion Blur", 
                                             description = "Global toggle for rendering of object motion blur",
                                             default = False)
@@ -0,0 +1,163 @@
+#
+# This source file is part of appleseed.
+# Visit http://appleseedhq.net/ for additional information and resources.
+#
+# This software is released under the MIT license.
+#
+# Copyright (c) 2013 Franz Beaune, Joel Daniels, Esteban Tovagliari.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+
+#
+# Intermediate representation of the entities of an appleseed project.
+#
+# write_project_file reads the Blender scene and fills these nodes; the
+# scene_serializer module turns them into .appleseed XML. Nodes hold plain
+# Python values only, so they can be built, compared and serialized outside
+# of Blender.
+#
+# Parameters are ordered lists of ( name, value) pairs, written in order.
+#
+# Every entity, instance and configuration of the project is a node, except the
+# object instances of the compact instancing mode, which instance_encoder
+# formats as whole lines. The writer only emits the enclosing elements itself:
+# project, scene, assemblies, output, rules and configurations.
+#
+
+#--------------------------------------------------------------------------------------------------
+# Common elements.
+#--------------------------------------------------------------------------------------------------
+
+class ParameterGroup( object):
+    '''
+    A named group of parameters, such as the settings of one renderer component.
+    '''
+    __slots__ = ( 'name', 'parameters')
+
+    def __init__( self, name, parameters):
+        self.name = name
+        self.parameters = parameters
+
+class Color( object):
+    '''
+    A solid color entity.
+    '''
+    __slots__ = ( 'name', 'color_space', 'values', 'alpha', 'multiplier')
+
+    def __init__( self, name, color_space, values, alpha = None, multiplier = 1.0):
+        self.name = name
+        self.color_space = color_space
+        self.values = values
+        self.alpha = alpha
+        self.multiplier = multiplier
+
+class Transform( object):
+    '''
+    A transform given as the four rows of a matrix in appleseed's coordinate system.
+    '''
+    __slots__ = ( 'rows', 'time')
+
+    def __init__( self, rows, time = None):
+        self.rows = rows
+        self.time = time
+
+class LookAt( object):
+    '''
+    A transform given as an origin, a target and an up vector in appleseed's coordinate system.
+    '''
+    __slots__ = ( 'origin', 'target', 'up', 'time')
+
+    def __init__( self, origin, target, up, time = None):
+        self.origin = origin
+        self.target = target
+        self.up = up
+        self.time = time
+
+#--------------------------------------------------------------------------------------------------
+# Entities.
+#--------------------------------------------------------------------------------------------------
+
+class Entity( object):
+    '''
+    An entity with an optional model: texture, material, EDF, environment, light, camera,
+    object, frame, render layer rule... kind is the XML element name. Parameters are written before parameter groups,
+    and transforms last.
+    '''
+    __slots__ = ( 'kind', 'name', 'model', 'parameters', 'groups', 'transforms')
+
+    def __init__( self, kind, name, model = None, parameters = None, groups = None, transforms = None):
+        self.kind = kind
+        self.name = name
+        self.model = model
+        self.parameters = parameters if parameters is not None else []
+        self.groups = groups if groups is not None else []
+        self.transforms = transforms if transforms is not None else []
+
+class TextureInstance( object):
+    '''
+    An instance of a texture entity.
+    '''
+    __slots__ = ( 'name', 'texture', 'parameters')
+
+    def __init__( self, name, texture, parameters):
+        self.name = name
+        self.texture = texture
+        self.parameters = parameters
+
+class ObjectInstance( object):
+    '''
+    An instance of an object, with the same material on all of its faces.
+    '''
+    __slots__ = ( 'name', 'object', 'transforms', 'front_material', 'back_material')
+
+    def __init__( self, name, object, transforms, front_material, back_material):
+        self.name = name
+        self.object = object
+        self.transforms = transforms
+        self.front_material = front_material
+        self.back_material = back_material
+
+class AssemblyInstance( object):
+    '''
+    An instance of an assembly.
+    '''
+    __slots__ = ( 'name', 'assembly', 'transforms')
+
+    def __init__( self, name, assembly, transforms):
+        self.name = name
+        self.assembly = assembly
+        self.transforms = transforms
+
+#--------------------------------------------------------------------------------------------------
+# Configurations.
+#--------------------------------------------------------------------------------------------------
+
+class Configuration( object):
+    '''
+    A render configuration, overriding the parameters of its base configuration.
+    '''
+    __slots__ = ( 'name', 'base', 'parameters', 'groups')
+
+    def __init__( self, name, base, parameters, groups):
+        self.name = name
+        self.base = base
+        self.parameters = parameters
+        self.groups = groups
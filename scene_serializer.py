@@ -0,0 +1,164 @@
+#
+# This source file is part of appleseed.
+# Visit http://appleseedhq.net/ for additional information and resources.
+#
+# This software is released under the MIT license.
+#
+# Copyright (c) 2013 Franz Beaune, Joel Daniels, Esteban Tovagliari.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+
+#
+# Serialization of scene_ir nodes to .appleseed XML.
+#
+# Nodes are written to an xml_emitter.XmlEmitter, or any object with the same
+# open_element(), close_element(), emit_line(), begin_entry() and add_entry()
+# methods. Entities, texture instances, object instances, assembly instances
+# and configurations are recorded in the emitter's index. Writers are looked
+# up by node class name, so this module has no import dependencies and can be
+# used outside of Blender.
+#
+
+#--------------------------------------------------------------------------------------------------
+# Public functions.
+#--------------------------------------------------------------------------------------------------
+
+def write( emitter, node):
+    '''
+    Write one node.
+    '''
+    _writers[node.__class__.__name__]( emitter, node)
+
+def write_all( emitter, nodes):
+    '''
+    Write nodes in order.
+    '''
+    for node in nodes:
+        _writers[node.__class__.__name__]( emitter, node)
+
+#--------------------------------------------------------------------------------------------------
+# Common elements.
+#--------------------------------------------------------------------------------------------------
+
+def _write_parameters( emitter, parameters):
+    emit_line = emitter.emit_line
+    for name, value in parameters:
+        emit_line( '<parameter name="%s" value="%s" />' % ( name, value))
+
+def _write_parameter_group( emitter, group):
+    emitter.open_element( 'parameters name="%s"' % group.name)
+    _write_parameters( emitter, group.parameters)
+    emitter.close_element( "parameters")
+
+def _write_color( emitter, color):
+    emitter.open_element( 'color name="%s"' % color.name)
+    _write_parameters( emitter, ( ( "color_space", color.color_space), ( "multiplier", color.multiplier)))
+    emitter.emit_line( "<values>%s</values>" % " ".join( map( str, color.values)))
+    if color.alpha:
+        emitter.emit_line( "<alpha>%s</alpha>" % " ".join( map( str, color.alpha)))
+    emitter.close_element( "color")
+
+def _open_transform( emitter, time):
+    if time is not None:
+        emitter.open_element( 'transform time="%.9g"' % time)
+    else:
+        emitter.open_element( "transform")
+
+def _write_transform( emitter, transform):
+    _open_transform( emitter, transform.time)
+    emitter.open_element( "matrix")
+    for row in transform.rows:
+        emitter.emit_line( "{0} {1} {2} {3}".format( row[0], row[1], row[2], row[3]))
+    emitter.close_element( "matrix")
+    emitter.close_element( "transform")
+
+def _write_look_at( emitter, look_at):
+    _open_transform( emitter, look_at.time)
+    origin, target, up = look_at.origin, look_at.target, look_at.up
+    emitter.emit_line( '<look_at origin="{0} {1} {2}" target="{3} {4} {5}" up="{6} {7} {8}" />'.format(
+                       origin[0], origin[1], origin[2],
+                       target[0], target[1], target[2],
+                       up[0], up[1], up[2]))
+    emitter.close_element( "transform")
+
+#--------------------------------------------------------------------------------------------------
+# Entities.
+#--------------------------------------------------------------------------------------------------
+
+def _write_entity( emitter, entity):
+    start = emitter.begin_entry()
+    if entity.model is not None:
+        emitter.open_element( '%s name="%s" model="%s"' % ( entity.kind, entity.name, entity.model))
+    else:
+        emitter.open_element( '%s name="%s"' % ( entity.kind, entity.name))
+    _write_parameters( emitter, entity.parameters)
+    for group in entity.groups:
+        _write_parameter_group( emitter, group)
+    write_all( emitter, entity.transforms)
+    emitter.close_element( entity.kind)
+    emitter.add_entry( entity.kind, entity.name, start)
+
+def _write_texture_instance( emitter, instance):
+    start = emitter.begin_entry()
+    emitter.open_element( 'texture_instance name="%s" texture="%s"' % ( instance.name, instance.texture))
+    _write_parameters( emitter, instance.parameters)
+    emitter.close_element( "texture_instance")
+    emitter.add_entry( "texture_instance", instance.name, start)
+
+def _write_object_instance( emitter, instance):
+    start = emitter.begin_entry()
+    emitter.open_element( 'object_instance name="%s" object="%s"' % ( instance.name, instance.object))
+    write_all( emitter, instance.transforms)
+    emitter.emit_line( '<assign_material slot="0" side="front" material="%s" />' % instance.front_material)
+    emitter.emit_line( '<assign_material slot="0" side="back" material="%s" />' % instance.back_material)
+    emitter.close_element( "object_instance")
+    emitter.add_entry( "object_instance", instance.name, start)
+
+def _write_assembly_instance( emitter, instance):
+    start = emitter.begin_entry()
+    emitter.open_element( 'assembly_instance name="%s" assembly="%s"' % ( instance.name, instance.assembly))
+    write_all( emitter, instance.transforms)
+    emitter.close_element( "assembly_instance")
+    emitter.add_entry( "assembly_instance", instance.name, start)
+
+#--------------------------------------------------------------------------------------------------
+# Configurations.
+#--------------------------------------------------------------------------------------------------
+
+def _write_configuration( emitter, configuration):
+    start = emitter.begin_entry()
+    emitter.open_element( 'configuration name="%s" base="%s"' % ( configuration.name, configuration.base))
+    _write_parameters( emitter, configuration.parameters)
+    for group in configuration.groups:
+        _write_parameter_group( emitter, group)
+    emitter.close_element( "configuration")
+    emitter.add_entry( "configuration", configuration.name, start)
+
+_writers = {
+    'ParameterGroup'   : _write_parameter_group,
+    'Color'            : _write_color,
+    'Transform'        : _write_transform,
+    'LookAt'           : _write_look_at,
+    'Entity'           : _write_entity,
+    'TextureInstance'  : _write_texture_instance,
+    'ObjectInstance'   : _write_object_instance,
+    'AssemblyInstance' : _write_assembly_instance,
+    'Configuration'    : _write_configuration }
@@ -0,0 +1,51 @@
+#
+# The add-on's __init__ imports bpy, which only exists inside Blender. The modules
+# that do not use bpy are tested by registering the add-on directory as a package
+# without running its __init__, under the name of the directory (which pytest imports
+# when collecting the tests) and as render_appleseed (which the tests import).
+#
+
+import os
+import sys
+import types
+import numpy as np
+import pytest
+
+AddonPath = os.path.dirname( os.path.dirname( os.path.abspath( __file__)))
+
+PackageName = os.path.basename( AddonPath)
+if PackageName not in sys.modules:
+    package = types.ModuleType( PackageName)
+    package.__path__ = [AddonPath]
+    sys.modules[PackageName] = package
+sys.modules.setdefault( "render_appleseed", sys.modules[PackageName])
+
+from render_appleseed import mesh_encoder
+
+def make_mesh_arrays( seed = 0, num_vertices = 40, num_faces = 60, uvs = True):
+    '''
+    Random tessellated mesh buffers, as returned by mesh_writer.get_mesh_arrays().
+    Coordinates are float32, and normals take few distinct values so that some are shared.
+    '''
+    random = np.random.RandomState( seed)
+    co = random.uniform( -5.0, 5.0, ( num_vertices, 3)).astype( np.float32)
+    vertex_normals = random.choice( [0.0, -0.0, 1.0, 0.5, -0.25], ( num_vertices, 3)).astype( np.float32)
+    face_vertices = np.zeros(( num_faces, 4), dtype = np.int32)
+    for face in range( num_faces):
+        size = random.choice( [3, 4])
+        vertices = random.choice( num_vertices, size, replace = False)
+        if size == 4 and vertices[3] == 0:
+            # Blender never stores vertex 0 in the fourth slot of a quad.
+            vertices = np.roll( vertices, 1)
+        face_vertices[face, :size] = vertices
+    face_normals = random.choice( [0.0, -0.0, 1.0, 0.5], ( num_faces, 3)).astype( np.float32)
+    material_indices = random.randint( 0, 3, num_faces).astype( np.int32)
+    smooth = random.uniform( size = num_faces) < 0.5
+    face_uvs = None
+    if uvs:
+        face_uvs = random.uniform( size = ( num_faces, 4, 2)).astype( np.float32)
+    return mesh_encoder.MeshArrays( co, vertex_normals, face_vertices, face_normals, material_indices, smooth, face_uvs)
+
+@pytest.fixture
+def mesh_arrays():
+    return make_mesh_arrays
@@ -0,0 +1,91 @@
+import io
+import numpy as np
+from render_appleseed import instance_encoder
+from render_appleseed import scene_ir
+from render_appleseed import scene_serializer
+from render_appleseed import xml_emitter
+
+def serialize( nodes):
+    output = io.BytesIO()
+    emitter = xml_emitter.XmlEmitter( output)
+    scene_serializer.write_all( emitter, nodes)
+    emitter.flush()
+    return output.getvalue().decode( "utf8")
+
+def translation( x, y, z):
+    matrix = np.identity( 4)
+    matrix[:3, 3] = ( x, y, z)
+    return matrix
+
+def test_duplis_share_one_assembly():
+    times = [ 0.0, 1.0]
+    assemblies = instance_encoder.DupliAssemblies()
+    placed = []
+    for offset in ( 1.0, 2.0):
+        # Two duplis of the same source object, moving along X during the shutter.
+        rows = instance_encoder.get_instance_rows( np.identity( 4), np.array([ translation( offset, 0, 0), translation( offset + 0.5, 0, 0)]))
+        placed.append( assemblies.place( "cube", instance_encoder.get_motion_transforms( rows, times)))
+
+    assert [ ( name, new) for name, new, instance in placed] == [ ( "cube_dupli", True), ( "cube_dupli", False)]
+    instances = [ instance for name, new, instance in placed]
+    assert [ instance.name for instance in instances] == [ "cube_dupli.instance_0", "cube_dupli.instance_1"]
+    assert [ [ transform.rows[0][3] for transform in instance.transforms] for instance in instances] == [ [ 1.0, 1.5], [ 2.0, 2.5]]
+
+    lines = serialize( instances).splitlines()
+    assert [ line for line in lines if "assembly_instance name" in line] == [
+        '<assembly_instance name="cube_dupli.instance_0" assembly="cube_dupli">',
+        '<assembly_instance name="cube_dupli.instance_1" assembly="cube_dupli">']
+    assert lines.count( '    <transform time="0">') == 2
+    assert lines.count( '    <transform time="1">') == 2
+    assert '            1.0 0.0 0.0 1.5' in lines
+    assert '            1.0 0.0 0.0 2.5' in lines
+
+def test_motion_transforms_are_y_up():
+    matrix = translation( 1, 2, 3)
+    transforms = instance_encoder.get_motion_transforms( instance_encoder.get_instance_rows( np.identity( 4), matrix[None]), [ 0.5])
+    assert transforms[0].time == 0.5
+    assert transforms[0].rows == (( 1.0, 0.0, 0.0, 1.0),
+                                  ( 0.0, 0.0, 1.0, 3.0),
+                                  ( -0.0, -1.0, -0.0, -2.0),
+                                  ( 0.0, 0.0, 0.0, 1.0))
+
+def test_compact_instances_match_standard_transforms():
+    random = np.random.RandomState( 0)
+    matrices = random.uniform( -10.0, 10.0, ( 3, 4, 4)).astype( np.float32)
+    matrices[:, 3] = ( 0.0, 0.0, 0.0, 1.0)
+    matrices_text = instance_encoder.format_instance_matrices( instance_encoder.get_instance_matrices( np.identity( 4), matrices))
+
+    output = io.BytesIO()
+    emitter = xml_emitter.XmlEmitter( output, level = 1, index = True)
+    for name, line in instance_encoder.encode_object_instances( "cube.part_0", "cube.part_0.instance_", 4, matrices_text, "front", "back"):
+        start = emitter.begin_entry()
+        emitter.emit_line( line)
+        emitter.add_entry( "object_instance", name, start)
+    emitter.flush()
+    data = output.getvalue()
+    entries = emitter.get_index()
+    assert [ name for scope, kind, name, level, start, end in entries] == [ "cube.part_0.instance_%d" % index for index in range( 4, 7)]
+
+    for matrix, ( scope, kind, name, level, start, end) in zip( matrices, entries):
+        line = data[start:end].decode( "utf8")
+        assert line.startswith( '    <object_instance name="%s" object="cube.part_0">' % name)
+        # Same values and text as the transform of an instance written by scene_serializer,
+        # from the rows of a Blender (float32) matrix.
+        m = matrix.tolist()
+        transform = scene_ir.Transform(( m[0], m[2], [ -value for value in m[1]], m[3]))
+        expected = [ row.strip() for row in serialize([ transform]).splitlines()[2:6]]
+        assert line.split( "<matrix>")[1].split( "</matrix>")[0] == " ".join( expected)
+
+def test_particle_rows_are_rotated_and_y_up():
+    # A particle at ( 1, 2, 3), rotated by 90 degrees around Z, with size 2, and a global scale of 3.
+    half_angle = np.pi / 4.0
+    matrices = instance_encoder.compose_particle_matrices( [( 1.0, 2.0, 3.0)], [( np.cos( half_angle), 0.0, 0.0, np.sin( half_angle))], [( 2.0, 2.0, 2.0)])
+    global_matrix = np.diag(( 3.0, 3.0, 3.0, 1.0))
+    rows = instance_encoder.get_instance_rows( global_matrix, matrices)
+    assert rows.shape == ( 1, 4, 4)
+    assert np.allclose( rows[0], [( 0.0, -6.0, 0.0, 3.0),
+                                  ( 0.0, 0.0, 6.0, 9.0),
+                                  ( -6.0, 0.0, 0.0, -6.0),
+                                  ( 0.0, 0.0, 0.0, 1.0)])
+    # Same rows as the matrices converted one by one.
+    assert np.array_equal( rows, instance_encoder.swap_axes( instance_encoder.get_instance_matrices( global_matrix, matrices)))
@@ -0,0 +1,41 @@
+import os
+from render_appleseed import mesh_cache
+
+Parts = [( 0, "part_0"), ( 2, "part_2")]
+
+def write_mesh_file( meshes_path, filename):
+    with open( os.path.join( meshes_path, filename), "w") as mesh_file:
+        mesh_file.write( "v 0 0 0\n")
+
+def test_round_trip( tmpdir):
+    meshes_path = str( tmpdir.join( "meshes"))
+    cache = mesh_cache.MeshCache( meshes_path)
+    cache.store( "cube.obj", "hash", Parts, "fingerprint")
+    cache.store( "sphere.obj", "hash", Parts)
+    cache.save()
+    write_mesh_file( meshes_path, "cube.obj")
+
+    cache = mesh_cache.MeshCache( meshes_path)
+    assert cache.lookup( "cube.obj", "hash") == Parts
+    assert cache.lookup( "cube.obj", "other hash") is None
+    assert cache.lookup_fingerprint( "cube.obj", "fingerprint") == Parts
+    assert cache.lookup_fingerprint( "cube.obj", None) is None
+    # Entries of files missing on disk are not used.
+    assert cache.lookup( "sphere.obj", "hash") is None
+
+def test_discard( tmpdir):
+    meshes_path = str( tmpdir)
+    cache = mesh_cache.MeshCache( meshes_path)
+    cache.store( "cube.obj", "hash", Parts)
+    cache.save()
+    write_mesh_file( meshes_path, "cube.obj")
+    cache.discard( "cube.obj")
+    cache.save()
+    assert mesh_cache.MeshCache( meshes_path).lookup( "cube.obj", "hash") is None
+
+def test_damaged_manifest( tmpdir):
+    meshes_path = str( tmpdir)
+    with open( os.path.join( meshes_path, mesh_cache.MeshCache.ManifestName), "w") as manifest_file:
+        manifest_file.write( "{")
+    write_mesh_file( meshes_path, "cube.obj")
+    assert mesh_cache.MeshCache( meshes_path).lookup( "cube.obj", "hash") is None
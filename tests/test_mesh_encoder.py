@@ -0,0 +1,167 @@
+import struct
+import numpy as np
+from render_appleseed import mesh_encoder
+
+# A quad and two triangles with two materials, flat and smooth faces, and values
+# that are not exact in float32 (0.1, 0.6...).
+def make_small_mesh( uvs = True):
+    f32 = np.float32
+    co = np.array([( 0.0, 0.0, 0.0), ( 1.0, 0.0, 0.0), ( 1.0, 1.0, 0.0), ( 0.0, 1.0, 0.1), ( 0.5, 0.5, -1.25)], dtype = f32)
+    vertex_normals = np.array([( 0.0, 0.0, 1.0), ( 0.0, 0.0, 1.0), ( 0.0, 0.6, 0.8), ( 0.0, 0.6, 0.8), ( -1.0, 0.0, 0.0)], dtype = f32)
+    face_vertices = np.array([( 0, 1, 2, 0), ( 1, 2, 3, 4), ( 0, 3, 4, 0)], dtype = np.int32)
+    face_normals = np.array([( 0.0, 0.0, 1.0), ( 0.0, -0.6, 0.8), ( -1.0, 0.0, 0.0)], dtype = f32)
+    material_indices = np.array([ 1, 0, 1], dtype = np.int32)
+    smooth = np.array([ True, False, False])
+    face_uvs = None
+    if uvs:
+        face_uvs = np.array([[( 0.0, 0.0), ( 1.0, 0.0), ( 1.0, 1.0), ( 0.0, 0.0)],
+                             [( 1.0, 0.0), ( 1.0, 1.0), ( 0.0, 1.0), ( 0.1, 0.3)],
+                             [( 0.0, 0.0), ( 0.0, 1.0), ( 0.1, 0.3), ( 0.0, 0.0)]], dtype = f32)
+    return mesh_encoder.MeshArrays( co, vertex_normals, face_vertices, face_normals, material_indices, smooth, face_uvs)
+
+# Written by mesh_writer.write_mesh_to_disk(), the per-vertex Python writer, for make_small_mesh().
+LegacyVertices = '''\
+v 0.000000000000000 0.000000000000000 0.000000000000000
+v 1.000000000000000 0.000000000000000 0.000000000000000
+v 1.000000000000000 1.000000000000000 0.000000000000000
+v 0.000000000000000 1.000000000000000 0.100000001490116
+v 0.500000000000000 0.500000000000000 -1.250000000000000
+vn 0.000000000000000 -0.600000023841858 0.800000011920929
+vn 0.000000000000000 0.000000000000000 1.000000000000000
+vn 0.000000000000000 0.600000023841858 0.800000011920929
+vn -1.000000000000000 0.000000000000000 0.000000000000000
+'''
+
+LegacyObj = LegacyVertices + '''\
+vt 1.000000000000000 0.000000000000000
+vt 1.000000000000000 1.000000000000000
+vt 0.000000000000000 1.000000000000000
+vt 0.100000001490116 0.300000011920929
+vt 0.000000000000000 0.000000000000000
+o part_0
+f 2/1/1 3/2/1 4/3/1 5/4/1
+o part_1
+f 1/5/2 2/1/2 3/2/3
+f 1/5/4 4/3/4 5/4/4
+'''
+
+LegacyObjWithoutUVs = LegacyVertices + '''\
+o part_0
+f 2//1 3//1 4//1 5//1
+o part_1
+f 1//2 2//2 3//3
+f 1//4 4//4 5//4
+'''
+
+def test_obj_matches_legacy_writer():
+    text, mesh_parts = mesh_encoder.encode_obj( make_small_mesh())
+    assert text == LegacyObj
+    assert mesh_parts == [( 0, "part_0"), ( 1, "part_1")]
+
+def test_obj_without_uvs_matches_legacy_writer():
+    text, mesh_parts = mesh_encoder.encode_obj( make_small_mesh( uvs = False))
+    assert text == LegacyObjWithoutUVs
+
+def test_obj_chunks_join_to_the_whole_text( mesh_arrays):
+    arrays = mesh_arrays( 1)
+    text = mesh_encoder.encode_obj( arrays)[0]
+    for chunk_rows in ( 1, 7, 1000):
+        assert "".join( mesh_encoder.iter_obj_chunks( arrays, chunk_rows)) == text
+
+def test_float32_precision_reads_back_exactly( mesh_arrays):
+    arrays = mesh_arrays( 2)
+    text = "".join( mesh_encoder.iter_obj_chunks( arrays, precision = 'float32'))
+    vertices = [line.split()[1:] for line in text.splitlines() if line.startswith( "v ")]
+    assert np.array_equal( np.array( vertices, dtype = np.float32), arrays.co)
+
+def read_binarymesh( data):
+    '''
+    Decode an uncompressed .binarymesh file into { part name: list of faces}, each face
+    being the list of its ( position, normal, texture coordinate) corners.
+    '''
+    assert data[:10] == mesh_encoder.BinaryMeshSignature
+    assert struct.unpack_from( "<H", data, 10)[0] == mesh_encoder.BinaryMeshVersion
+    offset = 12
+    def read( fmt):
+        nonlocal offset
+        values = struct.unpack_from( "<" + fmt, data, offset)
+        offset += struct.calcsize( "<" + fmt)
+        return values
+    def read_vectors( size):
+        count = read( "I")[0]
+        return [read( "%dd" % size) for i in range( count)]
+    parts = {}
+    while offset < len( data):
+        name_length = read( "H")[0]
+        name = data[offset:offset + name_length].decode( "utf8")
+        offset += name_length
+        positions = read_vectors( 3)
+        normals = read_vectors( 3)
+        texcoords = read_vectors( 2)
+        assert read( "H")[0] == 0
+        faces = []
+        for i in range( read( "I")[0]):
+            count = read( "H")[0]
+            vertices = read( "%dI" % count)
+            face_normals = read( "%dI" % count)
+            face_texcoords = read( "%dI" % count)
+            read( "H")
+            faces.append([( positions[v], normals[n], texcoords[t]) for v, n, t in zip( vertices, face_normals, face_texcoords)])
+        parts[name] = faces
+    return parts
+
+def test_binarymesh_faces_match_the_mesh():
+    arrays = make_small_mesh()
+    chunks, mesh_parts = mesh_encoder.encode_binarymesh( arrays)
+    parts = read_binarymesh( b"".join( chunks))
+    assert mesh_parts == [( 0, "part_0"), ( 1, "part_1")]
+
+    f64 = lambda values: tuple( float( x) for x in values)
+    expected = { "part_0": [], "part_1": []}
+    for face in range( arrays.num_faces):
+        size = 4 if arrays.face_vertices[face, 3] != 0 else 3
+        corners = []
+        for corner in range( size):
+            vertex = arrays.face_vertices[face, corner]
+            normal = arrays.vertex_normals[vertex] if arrays.smooth[face] else arrays.face_normals[face]
+            corners.append(( f64( arrays.co[vertex]), f64( normal), f64( arrays.uvs[face, corner])))
+        expected["part_%d" % arrays.material_indices[face]].append( corners)
+    assert sorted( parts) == sorted( expected)
+    for name in parts:
+        assert sorted( parts[name]) == sorted( expected[name])
+
+def test_vertex_keys_have_the_normals_and_faces_of_the_shutter_open_mesh( mesh_arrays):
+    open_arrays = mesh_arrays( 5)
+    key_arrays = mesh_arrays( 6)
+    key_arrays = mesh_encoder.MeshArrays( key_arrays.co, key_arrays.vertex_normals, open_arrays.face_vertices, key_arrays.face_normals,
+                                          open_arrays.material_indices, open_arrays.smooth)
+    assert mesh_encoder.same_topology( open_arrays, key_arrays)
+    key_arrays = mesh_encoder.get_vertex_key_arrays( key_arrays, open_arrays)
+    assert key_arrays.uvs is None
+
+    open_lines = "".join( mesh_encoder.iter_obj_chunks( open_arrays, normal_tolerance = None)).splitlines()
+    key_lines = "".join( mesh_encoder.iter_obj_chunks( key_arrays, normal_tolerance = None)).splitlines()
+    count = lambda lines, prefix: len([ line for line in lines if line.startswith( prefix)])
+    # Normals are not merged by value, so the keys have as many normals as the shutter open mesh.
+    num_normals = count( open_lines, "vn ")
+    assert num_normals == count( key_lines, "vn ")
+    assert num_normals > count( mesh_encoder.encode_obj( open_arrays)[0].splitlines(), "vn ")
+    assert count( key_lines, "v ") == len( open_arrays.co)
+    # Same faces, without texture coordinates.
+    def faces( lines):
+        corners = lambda line: [ corner.split( "/") for corner in line.split()[1:]]
+        return [[( corner[0], corner[2]) for corner in corners( line)] for line in lines if line.startswith( "f ")]
+    assert faces( key_lines) == faces( open_lines)
+    assert all( "//" in line for line in key_lines if line.startswith( "f "))
+
+def test_mesh_arrays_file_round_trip( tmpdir, mesh_arrays):
+    for arrays in ( mesh_arrays( 3), mesh_arrays( 4, uvs = False)):
+        filepath = str( tmpdir.join( "arrays.npz"))
+        mesh_encoder.save_mesh_arrays( arrays, filepath)
+        loaded = mesh_encoder.load_mesh_arrays( filepath)
+        for slot in mesh_encoder.MeshArrays.__slots__:
+            if getattr( arrays, slot) is None:
+                assert getattr( loaded, slot) is None
+            else:
+                assert np.array_equal( getattr( loaded, slot), getattr( arrays, slot))
+        assert mesh_encoder.hash_mesh_arrays( loaded) == mesh_encoder.hash_mesh_arrays( arrays)
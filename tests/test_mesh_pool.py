@@ -0,0 +1,53 @@
+import os
+import sys
+from render_appleseed import mesh_encoder
+from render_appleseed import mesh_pool
+
+def read( filepath):
+    with open( filepath, "rb") as f:
+        return f.read()
+
+def test_parallel_files_match_serial_files( tmpdir, mesh_arrays):
+    pool = mesh_pool.MeshEncoderPool( 2, sys.executable)
+    assert pool.parallel
+    options = { "normal_tolerance": 0.0, "precision": 'fixed', "digits": 5}
+    jobs = []
+    for seed in range( 8):
+        arrays = mesh_arrays( seed, uvs = seed % 2 == 0)
+        for file_format in ( 'obj', 'binarymesh'):
+            filepath = str( tmpdir.join( "mesh_%d.%s" % ( seed, file_format)))
+            pool.submit( arrays, file_format, filepath, options)
+            jobs.append(( arrays, file_format, filepath))
+    assert pool.join() == []
+
+    for arrays, file_format, filepath in jobs:
+        expected_path = filepath + ".expected"
+        mesh_encoder.write_mesh_file( arrays, file_format, expected_path, options)
+        assert read( filepath) == read( expected_path)
+    # The buffer files are removed with the workers.
+    assert pool._directory is None
+
+def test_parallel_failures_are_reported( tmpdir, mesh_arrays):
+    pool = mesh_pool.MeshEncoderPool( 2, sys.executable)
+    filepath = str( tmpdir.join( "missing", "mesh.obj"))
+    pool.submit( mesh_arrays(), 'obj', filepath)
+    pool.submit( mesh_arrays(), 'obj', str( tmpdir.join( "mesh.obj")))
+    failures = pool.join()
+    assert [path for path, exception in failures] == [filepath]
+    assert os.path.exists( str( tmpdir.join( "mesh.obj")))
+
+def test_serial_without_interpreter( tmpdir, mesh_arrays):
+    pool = mesh_pool.MeshEncoderPool( 4, None)
+    assert not pool.parallel
+    filepath = str( tmpdir.join( "mesh.obj"))
+    pool.submit( mesh_arrays(), 'obj', filepath)
+    assert pool.join() == []
+    assert os.path.exists( filepath)
+
+def test_serial_when_workers_cannot_start( tmpdir, mesh_arrays):
+    pool = mesh_pool.MeshEncoderPool( 2, str( tmpdir.join( "no_python")))
+    filepath = str( tmpdir.join( "mesh.obj"))
+    pool.submit( mesh_arrays(), 'obj', filepath)
+    assert not pool.parallel
+    assert pool.join() == []
+    assert os.path.exists( filepath)
@@ -0,0 +1,87 @@
+import io
+import os
+from render_appleseed import project_index
+from render_appleseed import scene_ir
+from render_appleseed import scene_serializer
+from render_appleseed import xml_emitter
+
+Scope = ( "project", "configurations")
+
+def configuration( name, passes):
+    return scene_ir.Configuration( name, "base_" + name, [( "passes", passes), ( "ünïcode", "välue")], [])
+
+def write_project( path, passes):
+    with open( path, "wb") as output:
+        emitter = xml_emitter.XmlEmitter( output, block_lines = 2, index = True)
+        emitter.open_element( "project")
+        emitter.open_element( "configurations")
+        for name in ( "final", "interactive", "preview"):
+            scene_serializer.write( emitter, configuration( name, passes[name]))
+        emitter.close_element( "configurations")
+        emitter.close_element( "project")
+        emitter.flush()
+    project_index.save_index( path, emitter.get_index())
+
+def fragment( name, passes):
+    output = io.BytesIO()
+    emitter = xml_emitter.XmlEmitter( output, level = len( Scope))
+    scene_serializer.write( emitter, configuration( name, passes))
+    emitter.flush()
+    return output.getvalue()
+
+def read( path):
+    with open( path, "rb") as f:
+        return f.read()
+
+def test_patch_matches_a_full_write( tmpdir):
+    path = str( tmpdir.join( "project.appleseed"))
+    expected_path = str( tmpdir.join( "expected.appleseed"))
+    write_project( path, { "final": 1, "interactive": 1, "preview": 1})
+    new_passes = { "final": 1000, "interactive": 1, "preview": 22}
+    write_project( expected_path, new_passes)
+
+    index = project_index.load_index( path)
+    replacements = { ( Scope, "configuration", name): fragment( name, new_passes[name]) for name in ( "preview", "final")}
+    assert project_index.patch_project( path, index, replacements)
+    assert read( path) == read( expected_path)
+
+    # The index was shifted to the new file.
+    index = project_index.load_index( path)
+    assert index is not None
+    assert index.entries == project_index.load_index( expected_path).entries
+
+    # And the file can be patched again.
+    replacements = { ( Scope, "configuration", "interactive"): fragment( "interactive", 7)}
+    assert project_index.patch_project( path, index, replacements)
+    new_passes["interactive"] = 7
+    write_project( expected_path, new_passes)
+    assert read( path) == read( expected_path)
+
+def test_unknown_entities_leave_the_file_untouched( tmpdir):
+    path = str( tmpdir.join( "project.appleseed"))
+    write_project( path, { "final": 1, "interactive": 1, "preview": 1})
+    before = read( path)
+    index = project_index.load_index( path)
+    assert not project_index.patch_project( path, index, { ( Scope, "configuration", "missing"): b""})
+    assert read( path) == before
+
+def test_shifted_entries():
+    entries = [(( "a",), "x", "first", 1, 0, 10),
+               (( "a",), "x", "second", 1, 10, 20),
+               (( "a", "x"), "y", "nested", 2, 12, 18),
+               (( "a",), "x", "third", 1, 20, 30)]
+    spans = [( 10, 20, b"0123")]
+    assert project_index._shift_entries( entries, spans) == [(( "a",), "x", "first", 1, 0, 10),
+                                                             (( "a",), "x", "second", 1, 10, 14),
+                                                             (( "a",), "x", "third", 1, 14, 24)]
+
+def test_duplicate_keys_are_not_patched():
+    index = project_index.ProjectIndex([(( "a",), "x", "same", 1, 0, 10), (( "a",), "x", "same", 1, 10, 20)])
+    assert index.get(( "a",), "x", "same") is None
+
+def test_modified_project_has_no_index( tmpdir):
+    path = str( tmpdir.join( "project.appleseed"))
+    write_project( path, { "final": 1, "interactive": 1, "preview": 1})
+    with open( path, "ab") as project_file:
+        project_file.write( b"\n")
+    assert project_index.load_index( path) is None
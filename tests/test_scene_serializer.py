@@ -0,0 +1,60 @@
+import io
+from render_appleseed import scene_ir
+from render_appleseed import scene_serializer
+from render_appleseed import xml_emitter
+
+def serialize( nodes, index = False):
+    output = io.BytesIO()
+    emitter = xml_emitter.XmlEmitter( output, index = index)
+    scene_serializer.write_all( emitter, nodes)
+    emitter.flush()
+    return output.getvalue().decode( "utf8"), emitter
+
+def test_entity():
+    entity = scene_ir.Entity( "object", "cube", "mesh_object", [( "filename", "meshes/cube.obj")],
+                              groups = [scene_ir.ParameterGroup( "options", [( "a", 1)])])
+    text, emitter = serialize([ entity])
+    assert text == ( '<object name="cube" model="mesh_object">\n'
+                     '    <parameter name="filename" value="meshes/cube.obj" />\n'
+                     '    <parameters name="options">\n'
+                     '        <parameter name="a" value="1" />\n'
+                     '    </parameters>\n'
+                     '</object>\n')
+
+def test_object_instance_transforms():
+    rows = [( 1, 0, 0, 0), ( 0, 1, 0, 0), ( 0, 0, 1, 0), ( 0, 0, 0, 1)]
+    times = [ key / 31 for key in range( 32)]
+    instance = scene_ir.ObjectInstance( "cube.instance", "cube.part_0", [scene_ir.Transform( rows, time) for time in times],
+                                        "front", "back")
+    text, emitter = serialize([ instance])
+    lines = text.splitlines()
+    assert lines[0] == '<object_instance name="cube.instance" object="cube.part_0">'
+    assert lines[1] == '    <transform time="0">'
+    assert lines[3] == '            1 0 0 0'
+    assert lines[-3:] == [ '    <assign_material slot="0" side="front" material="front" />',
+                           '    <assign_material slot="0" side="back" material="back" />',
+                           '</object_instance>']
+    # Motion key times are written as sampled.
+    written = [ float( line.split( '"')[1]) for line in lines if line.startswith( "    <transform time=")]
+    assert written == [ float( "%.9g" % time) for time in times]
+    assert max( abs( a - b) for a, b in zip( written, times)) < 1e-9
+
+def test_look_at():
+    text, emitter = serialize([ scene_ir.LookAt(( 0, 0, 5), ( 0, 0, 0), ( 0, 1, 0))])
+    assert text == ( '<transform>\n'
+                     '    <look_at origin="0 0 5" target="0 0 0" up="0 1 0" />\n'
+                     '</transform>\n')
+
+def test_index_entries():
+    nodes = [ scene_ir.Entity( "texture", "wood", "disk_texture_2d", [( "filename", "wood.png")]),
+              scene_ir.TextureInstance( "wood_inst", "wood", [( "addressing_mode", "wrap")]),
+              scene_ir.Configuration( "final", "base_final", [( "lighting_engine", "pt")], [])]
+    text, emitter = serialize( nodes, index = True)
+    data = text.encode( "utf8")
+    entries = emitter.get_index()
+    assert [( kind, name) for scope, kind, name, level, start, end in entries] == [( "texture", "wood"),
+                                                                                   ( "texture_instance", "wood_inst"),
+                                                                                   ( "configuration", "final")]
+    for scope, kind, name, level, start, end in entries:
+        assert data[start:end].startswith(( '<%s name="%s"' % ( kind, name)).encode( "utf8"))
+        assert data[start:end].endswith(( '</%s>\n' % kind).encode( "utf8"))
@@ -0,0 +1,57 @@
+import io
+from render_appleseed import scene_ir
+from render_appleseed import scene_serializer
+from render_appleseed import xml_emitter
+
+Names = [ "plain", "café", "日本語の名前", "emoji 🎨", "ascii again"]
+
+def emit_scene( output, block_lines):
+    emitter = xml_emitter.XmlEmitter( output, block_lines = block_lines, index = True)
+    emitter.open_element( 'project format_revision="7"')
+    emitter.open_element( "scene")
+    for name in Names:
+        emitter.open_element( 'assembly name="%s"' % name)
+        scene_serializer.write( emitter, scene_ir.Entity( "object", name, "mesh_object", [( "filename", name + ".obj")]))
+        scene_serializer.write( emitter, scene_ir.ObjectInstance( name + ".inst", name, [], "mat", "mat"))
+        emitter.close_element( "assembly")
+    emitter.close_element( "scene")
+    emitter.close_element( "project")
+    emitter.flush()
+    return emitter
+
+def test_output_does_not_depend_on_blocks():
+    outputs = []
+    for block_lines in ( 1, 3, 7, 16384):
+        output = io.BytesIO()
+        emitter = emit_scene( output, block_lines)
+        outputs.append(( output.getvalue(), emitter.get_index()))
+    assert all( output == outputs[0] for output in outputs)
+
+def test_index_byte_offsets_with_non_ascii_names():
+    for block_lines in ( 1, 3, 7, 16384):
+        output = io.BytesIO()
+        entries = emit_scene( output, block_lines).get_index()
+        data = output.getvalue()
+        assert len( entries) == 2 * len( Names)
+        for scope, kind, name, level, start, end in entries:
+            assert scope == ( 'project format_revision="7"', "scene", 'assembly name="%s"' % name.replace( ".inst", ""))
+            assert level == 3
+            entity = data[start:end].decode( "utf8")
+            assert entity.startswith( "            <%s name=\"%s\"" % ( kind, name))
+            assert entity.endswith( "</%s>\n" % kind)
+
+def test_emit_lines_indents_fragments():
+    fragment = io.BytesIO()
+    emitter = xml_emitter.XmlEmitter( fragment)
+    emitter.open_element( "material")
+    emitter.emit_line( "<parameter />")
+    emitter.close_element( "material")
+    emitter.flush()
+
+    output = io.BytesIO()
+    emitter = xml_emitter.XmlEmitter( output)
+    emitter.open_element( "assembly")
+    emitter.emit_lines( fragment.getvalue().decode( "utf8"))
+    emitter.close_element( "assembly")
+    emitter.flush()
+    assert output.getvalue() == b"<assembly>\n    <material>\n        <parameter />\n    </material>\n</assembly>\n"
@@ -25,6 +25,7 @@ class AppleseedPsysPanel( bpy.types.Panel):
 
         layout.prop( asr_psys, "shape")
         layout.prop( asr_psys, "resolution")
+        layout.prop( asr_psys, "curve_points")
         layout.label( "Thickness:")
         row = layout.row()
         row.prop( asr_psys, "root_size")
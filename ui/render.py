@@ -75,10 +75,26 @@ class AppleseedRenderSettingsPanel( bpy.types.Panel, AppleseedRenderPanelBase):
         col.label( "Render Threads:")
         col = split.column()        
         col.prop( asr_scene_props, "threads")
+        layout.prop( asr_scene_props, "instancing_mode")
+        layout.prop( asr_scene_props, "skip_instance_sources")
+        if asr_scene_props.skip_instance_sources:
+            layout.label( "Particle and group sources on visible layers are not rendered in place, unlike Blender.", icon = 'INFO')
         row = layout.row()
         row.prop( asr_scene_props, "generate_mesh_files")
         if asr_scene_props.generate_mesh_files:
             row.prop( asr_scene_props, "export_mode")
+            row = layout.row()
+            row.prop( asr_scene_props, "mesh_file_format")
+            row.prop( asr_scene_props, "mesh_export_method")
+            row = layout.row()
+            row.prop( asr_scene_props, "mesh_export_processes")
+            row.prop( asr_scene_props, "mesh_chunk_size")
+            row = layout.row()
+            row.prop( asr_scene_props, "float_precision")
+            if asr_scene_props.float_precision == 'fixed':
+                row.prop( asr_scene_props, "float_digits")
+            if asr_scene_props.mesh_file_format == 'obj':
+                layout.prop( asr_scene_props, "normal_tolerance")
 #            layout.prop( asr_scene_props, "export_hair")
             
 class AppleseedSamplingPanel( bpy.types.Panel, AppleseedRenderPanelBase):
@@ -209,11 +225,15 @@ class AppleseedMotionBlurPanel( bpy.types.Panel, AppleseedRenderPanelBase):
 
         layout.prop( asr_scene_props, "ob_mblur")
         layout.prop( asr_scene_props, "def_mblur")
+        row = layout.row()
+        row.active = asr_scene_props.def_mblur
+        row.prop( asr_scene_props, "def_mblur_keys")
         layout.prop( asr_scene_props, "cam_mblur")
 
         row = layout.row( align = True)
         row.prop( asr_scene_props, "shutter_open")
         row.prop( asr_scene_props, "shutter_close")
+        layout.prop( asr_scene_props, "mblur_samples")
 
 def register():
     bpy.utils.register_class( AppleseedRenderButtons)
@@ -33,7 +33,9 @@ from extensions_framework import util as efutil
 from shutil import copyfile
 from math import tan, atan, degrees
 import mathutils
+import numpy as np
 from . import bl_info
+from . import instance_encoder
 
 #------------------------------------
 # Generic utilities and settings.
@@ -185,52 +187,72 @@ def get_all_duplis( scene ):
     return obs
 
 
-def get_instances(obj_parent, scene):
+def is_group_instance( ob):
     '''
-    Get the instanced objects on the parent object (dupli-faces / dupli-verts).
-    If motion blur is not enabled, returns list of lists [ [dupli_object.object, dupli matrix]]
-    If motion blur is enabled, returns a nested list: [ [dupli_object.object, [dupli matrices]]]
+    True if the object places a dupli group.
     '''
-    dupli_list = []
-    if ob_mblur_enabled( obj_parent, scene):
-        dupli_list = sample_mblur( obj_parent, scene, dupli = True)
-    else:
-        obj_parent.dupli_list_create( scene)
-        for dupli in obj_parent.dupli_list :
-            dupli_matrix = dupli.matrix.copy() 
-            dupli_list.append( [ dupli.object, dupli_matrix])
-        obj_parent.dupli_list_clear()
-    return dupli_list
-
-
-def sample_mblur( ob, scene, dupli = False):
+    return ob.dupli_type == 'GROUP' and ob.dupli_group is not None and not ob.hide_render
+
+
+def do_export_group_instance( ob, scene):
     '''
-    Sample motion blur matrices for the object or duplis.
-    Returns a list of matrices, if an object only.
-    Returns a nested list of [ [dupli_object.object, [dupli matrix 1, dupli matrix 2]]]
+    True if the object places a dupli group that is rendered: an empty, or an object that would be exported itself.
     '''
-    matrices = []
-    asr_scn = scene.appleseed
-    frame_orig = scene.frame_current
-    frame_set = scene.frame_set
-
-    # Collect matrices at shutter open.
-    frame_set( frame_orig, subframe = asr_scn.shutter_open)
-    ob.dupli_list_create( scene)
-    for dupli in ob.dupli_list:
-        matrices.append( [dupli.object, [dupli.matrix.copy(),]])
-    ob.dupli_list_clear()
-
-    # Advance to shutter close, collect matrices.
-    frame_set( frame_orig, subframe = asr_scn.shutter_close)
-    ob.dupli_list_create( scene)
-    for m in range( 0, len(ob.dupli_list)):
-        matrices[m][1].append( ob.dupli_list[m].matrix.copy())
-    ob.dupli_list_clear()
-    
-    # Reset timeline and return.
-    frame_set( frame_orig)
-    return matrices
+    return is_group_instance( ob) and ( ob.type == 'EMPTY' or do_export( ob, scene)) and inscenelayer( ob, scene)
+
+
+class DupliCache( object):
+    '''
+    Dupli objects and matrices of dupli parents and particle emitters, per object and time sample,
+    so that the dupli list of an object is created only once per export and time sample.
+    '''
+    def __init__( self):
+        # (object name, settings, frame, subframe) -> ([dupli objects], (N, 4, 4) float32 matrices)
+        self.__duplis = {}
+
+    def get( self, ob, scene, settings = 'VIEWPORT'):
+        '''
+        Return the dupli objects of ob and their matrices at the current time.
+        '''
+        key = ( ob.name, settings, scene.frame_current, scene.frame_subframe)
+        duplis = self.__duplis.get( key)
+        if duplis is None:
+            ob.dupli_list_create( scene, settings)
+            dupli_list = ob.dupli_list
+            count = len( dupli_list)
+            matrices = np.empty( count * 16, dtype = np.float32)
+            dupli_list.foreach_get( "matrix", matrices)
+            # Matrices are read column by column.
+            duplis = ( [dupli.object for dupli in dupli_list], matrices.reshape( count, 4, 4).transpose( 0, 2, 1))
+            ob.dupli_list_clear()
+            self.__duplis[key] = duplis
+        return duplis
+
+    def release( self, ob):
+        '''
+        Forget the duplis of ob, once it is emitted.
+        '''
+        for key in [key for key in self.__duplis if key[0] == ob.name]:
+            del self.__duplis[key]
+
+
+def get_duplis( ob, scene, settings = 'VIEWPORT', dupli_cache = None):
+    '''
+    Return a list of [dupli.object, dupli matrix] pairs.
+    '''
+    if dupli_cache is None:
+        dupli_cache = DupliCache()
+    objects, matrices = dupli_cache.get( ob, scene, settings)
+    return [[dupli_object, mathutils.Matrix( matrix)] for dupli_object, matrix in zip( objects, matrices.tolist())]
+
+
+def get_instances(obj_parent, scene, dupli_cache = None):
+    '''
+    Get the instanced objects on the parent object (dupli-faces / dupli-verts).
+    Returns a list of lists [ [dupli_object.object, dupli matrix]]
+    Dupli objects with object motion blur are sampled by sample_motion.
+    '''
+    return get_duplis( obj_parent, scene, dupli_cache = dupli_cache)
 
 
 #------------------------------------
@@ -286,135 +308,198 @@ def get_all_psysobs():
             obs.update( {ob for ob in settings.dupli_group.objects})
     return obs
 
-    
-def get_psys_instances(ob, scene):
-    ''' 
-    Return a dictionary of 
-    particle: [dupli.object, [matrices]] 
-    pairs. This function assumes particle systems and 
-    face / verts duplication aren't being used on the same object.
+
+def get_instance_sources( scene):
+    '''
+    Return the names of the objects that are rendered as the particles of an exported emitter
+    or as members of a dupli group placed in the scene, and not on their own.
     '''
-    all_duplis = {}
-    current_total = 0
-    index = 0
-    if not hasattr(ob, 'modifiers'):
-        return {}
-    if not ob_mblur_enabled( ob, scene):   
-        # If no motion blur
-        ob.dupli_list_create(scene, settings = 'RENDER')
+    sources = set()
+    groups = []
+    for ob in scene.objects:
+        if is_group_instance( ob) and inscenelayer( ob, scene):
+            groups.append( ob.dupli_group)
+        elif do_export( ob, scene) and ob.type != 'LAMP':
+            for modifier in ob.modifiers:
+                if modifier.type == 'PARTICLE_SYSTEM' and modifier.show_render:
+                    settings = modifier.particle_system.settings
+                    if settings.render_type == 'OBJECT' and settings.dupli_object is not None:
+                        sources.add( settings.dupli_object.name)
+                    elif settings.render_type == 'GROUP' and settings.dupli_group is not None:
+                        groups.append( settings.dupli_group)
+
+    # Members of nested dupli groups are sources too.
+    visited = set()
+    while groups:
+        group = groups.pop()
+        if group.name in visited:
+            continue
+        visited.add( group.name)
+        for ob in group.objects:
+            sources.add( ob.name)
+            if is_group_instance( ob):
+                groups.append( ob.dupli_group)
+    return sources
+
+
+#------------------------------------
+# Motion blur sampling.
+#------------------------------------
+class MotionSnapshot( object):
+    '''
+    Transformations sampled at evenly spaced motion keys, from shutter open to shutter close.
+    Every list of matrices holds one matrix per motion key.
+    '''
+    def __init__( self):
+        # Motion key times, from 0 (shutter open) to 1 (shutter close).
+        self.times = []
+        # Object name -> [matrix_world at each key].
+        self.matrices = {}
+        # Dupli parent name -> [ [dupli.object, [dupli matrices]]]
+        self.duplis = {}
+        # Particle emitter name -> [ [dupli.object, (keys, 4, 4) transform rows in appleseed's coordinate system]]
+        self.particles = {}
+        # [ (origin, forward, up, target) at each key]
+        self.camera = []
+
+
+def sample_motion( scene, global_matrix, at_shutter_close = None, dupli_cache = None):
+    '''
+    Sample the camera and every object with object motion blur at mblur_samples evenly spaced
+    motion keys, stepping the timeline once per key for all objects together.
+    at_shutter_close is called while the scene is evaluated at shutter close.
+    The scene is left at shutter open.
+    '''
+    if dupli_cache is None:
+        dupli_cache = DupliCache()
+    asr_scn = scene.appleseed
+    frame = scene.frame_current
+    objects = [ob for ob in scene.objects if ( ( do_export( ob, scene) and ob.type != 'LAMP') or do_export_group_instance( ob, scene))
+               and ob_mblur_enabled( ob, scene)]
+
+    snapshot = MotionSnapshot()
+    keys = max( 2, asr_scn.mblur_samples)
+    snapshot.times = [key / (keys - 1) for key in range( keys)]
+    shutter_length = asr_scn.shutter_close - asr_scn.shutter_open
+
+    # Step backwards from shutter close, so the scene is left at shutter open.
+    samples = []
+    for time in reversed( snapshot.times):
+        scene.frame_set( frame, subframe = asr_scn.shutter_open + shutter_length * time)
+        if at_shutter_close is not None and not samples:
+            at_shutter_close()
+        samples.insert( 0, capture_motion( scene, objects, global_matrix, dupli_cache))
+
+    if asr_scn.cam_mblur and scene.camera is not None:
+        snapshot.camera = [sample[0] for sample in samples]
+    for ob in objects:
+        name = ob.name
+        snapshot.matrices[name] = [sample[1][name] for sample in samples]
+        if name in samples[0][2]:
+            snapshot.duplis[name] = [[duplis[0][0], [dupli[1] for dupli in duplis]] for duplis in zip( *[sample[2][name] for sample in samples])]
+        if name in samples[0][3]:
+            snapshot.particles[name] = combine_particles( [sample[3][name] for sample in samples], global_matrix)
+        dupli_cache.release( ob)
+    return snapshot
+
+
+def capture_motion( scene, objects, global_matrix, dupli_cache):
+    '''
+    Capture the camera, object, dupli and particle transformations at the current time.
+    Returns (camera, {name: matrix}, {name: duplis}, {name: particles}).
+    '''
+    camera = None
+    if scene.appleseed.cam_mblur and scene.camera is not None:
+        camera = get_camera_matrix( scene.camera, global_matrix)
+    matrices = {}
+    duplis = {}
+    particles = {}
+    for ob in objects:
+        matrices[ob.name] = ob.matrix_world.copy()
+        if ob.is_duplicator and ob.dupli_type in {'VERTS', 'FACES'}:
+            duplis[ob.name] = get_duplis( ob, scene, dupli_cache = dupli_cache)
+        elif is_psys_emitter( ob):
+            particles[ob.name] = capture_particles( ob, scene, dupli_cache)
+    return camera, matrices, duplis, particles
+
+
+def capture_particles( ob, scene, dupli_cache):
+    '''
+    Capture the render duplis of an emitter and the state of its object / group particle systems.
+    Returns (duplis, [(particle system type, particle count, states)]), see get_particle_states.
+    Hair particle systems do not store particle states: their duplis hold the matrices.
+    '''
+    systems = []
     for modifier in ob.modifiers:
         if modifier.type == 'PARTICLE_SYSTEM' and modifier.show_render:
             psys = modifier.particle_system
             if not psys.settings.render_type in {'OBJECT', 'GROUP'}:
                 continue
+            states = None
             if psys.settings.type == 'EMITTER':
-                particles = [p for p in psys.particles if p.alive_state == 'ALIVE']
-            else:
-                particles = [p for p in psys.particles]
-            start = current_total
-            current_total += len( particles)
-            
-            if not ob_mblur_enabled( ob, scene):   
-                # No motion blur.
-                duplis = []
-                for dupli_index in range( start, current_total):
-                    # Store the dupli.objects for the current particle system only
-                    # ob.dupli_list is created in descending order of particle systems
-                    # So it should be reliable to match them this way.
-                    duplis.append( ob.dupli_list[dupli_index].object)
-                    
-                if psys.settings.type == 'EMITTER':
-                    p_duplis_pairs = list( zip( particles, duplis))     # Match the particles to the duplis
-                    dupli_dict = {p[0]:[ p[1], []] for p in p_duplis_pairs}  # Create particle:[dupli.object, [matrix]] pairs
-                    for particle in dupli_dict.keys():
-                        size = particle.size
-                        loc = particle.location
-                        scale = dupli_dict[particle][0].scale * size
-                        transl = mathutils.Matrix.Translation(( loc))
-                        scale = mathutils.Matrix.Scale(scale.x, 4, (1,0,0)) * mathutils.Matrix.Scale(scale.y, 4, (0,1,0)) * mathutils.Matrix.Scale(scale.z, 4, (0,0,1))
-                        mat = transl * scale
-                        dupli_dict[particle][1].append(mat)
-                else:
-                    dupli_mat_list = [ dupli.matrix.copy() for dupli in ob.dupli_list]
-                    p_duplis_pairs = list( zip( particles, duplis, dupli_mat_list))
-                    dupli_dict = {p[0]:[ p[1], [p[2]]] for p in p_duplis_pairs}
-            else:
-                # Using motion blur       
-                dupli_dict, index = sample_psys_mblur( ob, scene, psys, index, start, current_total)
-                     
-            # Add current particle system to the collection.
-            all_duplis.update( dupli_dict)  
-            
-    if not ob_mblur_enabled( ob, scene):   
-        # If no motion blur
-        ob.dupli_list_clear()               
-    return all_duplis
+                states = get_particle_states( psys)
+            systems.append( ( psys.settings.type, len( psys.particles), states))
+    return get_duplis( ob, scene, 'RENDER', dupli_cache), systems
 
-    
-def sample_psys_mblur( ob, scene, psys, index, start, current_total):
+
+def get_particle_states( psys):
     '''
-    Return a dictionary of 
-    particle: [dupli.object, [matrices]] 
-    pairs
+    Read the particles of a particle system in bulk.
+    Returns (alive (N,) bool, locations (N, 3), rotations (N, 4) quaternions, sizes (N,)).
     '''
-    asr_scn = scene.appleseed
-    dupli_dict = {}
-    frame_orig = scene.frame_current
-    frame_set = scene.frame_set
-    
-    frame_set( frame_orig, subframe = asr_scn.shutter_open)
-    if psys.settings.type == 'EMITTER':
-        particles = [p for p in psys.particles if p.alive_state == 'ALIVE']
-    else: 
-        particles = [p for p in psys.particles]
-    if len(particles) == 0:
-        return False
-
-    if psys.settings.type == 'EMITTER':
-        # Emitter particle system.
-        ob.dupli_list_create( scene, 'RENDER')
-        duplis = [dupli.object for dupli in ob.dupli_list]
-        p_duplis_pairs = list( zip( particles, duplis))
-        dupli_dict = {p[0]:[ p[1], []] for p in p_duplis_pairs}
-        new_index = index
-        for frame in {asr_scn.shutter_open, asr_scn.shutter_close}:
-            new_index = index
-            frame_set( frame_orig, subframe = frame)
-            for particle in dupli_dict.keys():
-                size = particle.size 
-                transl = particle.location
-                scale = dupli_dict[particle][0].scale * size
-                transl = mathutils.Matrix.Translation(( transl))
-                scale = mathutils.Matrix.Scale(scale.x, 4, (1,0,0)) * mathutils.Matrix.Scale(scale.y, 4, (0,1,0)) * mathutils.Matrix.Scale(scale.z, 4, (0,0,1))
-                mat = transl * scale
-                dupli_dict[particle][1].append(mat)
-                new_index += 1
-        index += new_index
-    else:
-        # Hair particle system.
-        duplis = []
-        ob.dupli_list_create( scene, 'RENDER')
-        for dupli_index in range( start, current_total):
-            duplis.append( ob.dupli_list[dupli_index].object)
-        p_duplis_pairs = list( zip( particles, duplis))
-        dupli_dict = {p[0]:[ p[1], []] for p in p_duplis_pairs}
-        ob.dupli_list_clear()
-        new_index = index
-        for frame in {asr_scn.shutter_open, asr_scn.shutter_close}:
-            new_index = index
-            frame_set( frame_orig, subframe = frame)
-            ob.dupli_list_create( scene, 'RENDER')
-            for particle in dupli_dict.keys():
-                mat = ob.dupli_list[new_index].matrix.copy()
-                dupli_dict[particle][1].append(mat)
-                new_index += 1
-            ob.dupli_list_clear()
-        index += new_index
-        
-    # Clean up and return
-    if psys.settings.type == 'EMITTER':
-        del scale, transl, mat
-        ob.dupli_list_clear()
-    frame_set( frame_orig)
-    return dupli_dict, index
+    particles = psys.particles
+    count = len( particles)
+    locations = np.empty( count * 3, dtype = np.float32)
+    rotations = np.empty( count * 4, dtype = np.float32)
+    sizes = np.empty( count, dtype = np.float32)
+    particles.foreach_get( "location", locations)
+    particles.foreach_get( "rotation", rotations)
+    particles.foreach_get( "size", sizes)
+    # Enum properties cannot be read with foreach_get.
+    alive = np.array( [p.alive_state == 'ALIVE' for p in particles], dtype = bool)
+    return alive, locations.reshape( count, 3), rotations.reshape( count, 4), sizes
+
+
+def combine_particles( samples, global_matrix):
+    '''
+    Match the particles captured at each motion key.
+    Returns a list of [dupli.object, rows] for the particles alive at shutter open, rows being the
+    (keys, 4, 4) rows of the transforms of the particle, converted with the global matrix in one batch per particle system.
+    '''
+    open_duplis, open_systems = samples[0]
+    instances = []
+    # ob.dupli_list is created in order of particle systems, so each system owns a slice of it.
+    # The slices can differ between motion keys, as particles are born or die.
+    starts = [0] * len( samples)
+    for system_index, open_system in enumerate( open_systems):
+        psys_type, count, open_states = open_system
+        if psys_type == 'EMITTER':
+            alive = np.flatnonzero( open_states[0])
+            dupli_objs = [dupli[0] for dupli in open_duplis[starts[0]:starts[0] + len( alive)]]
+            dupli_scales = np.array( [tuple( dupli_obj.scale) for dupli_obj in dupli_objs], dtype = np.float64).reshape( -1, 3)
+            # One (N, 4, 4) batch of particle matrices per motion key.
+            key_matrices = []
+            for key, sample in enumerate( samples):
+                key_alive, locations, rotations, sizes = sample[1][system_index][2]
+                key_matrices.append( instance_encoder.compose_particle_matrices( locations[alive], rotations[alive], dupli_scales * sizes[alive, None]))
+                starts[key] += int( np.count_nonzero( key_alive))
+            rows = instance_encoder.get_instance_rows( global_matrix, np.stack( key_matrices, axis = 1))
+            for index, dupli_obj in enumerate( dupli_objs):
+                instances.append( [dupli_obj, rows[index]])
+        else:
+            dupli_objs = []
+            matrices = []
+            for offset in range( count):
+                dupli_objs.append( open_duplis[starts[0] + offset][0])
+                for key, sample in enumerate( samples):
+                    duplis = sample[0]
+                    dupli_index = starts[key] + offset
+                    matrices.append( duplis[dupli_index][1] if dupli_index < len( duplis) else matrices[-1])
+            if count:
+                rows = instance_encoder.swap_axes( instance_encoder.get_instance_matrices( global_matrix, matrices)).reshape( count, len( samples), 4, 4)
+                for index, dupli_obj in enumerate( dupli_objs):
+                    instances.append( [dupli_obj, rows[index]])
+            starts = [start + count for start in starts]
+    return instances
+
 
@@ -0,0 +1,176 @@
+#
+# This source file is part of appleseed.
+# Visit http://appleseedhq.net/ for additional information and resources.
+#
+# This software is released under the MIT license.
+#
+# Copyright (c) 2013 Franz Beaune, Joel Daniels, Esteban Tovagliari.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+
+#
+# Buffered XML text output for the project file writer.
+#
+# Lines are collected in memory with cached indentation strings and written
+# to the file in large blocks, instead of two file writes per line.
+#
+# Optionally, the emitter records the byte range of entities in the file, so
+# that they can be replaced later without writing the whole file again (see
+# project_index).
+#
+
+#--------------------------------------------------------------------------------------------------
+# Emitter.
+#--------------------------------------------------------------------------------------------------
+
+class XmlEmitter( object):
+    '''
+    Indented XML text writer that buffers its output and writes it to a binary file
+    in UTF-8 blocks. If index is set, add_entry() records the byte ranges of entities.
+    '''
+    IndentSize = 4
+
+    def __init__( self, output_file, block_lines = 16384, level = 0, index = False):
+        self.__file = output_file
+        self.__block_lines = block_lines
+        self.__fragments = []
+        self.__level = level
+        # Indentation string of each level, grown as elements nest deeper.
+        self.__indents = [" " * ( i * self.IndentSize) for i in range( level + 1)]
+        self.__indent = self.__indents[level]
+        # Elements currently open, outermost first.
+        self.__scopes = []
+
+        # Bytes written to the file and fragments flushed so far.
+        self.__offset = 0
+        self.__base = 0
+
+        # Fragment positions of the marks, and the byte offsets of those already flushed.
+        self.__positions = []
+        self.__offsets = []
+        # Recorded entities: ( scope, kind, name, level, start mark, end mark).
+        self.__entries = [] if index else None
+
+    def open_element( self, name):
+        self.__fragments.append( self.__indent + "<" + name + ">\n")
+        self.__scopes.append( name)
+        level = self.__level = self.__level + 1
+        if level == len( self.__indents):
+            self.__indents.append( " " * ( level * self.IndentSize))
+        self.__indent = self.__indents[level]
+
+    def close_element( self, name):
+        assert self.__level > 0
+        self.__scopes.pop()
+        self.__level -= 1
+        self.__indent = self.__indents[self.__level]
+        fragments = self.__fragments
+        fragments.append( self.__indent + "</" + name + ">\n")
+        # Lines are only counted when an element closes, which keeps emit_line() to a single append.
+        if len( fragments) >= self.__block_lines:
+            self.flush()
+
+    def emit_line( self, line):
+        self.__fragments.append( self.__indent + line + "\n")
+
+    def emit_lines( self, text):
+        '''
+        Emit text written by another emitter at level 0, indented at the current level.
+        '''
+        indent = self.__indent
+        fragments = self.__fragments
+        fragments.extend( indent + line + "\n" for line in text.splitlines())
+        if len( fragments) >= self.__block_lines:
+            self.flush()
+
+    def write( self, text):
+        '''
+        Write text as is, after the lines already emitted.
+        '''
+        fragments = self.__fragments
+        fragments.append( text)
+        if len( fragments) >= self.__block_lines:
+            self.flush()
+
+    def flush( self):
+        '''
+        Write the buffered text to the file.
+        '''
+        text = "".join( self.__fragments)
+        data = text.encode( "utf8")
+        if len( self.__offsets) < len( self.__positions):
+            self.__resolve_marks( text, data)
+        if data:
+            self.__file.write( data)
+            self.__offset += len( data)
+        self.__base += len( self.__fragments)
+        self.__fragments = []
+
+    #----------------------------------------------------------------------------------------------
+    # Entity index.
+    #----------------------------------------------------------------------------------------------
+
+    def begin_entry( self):
+        '''
+        Return a mark at the start of an entity about to be emitted, None if not indexing.
+        '''
+        if self.__entries is None:
+            return None
+        return self.__mark()
+
+    def add_entry( self, kind, name, start):
+        '''
+        Record the entity emitted since begin_entry() returned start.
+        '''
+        if start is not None:
+            self.__entries.append( ( tuple( self.__scopes), kind, name, self.__level, start, self.__mark()))
+
+    def get_index( self):
+        '''
+        Return the recorded entities as ( scope, kind, name, level, start, end) tuples,
+        with start and end the byte range of the entity in the file. Call after flush().
+        '''
+        assert not self.__fragments
+        offsets = self.__offsets
+        return [( scope, kind, name, level, offsets[start], offsets[end]) for scope, kind, name, level, start, end in self.__entries]
+
+    def __mark( self):
+        self.__positions.append( self.__base + len( self.__fragments))
+        return len( self.__positions) - 1
+
+    def __resolve_marks( self, text, data):
+        # Byte offsets of the marks in this block. Characters and bytes only differ
+        # when the block has non-ASCII characters.
+        fragments = self.__fragments
+        is_ascii = len( data) == len( text)
+        fragment = 0
+        char_offset = 0
+        byte_offset = 0
+        for position in self.__positions[len( self.__offsets):]:
+            end = position - self.__base
+            char_end = char_offset + sum( map( len, fragments[fragment:end]))
+            if is_ascii:
+                byte_offset = char_end
+            else:
+                byte_offset += len( text[char_offset:char_end].encode( "utf8"))
+            self.__offsets.append( self.__offset + byte_offset)
+            fragment = end
+            char_offset = char_end